@@ -0,0 +1,44 @@
+class AnnotationRenderer():
+    """
+    Draw a list of annotation layers onto every frame in a single pass.
+
+    A layer is any callable layer(frame, frame_num) that draws onto frame in
+    place, or a (name, layer) pair. Layers are drawn in list order, so later
+    layers end up on top. With a StageProfiler, every layer is timed per
+    frame as the stage draw/<name>.
+    """
+    def __init__(self,layers=None,profiler=None):
+        self.profiler = profiler
+        self.layers = []
+        for layer in layers or []:
+            if isinstance(layer,tuple):
+                self.add_layer(layer[1],layer[0])
+            else:
+                self.add_layer(layer)
+
+    def add_layer(self,layer,name=None):
+        if self.profiler is not None:
+            layer = self.profiler.timed(f"draw/{name or getattr(layer,'__name__','layer')}",layer)
+        self.layers.append(layer)
+
+    def render_frame(self,frame,frame_num):
+        """
+        Draw every layer onto frame in place and return it
+        """
+        for layer in self.layers:
+            layer(frame,frame_num)
+        return frame
+
+    def render(self,frames,copy=False):
+        """
+        Render a list or stream of frames
+        Args:
+            frames: Iterable of frames
+            copy: Draw onto copies instead of the input frames
+        Yields:
+            Annotated frames
+        """
+        for frame_num,frame in enumerate(frames):
+            if copy:
+                frame = frame.copy()
+            yield self.render_frame(frame,frame_num)
@@ -0,0 +1 @@
+from .batch_runner import BatchRunner
\ No newline at end of file
@@ -0,0 +1,317 @@
+import os
+import sys
+import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor,as_completed
+from concurrent.futures.process import BrokenProcessPool
+try:
+    import resource
+except ImportError:  # Not available on Windows, peak memory is not reported
+    resource = None
+sys.path.append('../')
+from trackers import Tracker
+from trackers.model_export import export_model
+
+VIDEO_EXTENSIONS = ('.mp4','.avi','.mov','.mkv')
+
+# Tracker of the worker process, the model is loaded once per worker
+_worker_tracker = None
+
+def _init_worker(model_path,tracker_options):
+    global _worker_tracker
+    _worker_tracker = Tracker(model_path,**tracker_options)
+
+def _peak_rss_mb(pid):
+    """
+    Returns:
+        Peak resident memory of the process pid so far in MB (VmHWM, so
+        spikes between two polls are not missed), None if it can't be read
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])/1024
+    except (OSError,ValueError,IndexError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    try:
+        memory_info = psutil.Process(pid).memory_info()
+    except psutil.Error:
+        return None
+    # peak_wset on Windows, the current RSS elsewhere
+    return getattr(memory_info,'peak_wset',memory_info.rss)/(1024*1024)
+
+def _process_job(process_fn,job,model_path,process_kwargs):
+    start = time.perf_counter()
+    num_frames = process_fn(
+        job['input'],
+        job['output'],
+        model_path=model_path,
+        tracker=_worker_tracker,
+        calibration_dir=job['calibration_dir'],
+        **process_kwargs
+    )
+    result = {'frames':int(num_frames or 0),'seconds':time.perf_counter()-start}
+    if resource is not None:
+        # Peak resident memory of this process (kB on Linux)
+        result['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+    return result
+
+def _job_process(connection,process_fn,job,model_path,process_kwargs):
+    # Child process of a job with a memory limit, sends back the result or
+    # the error of the job
+    try:
+        message = ('done',_process_job(process_fn,job,model_path,process_kwargs))
+    except Exception as e:
+        message = ('failed',e)
+    try:
+        connection.send(message)
+    except Exception:
+        # The error can't be pickled
+        connection.send(('failed',RuntimeError(repr(message[1]))))
+    connection.close()
+
+def _run_job_with_memory_limit(process_fn,job,model_path,memory_limit_mb,process_kwargs,interval=0.1):
+    """
+    Run the job in a child process forked from the worker, so it shares the
+    worker's Tracker, and kill the child once its peak resident memory goes
+    over memory_limit_mb. Killing the process stops the job wherever it is,
+    inside native code too.
+    Raises:
+        MemoryError: The job went over its memory limit
+        RuntimeError: The job process died without a result
+    """
+    context = multiprocessing.get_context('fork')
+    receiver,sender = context.Pipe(duplex=False)
+    # The worker only loads the model, inference runs in the children, so
+    # no thread pool of the worker is forked mid-use
+    child = context.Process(target=_job_process,args=(sender,process_fn,job,model_path,process_kwargs))
+    child.start()
+    sender.close()
+
+    message = None
+    peak_mb = 0.0
+    try:
+        while True:
+            has_message = receiver.poll(interval)
+            rss_mb = _peak_rss_mb(child.pid)
+            if rss_mb is not None:
+                peak_mb = max(peak_mb,rss_mb)
+            if peak_mb > memory_limit_mb:
+                child.kill()
+                break
+            if has_message:
+                message = receiver.recv()
+                break
+            if not child.is_alive():
+                break
+    except EOFError:
+        # The child exited without sending anything
+        pass
+    finally:
+        receiver.close()
+        child.join()
+
+    if message is not None and message[0] == 'done':
+        # Spikes after the last poll, as measured by the job itself
+        peak_mb = max(peak_mb,message[1].get('max_rss_mb',0.0))
+    if peak_mb > memory_limit_mb:
+        raise MemoryError(f"Job used {peak_mb:.0f} MB, over its memory limit of {memory_limit_mb} MB")
+    if message is None:
+        raise RuntimeError(f"Job process died with exit code {child.exitcode}")
+    if message[0] == 'failed':
+        raise message[1]
+    message[1]['max_rss_mb'] = peak_mb
+    return message[1]
+
+def _run_job(process_fn,job,model_path,memory_limit_mb,process_kwargs):
+    """
+    Process one video in a worker, with the worker's Tracker. With
+    memory_limit_mb, the job runs in its own process and fails with a
+    MemoryError when the resident memory of that process (model included)
+    goes over it
+    """
+    if memory_limit_mb:
+        if 'fork' not in multiprocessing.get_all_start_methods() or _peak_rss_mb(os.getpid()) is None:
+            print("Batch: job processes can't be forked or measured on this platform, the memory limit is not enforced")
+        else:
+            return _run_job_with_memory_limit(process_fn,job,model_path,memory_limit_mb,process_kwargs)
+    return _process_job(process_fn,job,model_path,process_kwargs)
+
+class BatchRunner():
+    """
+    Process a whole matchday of clips over a pool of worker processes.
+
+    Every worker loads the YOLO model once (one Tracker per worker) and reuses
+    it for all the clips it handles. The state of every job is kept in a JSON
+    status file next to the outputs, written after each job, so an interrupted
+    batch resumes with the jobs that are not done yet. With a memory limit,
+    every job runs in a process forked from its worker, which is killed once
+    it goes over the limit. Failed jobs (including jobs over their memory
+    limit) are recorded with their error and retried on the next run.
+    """
+    def __init__(self,process_fn,model_path="models/best.pt",num_workers=2,memory_limit_mb=None,
+                 status_path=None,tracker_options=None,**process_kwargs):
+        """
+        Args:
+            process_fn: process_fn(input_path, output_path, model_path=...,
+                tracker=..., calibration_dir=..., **process_kwargs) processes
+                one video and returns its number of frames (main.process_video)
+            model_path: Path to the YOLO weights
+            num_workers: Number of worker processes
+            memory_limit_mb: Resident memory limit of a job's process
+                (model included), the job is killed and fails over it
+            status_path: Status and resume file, <output_dir>/batch_status.json
+                by default
+            tracker_options: Tracker arguments of the workers' trackers, e.g.
+                inference_backend and precision
+            process_kwargs: Passed on to process_fn
+        """
+        self.process_fn = process_fn
+        self.model_path = model_path
+        self.num_workers = num_workers
+        self.memory_limit_mb = memory_limit_mb
+        self.status_path = status_path
+        self.tracker_options = tracker_options or {}
+        self.process_kwargs = process_kwargs
+        self.status = {}
+
+    def find_jobs(self,input_path,output_dir):
+        """
+        Args:
+            input_path: Directory of videos, or a manifest: a text file with
+                one video path per line (# for comments) or a JSON list of
+                paths. Relative paths are relative to the manifest.
+            output_dir: Directory of the output videos
+        Returns:
+            List of {'name', 'input', 'output', 'calibration_dir'} jobs
+        """
+        if os.path.isdir(input_path):
+            video_paths = [os.path.join(input_path,name) for name in sorted(os.listdir(input_path))
+                           if name.lower().endswith(VIDEO_EXTENSIONS)]
+        else:
+            with open(input_path) as f:
+                if input_path.endswith('.json'):
+                    video_paths = json.load(f)
+                else:
+                    video_paths = [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+            manifest_dir = os.path.dirname(input_path)
+            video_paths = [os.path.join(manifest_dir,path) for path in video_paths]
+
+        jobs = []
+        names = set()
+        for video_path in video_paths:
+            name = os.path.splitext(os.path.basename(video_path))[0]
+            # Clips with the same file name in different directories
+            base_name,suffix = name,1
+            while name in names:
+                suffix += 1
+                name = f"{base_name}_{suffix}"
+            names.add(name)
+            jobs.append({
+                'name':name,
+                'input':video_path,
+                'output':os.path.join(output_dir,f"{name}.mp4"),
+                'calibration_dir':os.path.join(output_dir,f"{name}_calibration")
+            })
+        return jobs
+
+    def load_status(self,status_path):
+        if os.path.exists(status_path):
+            with open(status_path) as f:
+                return json.load(f)
+        return {}
+
+    def save_status(self,status_path):
+        tmp_path = status_path+'.tmp'
+        with open(tmp_path,'w') as f:
+            json.dump(self.status,f,indent=4)
+        os.replace(tmp_path,status_path)
+
+    def run(self,input_path,output_dir):
+        """
+        Process every video of input_path that is not done yet
+        Args:
+            input_path: Directory or manifest, see find_jobs
+            output_dir: Directory of the outputs and of the status file
+        Returns:
+            {job name: status} of every job
+        """
+        os.makedirs(output_dir,exist_ok=True)
+        status_path = self.status_path or os.path.join(output_dir,'batch_status.json')
+        self.status = self.load_status(status_path)
+
+        pending_jobs = []
+        num_done = 0
+        for job in self.find_jobs(input_path,output_dir):
+            job_status = self.status.get(job['name'],{})
+            if job_status.get('status') == 'done' and os.path.exists(job['output']):
+                num_done += 1
+                continue
+            self.status[job['name']] = {**job,'status':'pending'}
+            pending_jobs.append(job)
+        self.save_status(status_path)
+
+        print(f"Batch: {len(pending_jobs)} videos to process, {num_done} already done, {self.num_workers} workers")
+
+        start = time.perf_counter()
+        if pending_jobs:
+            # Export the model once here, not in every worker at the same time
+            export_model(
+                self.model_path,
+                self.tracker_options.get('inference_backend','pytorch'),
+                self.tracker_options.get('precision','fp32'),
+                calibration_data=self.tracker_options.get('calibration_data')
+            )
+            with ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                initializer=_init_worker,
+                initargs=(self.model_path,self.tracker_options)
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        _run_job,
+                        self.process_fn,
+                        job,
+                        self.model_path,
+                        self.memory_limit_mb,
+                        self.process_kwargs
+                    ):job
+                    for job in pending_jobs
+                }
+                for future in as_completed(futures):
+                    job_status = self.status[futures[future]['name']]
+                    try:
+                        job_status.update(future.result())
+                        job_status['status'] = 'done'
+                        job_status.pop('error',None)
+                        print(f"Batch: {job_status['name']} done, {job_status['frames']} frames "
+                              f"at {job_status['frames']/job_status['seconds']:.1f} frames/sec")
+                    except BrokenProcessPool as e:
+                        # A worker was killed (e.g. by the OOM killer), the
+                        # jobs still in the pool fail with it
+                        job_status['status'] = 'failed'
+                        job_status['error'] = f"Worker process died: {e}"
+                        print(f"Batch: {job_status['name']} failed, worker process died: {e}")
+                    except Exception as e:
+                        job_status['status'] = 'failed'
+                        job_status['error'] = repr(e)
+                        print(f"Batch: {job_status['name']} failed: {e!r}")
+                    self.save_status(status_path)
+        wall_seconds = time.perf_counter()-start
+
+        self.print_summary(pending_jobs,wall_seconds)
+        return self.status
+
+    def print_summary(self,jobs,wall_seconds):
+        finished = [self.status[job['name']] for job in jobs if self.status[job['name']]['status'] == 'done']
+        num_failed = len(jobs)-len(finished)
+        num_frames = sum(job_status['frames'] for job_status in finished)
+        fps = num_frames/wall_seconds if wall_seconds > 0 else 0.0
+        print(f"Batch: {len(finished)} done, {num_failed} failed, {num_frames} frames in {wall_seconds:.1f} s "
+              f"({fps:.1f} frames/sec across the batch)")
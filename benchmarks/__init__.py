@@ -0,0 +1,2 @@
+from .synthetic import SyntheticMatch
+from .stub_detector import StubDetector
\ No newline at end of file
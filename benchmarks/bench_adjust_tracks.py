@@ -0,0 +1,72 @@
+"""
+Benchmark for Tracker.adjust_tracks (TrackReassociator).
+
+Times player id re-association on synthetic matches of increasing length.
+The time per frame should stay flat, i.e. the total time grows linearly
+with the length of the match.
+
+Usage:
+    python benchmarks/bench_adjust_tracks.py [--method greedy|hungarian]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from trackers.track_reassociation import TrackReassociator
+
+def make_player_tracks(num_frames,num_players=22,seed=0):
+    """
+    Synthetic per-frame player dicts: players random-walk over a 1080p frame,
+    miss a detection now and then and occasionally switch to a fresh id
+    """
+    rng = np.random.default_rng(seed)
+    positions = rng.uniform([0,300],[1800,1000],(num_players,2))
+    track_ids = np.arange(1,num_players+1)
+    next_track_id = num_players+1
+
+    player_tracks = []
+    for _ in range(num_frames):
+        positions += rng.normal(0,3,positions.shape)
+        switched = rng.random(num_players) < 0.002
+        for player in np.flatnonzero(switched):
+            track_ids[player] = next_track_id
+            next_track_id += 1
+        visible = rng.random(num_players) > 0.02
+
+        frame = {}
+        for player in np.flatnonzero(visible):
+            x,y = positions[player]
+            frame[int(track_ids[player])] = {'bbox':[x,y-80,x+40,y]}
+        player_tracks.append(frame)
+    return player_tracks
+
+def check_empty_window(method):
+    """
+    Frames after a window without players (no detections at the start, a
+    cutaway longer than the window) keep their ids
+    """
+    reassociator = TrackReassociator(window_size=3,method=method)
+    player_tracks = [{},{1:{'bbox':[0,0,1,1]}},{},{},{},{},{2:{'bbox':[5,5,6,6]}},{2:{'bbox':[6,6,7,7]}}]
+    reassociator.adjust(player_tracks)
+    assert [list(frame) for frame in player_tracks] == [[],[1],[],[],[],[],[2],[2]], player_tracks
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--method',default='greedy',choices=['greedy','hungarian'])
+    parser.add_argument('--lengths',default='2500,5000,10000,20000,40000')
+    args = parser.parse_args()
+
+    check_empty_window(args.method)
+    reassociator = TrackReassociator(method=args.method)
+    print(f"{'frames':>8} {'seconds':>9} {'us/frame':>9}")
+    for num_frames in map(int,args.lengths.split(',')):
+        player_tracks = make_player_tracks(num_frames)
+        start = time.perf_counter()
+        reassociator.adjust(player_tracks)
+        elapsed = time.perf_counter()-start
+        print(f"{num_frames:>8} {elapsed:>9.3f} {elapsed/num_frames*1e6:>9.1f}")
+
+if __name__ == '__main__':
+    main()
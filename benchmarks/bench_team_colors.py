@@ -0,0 +1,125 @@
+"""
+Parity check and benchmark of the batched jersey colors
+(TeamAssinger.get_player_colors) against the per-player sklearn path
+(get_player_color).
+
+Both paths run on the same player crops of synthetic matches (ground truth
+bboxes with a margin of grass, as a detector gives them). Each path fits its
+own team model on the first frame, like assign_team_color, and predicts the
+team of every crop. The team labels must be identical. Crops whose corners
+fall in both color clusters (another player overlaps a corner) are counted
+separately, they are where the background rules could differ.
+
+Usage:
+    python benchmarks/bench_team_colors.py [--seeds 0,1,2] [--frames 120]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from sklearn.cluster import KMeans
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from team_assigner import TeamAssinger
+from benchmarks.synthetic import SyntheticMatch
+
+def get_match_crops(match,frame_step=4,margin=6):
+    """
+    Yields:
+        (frame, bboxes, teams) of every frame_step-th frame: the bboxes of the
+        players fully in the frame and their ground truth team (0 or 1)
+    """
+    tracks = match.tracks()
+    for frame_num in range(0,match.num_frames,frame_step):
+        bboxes,teams = [],[]
+        for track_id,player in tracks['players'][frame_num].items():
+            x1,y1,x2,y2 = player['bbox']
+            bbox = [x1-margin,y1-margin,x2+margin,y2+margin]
+            if bbox[0] >= 0 and bbox[1] >= 0 and bbox[2] <= match.width and bbox[3] <= match.height:
+                bboxes.append(bbox)
+                # Players alternate between the two jersey colors
+                teams.append((track_id-1)%2)
+        if bboxes:
+            yield match.render_frame(frame_num),bboxes,np.array(teams)
+
+def corners_agree(team_assigner,frame,bbox):
+    # Whether the four corners of the crop fall in one sklearn cluster
+    image = frame[int(bbox[1]):int(bbox[3]),int(bbox[0]):int(bbox[2])]
+    top_half_img = image[0:int(image.shape[0]/2),:,:]
+    labels = team_assigner.get_clustering_model(top_half_img).labels_.reshape(top_half_img.shape[:2])
+    return len({labels[0,0],labels[0,-1],labels[-1,0],labels[-1,-1]}) == 1
+
+def compare_paths(match):
+    """
+    Returns:
+        {'crops', 'mixed_corner_crops', 'mismatches', 'reference_accuracy',
+        'batched_accuracy', 'reference_seconds', 'batched_seconds'}
+    """
+    team_assigner = TeamAssinger()
+    crops = list(get_match_crops(match))
+    first_frame,first_bboxes,_ = crops[0]
+    reference_model = KMeans(n_clusters=2,init='k-means++',n_init=5,random_state=42).fit(
+        np.array([team_assigner.get_player_color(first_frame,bbox) for bbox in first_bboxes])
+    )
+    batched_model = KMeans(n_clusters=2,init='k-means++',n_init=5,random_state=42).fit(
+        team_assigner.get_player_colors(first_frame,first_bboxes)
+    )
+    # Number the batched teams like the reference ones, by their colors
+    batched_order = np.linalg.norm(
+        reference_model.cluster_centers_[:,None]-batched_model.cluster_centers_[None],axis=2
+    ).argmin(axis=1)
+    if len(set(batched_order.tolist())) != 2:
+        raise ValueError("The two paths found different team colors")
+    batched_team = np.argsort(batched_order)
+
+    reference_seconds = batched_seconds = 0.0
+    reference_labels,batched_labels,teams,mixed_corners = [],[],[],[]
+    for frame,bboxes,frame_teams in crops:
+        start = time.perf_counter()
+        reference_labels.append(reference_model.predict(
+            np.array([team_assigner.get_player_color(frame,bbox) for bbox in bboxes])
+        ))
+        reference_seconds += time.perf_counter()-start
+        start = time.perf_counter()
+        batched_labels.append(batched_team[batched_model.predict(team_assigner.get_player_colors(frame,bboxes))])
+        batched_seconds += time.perf_counter()-start
+        teams.append(frame_teams)
+        mixed_corners.append([not corners_agree(team_assigner,frame,bbox) for bbox in bboxes])
+
+    reference_labels = np.concatenate(reference_labels)
+    batched_labels = np.concatenate(batched_labels)
+    teams = np.concatenate(teams)
+    # Team ids are arbitrary, number the ground truth teams like the reference ones
+    if np.mean(reference_labels == teams) < 0.5:
+        teams = 1-teams
+    return {
+        'crops':len(teams),
+        'mixed_corner_crops':int(np.concatenate(mixed_corners).sum()),
+        'mismatches':int((reference_labels != batched_labels).sum()),
+        'reference_accuracy':float(np.mean(reference_labels == teams)),
+        'batched_accuracy':float(np.mean(batched_labels == teams)),
+        'reference_seconds':reference_seconds,
+        'batched_seconds':batched_seconds
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seeds',default='0,1,2')
+    parser.add_argument('--frames',type=int,default=120)
+    args = parser.parse_args()
+
+    print(f"{'seed':>4} {'crops':>6} {'mixed':>6} {'diff':>5} {'ref acc':>8} {'new acc':>8} {'speed-up':>9}")
+    num_mismatches = 0
+    for seed in map(int,args.seeds.split(',')):
+        result = compare_paths(SyntheticMatch(num_frames=args.frames,seed=seed))
+        print(f"{seed:>4} {result['crops']:>6} {result['mixed_corner_crops']:>6} {result['mismatches']:>5} "
+              f"{result['reference_accuracy']:>8.3f} {result['batched_accuracy']:>8.3f} "
+              f"{result['reference_seconds']/result['batched_seconds']:>8.1f}x")
+        num_mismatches += result['mismatches']
+    if num_mismatches:
+        print(f"{num_mismatches} team labels differ from the sklearn path")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,192 @@
+"""
+Throughput and parity of the CPU inference backends against the PyTorch
+model, on frames of a real video. Unlike run_benchmarks this needs
+ultralytics, the model weights and the runtime of every backend
+(onnxruntime, openvino). Run from the repository root:
+
+    python -m benchmarks.model_backends --backends onnx onnx:int8 openvino openvino:fp16
+
+Every backend is exported once (cached in models/exported), its detections
+are compared with those of the PyTorch model on the same frames (see
+check_parity), and the frames are detected through the tracker's detection
+pipeline --repeat times. The results are saved to
+<results-dir>/<time>_<commit>.json.
+"""
+import os
+import json
+import time
+import argparse
+import importlib
+import itertools
+import statistics
+from utils import iter_video_frames
+from trackers import Tracker
+from trackers.model_export import check_parity,check_backend,load_export_metadata
+from .run_benchmarks import get_environment
+
+def get_runtime_versions():
+    versions = {}
+    for name in ('ultralytics','torch','onnxruntime','openvino'):
+        try:
+            versions[name] = importlib.import_module(name).__version__
+        except ImportError:
+            versions[name] = None
+    return versions
+
+def parse_backend(spec):
+    """
+    Returns:
+        (backend, precision) of 'backend' or 'backend:precision'
+    """
+    backend,_,precision = spec.partition(':')
+    precision = precision or 'fp32'
+    check_backend(backend,precision)
+    return backend,precision
+
+def benchmark_backend(model_path,backend,precision,frames,batch_size=8,detection_workers=1,repeat=3,
+                      calibration_data=None):
+    """
+    Detect frames with one backend through the detection pipeline
+    Returns:
+        (tracker, {'backend', 'precision', 'load_seconds', 'export_seconds',
+        'median_seconds', 'min_seconds', 'fps', 'inference_fps'})
+    """
+    start = time.perf_counter()
+    tracker = Tracker(
+        model_path,
+        batch_size=batch_size,
+        detection_workers=detection_workers,
+        inference_backend=backend,
+        precision=precision,
+        calibration_data=calibration_data
+    )
+    load_seconds = time.perf_counter()-start
+    pipeline = tracker.detection_pipeline
+
+    # The first batches initialize the runtime, don't time them
+    pipeline.run(frames[:batch_size],lambda *args: None)
+    seconds,inference_fps = [],[]
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pipeline.run(frames,lambda *args: None)
+        seconds.append(time.perf_counter()-start)
+        inference_fps.append(pipeline.get_fps()['inference'])
+
+    metadata = load_export_metadata(tracker.inference_model_path) if backend != 'pytorch' else None
+    median_seconds = statistics.median(seconds)
+    return tracker,{
+        'backend':backend,
+        'precision':precision,
+        'model':tracker.inference_model_path,
+        'load_seconds':round(load_seconds,3),
+        'export_seconds':metadata['export_seconds'] if metadata else None,
+        'median_seconds':round(median_seconds,6),
+        'min_seconds':round(min(seconds),6),
+        'fps':round(len(frames)/median_seconds,2),
+        'inference_fps':round(statistics.median(inference_fps),2)
+    }
+
+def format_backend_results(results):
+    lines = [
+        f"{'backend':<20}{'fps':>10}{'inference fps':>15}{'speedup':>9}{'recall':>8}{'precision':>11}"
+        f"{'mean IoU':>10}{'parity':>8}"
+    ]
+    for result in results:
+        parity = result.get('parity')
+        line = (f"{result['backend'] + ':' + result['precision']:<20}{result['fps']:>10.1f}"
+                f"{result['inference_fps']:>15.1f}{result['speedup']:>8.2f}x")
+        if parity is not None:
+            overall = parity['overall']
+            line += (f"{overall['recall']:>8.3f}{overall['precision']:>11.3f}{overall['mean_iou']:>10.3f}"
+                     f"{'ok' if parity['passed'] else 'FAILED':>8}")
+        lines.append(line)
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the inference backends against the PyTorch model')
+    parser.add_argument('--model',default=os.path.join('models','best.pt'),help='PyTorch YOLO weights')
+    parser.add_argument('--video',default=os.path.join('input_videos','bundesliga.mp4'),help='Video to detect')
+    parser.add_argument('--frames',type=int,default=64,help='Frames timed per run')
+    parser.add_argument('--parity-frames',type=int,default=32,help='Frames of the parity check')
+    parser.add_argument('--backends',nargs='+',default=['torchscript','onnx','openvino'],
+                        help='Backends to compare with pytorch, as backend or backend:precision')
+    parser.add_argument('--batch-size',type=int,default=8,help='Frames per predict call')
+    parser.add_argument('--detection-workers',type=int,default=1,help='Inference threads')
+    parser.add_argument('--repeat',type=int,default=3,help='Timed runs of every backend, the median is reported')
+    parser.add_argument('--calibration-data',default=None,help='Dataset YAML calibrating int8 OpenVINO exports')
+    parser.add_argument('--min-recall',type=float,default=0.95,
+                        help='Recall and precision against pytorch needed to pass the parity check')
+    parser.add_argument('--results-dir',default=os.path.join('benchmarks','results','models'),
+                        help='Directory of the saved results')
+    parser.add_argument('--no-save',action='store_true',help='Do not save the results')
+    args = parser.parse_args()
+
+    backends = [('pytorch','fp32')]+[parse_backend(spec) for spec in args.backends]
+    frames = list(itertools.islice(iter_video_frames(args.video),max(args.frames,args.parity_frames)))
+    if not frames:
+        raise ValueError(f"No frames read from {args.video}")
+
+    results = []
+    reference_tracker = None
+    for backend,precision in backends:
+        print(f"Benchmarking {backend}:{precision}...")
+        tracker,result = benchmark_backend(
+            args.model,
+            backend,
+            precision,
+            frames[:args.frames],
+            batch_size=args.batch_size,
+            detection_workers=args.detection_workers,
+            repeat=args.repeat,
+            calibration_data=args.calibration_data
+        )
+        if reference_tracker is None:
+            reference_tracker = tracker
+        else:
+            result['parity'] = check_parity(
+                reference_tracker.model,
+                tracker.model,
+                frames[:args.parity_frames],
+                conf=tracker.detection_pipeline.conf,
+                imgsz=tracker.detection_pipeline.imgsz,
+                batch_size=args.batch_size,
+                min_recall=args.min_recall
+            )
+        result['speedup'] = round(result['fps']/results[0]['fps'],3) if results else 1.0
+        results.append(result)
+
+    print(format_backend_results(results))
+
+    if not args.no_save:
+        environment = get_environment()
+        environment.update(get_runtime_versions())
+        os.makedirs(args.results_dir,exist_ok=True)
+        result_path = os.path.join(
+            args.results_dir,
+            f"{time.strftime('%Y%m%d-%H%M%S')}_{environment['commit'] or 'nogit'}.json"
+        )
+        with open(result_path,'w') as f:
+            json.dump({
+                'environment':environment,
+                'config':{
+                    'model':args.model,
+                    'video':args.video,
+                    'frames':len(frames[:args.frames]),
+                    'parity_frames':len(frames[:args.parity_frames]),
+                    'batch_size':args.batch_size,
+                    'detection_workers':args.detection_workers,
+                    'repeat':args.repeat
+                },
+                'results':results
+            },f,indent=4)
+        print(f"Backend results saved to {result_path}")
+
+    failed = [f"{result['backend']}:{result['precision']}" for result in results
+              if 'parity' in result and not result['parity']['passed']]
+    if failed:
+        print(f"Parity check failed for {', '.join(failed)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
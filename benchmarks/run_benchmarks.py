@@ -0,0 +1,486 @@
+"""
+Benchmark every pipeline stage on its own, on synthetic footage and with a
+stub detector, so it runs anywhere without a GPU, model weights or input
+videos. Run from the repository root:
+
+    python -m benchmarks.run_benchmarks [--frames 240] [--repeat 3]
+
+Every stage is timed separately over --repeat runs. The tracks stages
+(adjust_tracks ... assign_ball_to_players) are also timed on the ground
+truth tracks of a long synthetic match (table/*), where they dominate. The
+results are saved to <results-dir>/<time>_<commit>.json and compared with
+the latest earlier result of the same configuration, so regressions between
+commits are visible.
+"""
+import os
+import copy
+import glob
+import itertools
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from unittest import mock
+import cv2
+import numpy as np
+import supervision as sv
+from utils import iter_video_frames,read_frame,save_video,get_video_fps,TrackTable,StageProfiler,FrameStore
+from utils import AnalyticsExporter,AnalyticsDataset
+import trackers.tracker
+from trackers import Tracker
+from trackers.sparse_detection import compare_tracks
+from team_assigner import TeamAssinger
+from player_ball_assigner import PlayerBallAssigner,BallControl
+from camera_movement_estimator import CameraMovementEstimator
+from view_transformer import ViewTransformer
+from speed_and_distance_estimator import SpeedAndDistanceEstimator
+from annotation_renderer import AnnotationRenderer
+from .synthetic import SyntheticMatch
+from .stub_detector import StubDetector
+
+def make_stub_tracker(**kwargs):
+    """
+    Tracker with StubDetector in place of the YOLO model
+    """
+    with mock.patch.object(trackers.tracker,'YOLO',StubDetector):
+        return Tracker('stub',**kwargs)
+
+def run_track_stages(tracker,camera_movement_estimator,tracks,camera_movement_per_frame,profiler,prefix=''):
+    """
+    Time the stages between tracking and annotation, in the order of
+    process_video
+    Returns:
+        (tracks, speed_distance_estimator, assigned_players, track_table)
+    """
+    num_frames = len(tracks['players'])
+    with profiler.stage(f'{prefix}adjust_tracks',frames=num_frames):
+        tracks = tracker.adjust_tracks(tracks)
+    with profiler.stage(f'{prefix}interpolate_ball_positions',frames=num_frames):
+        tracks['ball'] = tracker.interpolate_ball_positions(tracks['ball'])
+    with profiler.stage(f'{prefix}from_tracks',frames=num_frames):
+        track_table = TrackTable.from_tracks(tracks)
+    with profiler.stage(f'{prefix}add_position_to_tracks',frames=num_frames):
+        tracker.add_position_to_tracks(track_table)
+    with profiler.stage(f'{prefix}adjust_position_to_tracks',frames=num_frames):
+        camera_movement_estimator.adjust_position_to_tracks(track_table,camera_movement_per_frame)
+    with profiler.stage(f'{prefix}add_transformed_position_to_tracks',frames=num_frames):
+        ViewTransformer().add_transformed_position_to_tracks(track_table)
+    speed_distance_estimator = SpeedAndDistanceEstimator()
+    with profiler.stage(f'{prefix}add_speed_and_distance_to_tracks',frames=num_frames):
+        speed_distance_estimator.add_speed_and_distance_to_tracks(track_table)
+    with profiler.stage(f'{prefix}to_tracks',frames=num_frames):
+        tracks = track_table.to_tracks()
+    with profiler.stage(f'{prefix}assign_ball_to_players',frames=num_frames):
+        assigned_players,_ = PlayerBallAssigner().assign_ball_to_players(track_table)
+    return tracks,speed_distance_estimator,assigned_players,track_table
+
+def run_video_stages(video_path,output_path,tracker,profiler,camera_workers=None,video_backend='opencv',
+                     detection_stride=4):
+    """
+    Time every stage of process_video on a video. Frames are decoded outside
+    of the timed calls, except in read, detect_and_track (the detection
+    pipeline decodes on its own thread), detect_and_track_sparse and
+    get_camera_movement_parallel (every worker decodes its chunk).
+    frame_store_write stores the frames while decoding them,
+    frame_store_read copies every frame out of the store (as annotation
+    does) and get_camera_movement_parallel_store reads its grayscale frames.
+    analytics_export streams the annotated frames' rows to an analytics
+    export, analytics_read queries it back with a pushed-down filter.
+    save_video encodes a pool of decoded frames, so it times the encoder alone.
+    Returns:
+        {'full': tracks, 'sparse': tracks} straight from detection, and the
+        SparseDetector of the sparse run
+    """
+    num_frames = 0
+    with profiler.stage('read') as stage:
+        for _ in iter_video_frames(video_path):
+            num_frames += 1
+        stage['frames'] = num_frames
+
+    tracker.reset()
+    with profiler.stage('detect_and_track',frames=num_frames):
+        tracks = tracker.get_object_tracks(iter_video_frames(video_path))
+    for stage_name,stage_stats in tracker.detection_pipeline.stats.items():
+        profiler.add_time(f'detect/{stage_name}',stage_stats['seconds'],frames=stage_stats['frames'])
+
+    tracker.set_detection_stride(detection_stride)
+    sparse_detector = tracker.sparse_detector
+    tracker.reset()
+    with profiler.stage('detect_and_track_sparse',frames=num_frames):
+        sparse_tracks = tracker.get_object_tracks(iter_video_frames(video_path))
+    tracker.set_detection_stride(1)
+    detection_tracks = {'full':copy.deepcopy(tracks),'sparse':sparse_tracks}
+
+    first_frame = read_frame(video_path,0)
+    camera_movement_estimator = CameraMovementEstimator(first_frame)
+    camera_movement_per_frame = []
+    for frame in iter_video_frames(video_path):
+        start = time.perf_counter()
+        camera_movement_estimator.update_camera_movement(camera_movement_per_frame,[frame])
+        profiler.add_time('get_camera_movement',time.perf_counter()-start)
+    with profiler.stage('get_camera_movement_parallel',frames=num_frames):
+        CameraMovementEstimator(first_frame).get_camera_movement_parallel(video_path,num_workers=camera_workers)
+
+    frame_store = FrameStore.create(
+        os.path.join(os.path.dirname(output_path),'frame_store'),
+        first_frame.shape[1],
+        first_frame.shape[0],
+        capacity=num_frames,
+        gray_scale=camera_movement_estimator.downscale
+    )
+    try:
+        with profiler.stage('frame_store_write',frames=num_frames):
+            for _ in frame_store.tee(iter_video_frames(video_path)):
+                pass
+            frame_store.finish()
+        with profiler.stage('frame_store_read',frames=num_frames):
+            for frame in frame_store.frames():
+                frame.copy()
+        with profiler.stage('get_camera_movement_parallel_store',frames=num_frames):
+            CameraMovementEstimator(first_frame).get_camera_movement_parallel(
+                video_path,
+                num_workers=camera_workers,
+                frame_store=frame_store
+            )
+    finally:
+        frame_store.delete()
+
+    tracks,speed_distance_estimator,assigned_players,track_table = run_track_stages(
+        tracker,camera_movement_estimator,tracks,camera_movement_per_frame,profiler
+    )
+
+    team_assigner = TeamAssinger()
+    with profiler.stage('assign_team_color',frames=1):
+        team_assigner.assign_team_color(first_frame,tracks['players'][0])
+    # A second assigner with the same colors, for the one-player-at-a-time path
+    single_team_assigner = TeamAssinger()
+    single_team_assigner.assign_team_color(first_frame,tracks['players'][0])
+    team_ball_control = BallControl(fps=24)
+    analytics_exporter = AnalyticsExporter(os.path.join(os.path.dirname(output_path),'analytics','match'),fps=24)
+
+    renderer = AnnotationRenderer([
+        ('draw_distance_visualizations',speed_distance_estimator.draw_distance_visualizations),
+        ('draw_frame_tracks',lambda frame,frame_num: tracker.draw_frame_tracks(frame,frame_num,tracks)),
+        ('draw_team_ball_control',lambda frame,frame_num: tracker.draw_team_ball_control(
+            frame,
+            frame_num,
+            team_ball_control
+        )),
+        ('draw_frame_camera_movement',lambda frame,frame_num: camera_movement_estimator.draw_frame_camera_movement(
+            frame,
+            frame_num,
+            camera_movement_per_frame
+        )),
+        ('draw_frame_speed_and_distance',lambda frame,frame_num: speed_distance_estimator.draw_frame_speed_and_distance(
+            frame,
+            frame_num,
+            tracks
+        )),
+    ],profiler=profiler)
+
+    for frame_num,frame in enumerate(iter_video_frames(video_path)):
+        player_track = tracks['players'][frame_num]
+
+        start = time.perf_counter()
+        for player_id,player in player_track.items():
+            single_team_assigner.assign_player_team(frame,player_id,player['bbox'],frame_num)
+        profiler.add_time('assign_player_team',time.perf_counter()-start)
+
+        start = time.perf_counter()
+        player_teams = team_assigner.assign_players_team(frame,player_track,frame_num)
+        profiler.add_time('assign_players_team',time.perf_counter()-start)
+        for player_id,player_team_id in player_teams.items():
+            player_track[player_id]['team'] = player_team_id
+            player_track[player_id]['team_color'] = team_assigner.team_colors[player_team_id]
+
+        assigned_player = int(assigned_players[frame_num])
+        if assigned_player != -1:
+            player_track[assigned_player]['has_ball'] = True
+            team_ball_control.append(player_track[assigned_player]['team'])
+        else:
+            team_ball_control.append(team_ball_control[-1] if len(team_ball_control) else 0)
+
+        start = time.perf_counter()
+        analytics_exporter.add_frame(
+            frame_num,
+            track_table,
+            player_track,
+            ball_player=assigned_player,
+            camera_movement=camera_movement_per_frame[frame_num],
+            ball_control_team=team_ball_control[-1]
+        )
+        profiler.add_time('analytics_export',time.perf_counter()-start)
+
+        renderer.render_frame(frame,frame_num)
+
+    start = time.perf_counter()
+    analytics_exporter.close()
+    profiler.add_time('analytics_export',time.perf_counter()-start,frames=0)
+    with profiler.stage('analytics_read',frames=num_frames):
+        AnalyticsDataset(os.path.dirname(analytics_exporter.path)).read(
+            'tracks',
+            columns=['frame','track_id','field_x','field_y','speed'],
+            filters=[('object','==','players'),('frame','>=',num_frames//2)]
+        )
+
+    frame_pool = list(itertools.islice(iter_video_frames(video_path),24))
+    with profiler.stage('save_video',frames=num_frames):
+        save_video(
+            (frame_pool[frame_num%len(frame_pool)] for frame_num in range(num_frames)),
+            output_path,
+            fps=get_video_fps(video_path),
+            backend=video_backend
+        )
+    return detection_tracks,sparse_detector
+
+def get_environment():
+    def git(*args):
+        try:
+            return subprocess.run(['git',*args],capture_output=True,text=True,check=True).stdout.strip()
+        except (OSError,subprocess.CalledProcessError):
+            return None
+
+    return {
+        'commit':git('rev-parse','--short','HEAD'),
+        'dirty':bool(git('status','--porcelain','--untracked-files=no')),
+        'python':platform.python_version(),
+        'platform':platform.platform(),
+        'processor':platform.processor(),
+        'cpu_count':os.cpu_count(),
+        'numpy':np.__version__,
+        'opencv':cv2.__version__,
+        'supervision':sv.__version__
+    }
+
+def summarize(stage_runs):
+    """
+    Args:
+        stage_runs: {stage: [report row of every repeat]}
+    Returns:
+        {stage: {'frames', 'calls', 'min_seconds', 'median_seconds', 'fps'}}
+    """
+    results = {}
+    for name,rows in stage_runs.items():
+        seconds = [row['wall_seconds'] for row in rows]
+        median_seconds = statistics.median(seconds)
+        results[name] = {
+            'frames':rows[0]['frames'],
+            'calls':rows[0]['calls'],
+            'min_seconds':round(min(seconds),6),
+            'median_seconds':round(median_seconds,6),
+            'fps':round(rows[0]['frames']/median_seconds,2) if rows[0]['frames'] and median_seconds > 0 else None
+        }
+    return results
+
+def find_previous_result(results_dir,config,exclude=None):
+    """
+    Returns:
+        The latest saved result with the same config, or None
+    """
+    for path in sorted(glob.glob(os.path.join(results_dir,'*.json')),reverse=True):
+        if exclude is not None and os.path.abspath(path) == os.path.abspath(exclude):
+            continue
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except (OSError,ValueError):
+            continue
+        if result.get('config') == config:
+            result['path'] = path
+            return result
+    return None
+
+def compare_results(results,previous_results,threshold=0.1,min_seconds=0.001):
+    """
+    Returns:
+        {stage: relative change of the median} and the stages slower than
+        previous_results by more than threshold (and by at least min_seconds,
+        below which timings are noise)
+    """
+    changes = {}
+    regressions = []
+    for name,stage in results.items():
+        previous_stage = previous_results.get(name)
+        if not previous_stage or previous_stage['median_seconds'] <= 0:
+            continue
+        previous_seconds = previous_stage['median_seconds']
+        change = stage['median_seconds']/previous_seconds-1
+        changes[name] = change
+        if change > threshold and stage['median_seconds']-previous_seconds >= min_seconds:
+            regressions.append(name)
+    return changes,regressions
+
+def format_results(results,changes=None,regressions=()):
+    changes = changes or {}
+    lines = [f"{'stage':<44}{'frames':>8}{'median s':>10}{'min s':>10}{'fps':>12}{'change':>9}"]
+    for name,stage in results.items():
+        fps = '' if stage['fps'] is None else f"{stage['fps']:.1f}"
+        change = f"{changes[name]:+.1%}" if name in changes else ''
+        flag = '  REGRESSION' if name in regressions else ''
+        lines.append(
+            f"{name:<44}{stage['frames']:>8}{stage['median_seconds']:>10.4f}{stage['min_seconds']:>10.4f}"
+            f"{fps:>12}{change:>9}{flag}"
+        )
+    return '\n'.join(lines)
+
+def get_detection_accuracy(ground_truth_tracks,detection_tracks,sparse_detector):
+    """
+    Returns:
+        Recall, precision and mean IoU (see compare_tracks) of full and sparse
+        detection against the ground truth, and of sparse against full
+        detection, with the compute of sparse detection relative to full
+    """
+    return {
+        'full_vs_ground_truth':compare_tracks(ground_truth_tracks,detection_tracks['full']),
+        'sparse_vs_ground_truth':compare_tracks(ground_truth_tracks,detection_tracks['sparse']),
+        'sparse_vs_full':compare_tracks(detection_tracks['full'],detection_tracks['sparse']),
+        'sparse_stats':dict(sparse_detector.stats),
+        'sparse_compute_fraction':sparse_detector.get_compute_fraction()
+    }
+
+def format_detection_accuracy(accuracy):
+    lines = [f"{'detection accuracy':<28}{'class':<10}{'recall':>8}{'precision':>11}{'mean IoU':>10}"]
+    for name in ('full_vs_ground_truth','sparse_vs_ground_truth','sparse_vs_full'):
+        for class_name,class_accuracy in accuracy[name].items():
+            lines.append(
+                f"{name:<28}{class_name:<10}{class_accuracy['recall']:>8.3f}{class_accuracy['precision']:>11.3f}"
+                f"{class_accuracy['mean_iou']:>10.3f}"
+            )
+    lines.append(f"Sparse detection compute: {accuracy['sparse_compute_fraction']:.1%} of full detection")
+    return '\n'.join(lines)
+
+def run_benchmarks(width=1920,height=1080,num_frames=240,table_frames=14400,repeat=3,seed=0,
+                   camera_workers=None,video_backend='opencv',detection_stride=4):
+    """
+    Returns:
+        (config, {stage: summary}, detection accuracy), see summarize and
+        get_detection_accuracy
+    """
+    config = {
+        'width':width,
+        'height':height,
+        'frames':num_frames,
+        'table_frames':table_frames,
+        'repeat':repeat,
+        'seed':seed,
+        'video_backend':video_backend,
+        'detection_stride':detection_stride
+    }
+    stage_runs = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        match = SyntheticMatch(width=width,height=height,num_frames=num_frames,seed=seed)
+        video_path = match.write_video(os.path.join(tmp_dir,'synthetic.mp4'))
+        table_match = None
+        if table_frames:
+            table_match = SyntheticMatch(width=width,height=height,num_frames=table_frames,seed=seed)
+        tracker = make_stub_tracker()
+
+        for run in range(repeat):
+            print(f"Benchmark run {run + 1}/{repeat}...")
+            profiler = StageProfiler()
+            detection_tracks,sparse_detector = run_video_stages(
+                video_path,
+                os.path.join(tmp_dir,'output.mp4'),
+                tracker,
+                profiler,
+                camera_workers,
+                video_backend,
+                detection_stride
+            )
+            if run == 0:
+                # Detection is deterministic, the accuracy of the first run holds for all
+                detection_accuracy = get_detection_accuracy(match.tracks(),detection_tracks,sparse_detector)
+            if table_match is not None:
+                # Ground truth tracks with a lost player every 30 seconds
+                tracks = table_match.tracks(id_switch_interval=30*table_match.fps)
+                run_track_stages(
+                    tracker,
+                    CameraMovementEstimator(table_match.render_frame(0)),
+                    tracks,
+                    table_match.camera_movement(),
+                    profiler,
+                    prefix='table/'
+                )
+            for row in profiler.report():
+                stage_runs.setdefault(row['stage'],[]).append(row)
+
+    return config,summarize(stage_runs),detection_accuracy
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on synthetic footage')
+    parser.add_argument('--width',type=int,default=1920,help='Frame width of the synthetic video')
+    parser.add_argument('--height',type=int,default=1080,help='Frame height of the synthetic video')
+    parser.add_argument('--frames',type=int,default=240,help='Frames of the synthetic video')
+    parser.add_argument('--table-frames',type=int,default=14400,
+                        help='Frames of the long match for the table/* stages, 0 to skip them')
+    parser.add_argument('--repeat',type=int,default=3,help='Runs of every stage, the median is reported')
+    parser.add_argument('--seed',type=int,default=0,help='Seed of the synthetic match')
+    parser.add_argument('--camera-workers',type=int,default=None,
+                        help='Processes of get_camera_movement_parallel, one per CPU by default')
+    parser.add_argument('--video-backend',choices=['opencv','ffmpeg'],default='opencv',
+                        help='Encoding backend of save_video')
+    parser.add_argument('--detection-stride',type=int,default=4,
+                        help='Detection stride of detect_and_track_sparse')
+    parser.add_argument('--results-dir',default=os.path.join('benchmarks','results'),
+                        help='Directory of the saved results')
+    parser.add_argument('--compare',default=None,
+                        help='Result file to compare with, the latest result of the same configuration by default')
+    parser.add_argument('--threshold',type=float,default=0.1,
+                        help='Relative slowdown of a stage reported as a regression')
+    parser.add_argument('--no-save',action='store_true',help='Do not save the results')
+    parser.add_argument('--fail-on-regression',action='store_true',help='Exit with status 1 on a regression')
+    args = parser.parse_args()
+
+    config,results,detection_accuracy = run_benchmarks(
+        width=args.width,
+        height=args.height,
+        num_frames=args.frames,
+        table_frames=args.table_frames,
+        repeat=args.repeat,
+        seed=args.seed,
+        camera_workers=args.camera_workers,
+        video_backend=args.video_backend,
+        detection_stride=args.detection_stride
+    )
+    environment = get_environment()
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        previous['path'] = args.compare
+    else:
+        previous = find_previous_result(args.results_dir,config)
+
+    changes,regressions = {},[]
+    if previous is not None:
+        changes,regressions = compare_results(results,previous['results'],args.threshold)
+        print(f"Compared with {previous['path']} (commit {previous['environment'].get('commit')})")
+    print(format_results(results,changes,regressions))
+    print(format_detection_accuracy(detection_accuracy))
+
+    if not args.no_save:
+        os.makedirs(args.results_dir,exist_ok=True)
+        result_path = os.path.join(
+            args.results_dir,
+            f"{time.strftime('%Y%m%d-%H%M%S')}_{environment['commit'] or 'nogit'}.json"
+        )
+        with open(result_path,'w') as f:
+            json.dump({
+                'environment':environment,
+                'config':config,
+                'results':results,
+                'detection_accuracy':detection_accuracy
+            },f,indent=4)
+        print(f"Benchmark results saved to {result_path}")
+
+    if regressions:
+        print(f"{len(regressions)} stages regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,101 @@
+import cv2
+import numpy as np
+from .synthetic import TEAM_COLORS, REFEREE_COLOR, BALL_COLOR
+
+CLASS_NAMES = {0:'ball',1:'goalkeeper',2:'player',3:'referee'}
+
+class _Array():
+    """
+    The parts of the torch tensor interface used on ultralytics results
+    """
+    def __init__(self,array):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+    def int(self):
+        return _Array(self.array.astype(np.int64))
+
+class _Boxes():
+    def __init__(self,xyxy,conf,cls):
+        self.xyxy = _Array(xyxy)
+        self.conf = _Array(conf)
+        self.cls = _Array(cls)
+        self.id = None
+
+class StubResult():
+    """
+    Minimal ultralytics Results, enough for sv.Detections.from_ultralytics
+    """
+    def __init__(self,xyxy,conf,cls):
+        self.boxes = _Boxes(xyxy,conf,cls)
+        self.names = CLASS_NAMES
+        self.obb = None
+        self.masks = None
+
+    def __len__(self):
+        return len(self.boxes.xyxy.array)
+
+class StubDetector():
+    """
+    Stand-in for ultralytics.YOLO on synthetic footage (see SyntheticMatch),
+    so the pipeline runs without a GPU or model weights.
+
+    Objects are found by color: a connected region of a jersey color is a
+    player, of the referee color a referee and of the ball color the ball.
+    Boxes are padded like real detections, which include some pitch around
+    the player. Like YOLO, images are downscaled to imgsz first, so the cost
+    follows the inference size; it is a few color thresholds per image, so
+    benchmarks measure the pipeline around the detector rather than the
+    detector.
+    """
+    def __init__(self,model_path=None,padding=0.15,min_area=2e-5):
+        """
+        Args:
+            model_path: Ignored, for the YOLO(model_path) signature
+            padding: Fraction of the box size added on every side of players
+                and referees
+            min_area: Minimum region area, as a fraction of the image area
+        """
+        self.names = CLASS_NAMES
+        self.overrides = {'imgsz':640}
+        self.padding = padding
+        self.min_area = min_area
+        self.color_classes = [(color,2) for color in TEAM_COLORS]+[(REFEREE_COLOR,3),(BALL_COLOR,0)]
+
+    def _detect(self,image):
+        height,width = image.shape[:2]
+        min_area = max(self.min_area*height*width,2)
+        xyxy,classes = [],[]
+        for color,class_id in self.color_classes:
+            color = np.array(color)
+            mask = cv2.inRange(image,np.clip(color-30,0,255),np.clip(color+30,0,255))
+            num_labels,_,stats,_ = cv2.connectedComponentsWithStats(mask)
+            for x,y,w,h,area in stats[1:num_labels]:
+                if area < min_area:
+                    continue
+                pad_x,pad_y = (w*self.padding,h*self.padding) if class_id != 0 else (0,0)
+                xyxy.append([max(x-pad_x,0),max(y-pad_y,0),min(x+w+pad_x,width),min(y+h+pad_y,height)])
+                classes.append(class_id)
+        xyxy = np.array(xyxy,dtype=np.float32).reshape(-1,4)
+        return StubResult(xyxy,np.full(len(xyxy),0.9,dtype=np.float32),np.array(classes,dtype=np.float32))
+
+    def _detect_scaled(self,image,imgsz):
+        scale = min(imgsz/max(image.shape[:2]),1.0)
+        if scale == 1.0:
+            return self._detect(image)
+        result = self._detect(cv2.resize(image,None,fx=scale,fy=scale,interpolation=cv2.INTER_LINEAR))
+        result.boxes.xyxy.array /= scale
+        return result
+
+    def predict(self,images,conf=0.25,imgsz=None,**kwargs):
+        if isinstance(images,np.ndarray) and images.ndim == 3:
+            images = [images]
+        imgsz = imgsz or self.overrides['imgsz']
+        return [self._detect_scaled(image,imgsz) for image in images]
+
+    __call__ = predict
@@ -0,0 +1,250 @@
+import sys
+import cv2
+import numpy as np
+sys.path.append('../')
+from utils import save_video, TrackTable, TRACK_CLASSES, BALL_TRACK_ID
+
+# BGR colors of the synthetic objects, the stub detector looks for them
+TEAM_COLORS = [(40,40,200),(200,130,40)]
+REFEREE_COLOR = (20,20,20)
+BALL_COLOR = (0,230,255)
+
+GRASS_COLORS = [(40,140,40),(50,160,50)]
+LINE_COLOR = (200,235,200)
+
+class SyntheticMatch():
+    """
+    Reproducible synthetic footage of a match: a striped pitch with lines and
+    texture, players as rectangles in two jersey colors, referees and a ball
+    passed between players, filmed by a camera that pans to follow the ball
+    over a pitch larger than the frame.
+
+    Everything is a function of the frame number and the seed, so the same
+    match can be rendered as a video (frames, write_video) and given as
+    ground truth tracks (tracks, track_table) of any length without
+    rendering, e.g. the track table of a 90 minute match.
+    """
+    def __init__(self,width=1920,height=1080,num_frames=300,num_players=22,num_referees=3,
+                 pan=0.15,fps=24,ball_visibility=0.9,seed=0):
+        """
+        Args:
+            width, height: Frame size in pixels
+            num_frames: Length of the match
+            num_players: Players, split between the two teams
+            num_referees: Referees
+            pan: Camera pan amplitude, as a fraction of the frame width
+            fps: Frame rate
+            ball_visibility: Fraction of frames in which the ball is visible
+            seed: Random seed, the same seed gives the same match
+        """
+        self.width = width
+        self.height = height
+        self.num_frames = num_frames
+        self.num_players = num_players
+        self.num_referees = num_referees
+        self.fps = fps
+        self.ball_visibility = ball_visibility
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+
+        # The pitch is wider and taller than the frame so the camera can pan
+        self.pan_x = int(pan*width)
+        self.pan_y = int(0.2*pan*height)
+        self.world_width = width+2*self.pan_x
+        self.world_height = height+2*self.pan_y
+        self.pitch = self._draw_pitch(rng)
+
+        # Objects move around a base position with a few slow oscillations
+        num_objects = num_players+num_referees
+        self.object_height = max(int(0.08*height),8)
+        self.object_width = max(int(0.35*self.object_height),3)
+        self.ball_size = max(int(0.012*height),3)
+        margin = np.array([self.object_width,self.object_height])
+        world_size = np.array([self.world_width,self.world_height])
+        self.base_positions = margin+rng.random((num_objects,2))*(world_size-2*margin)
+        self.amplitudes = rng.uniform(0.02,0.08,(num_objects,2,2))*world_size[None,:,None]
+        self.frequencies = rng.uniform(0.2,1.0,(num_objects,2,2))*2*np.pi/(fps*20)
+        self.phases = rng.uniform(0,2*np.pi,(num_objects,2,2))
+
+        # The ball goes from holder to holder every pass_frames frames
+        self.pass_frames = 2*fps
+        num_passes = num_frames//self.pass_frames+2
+        self.ball_holders = rng.integers(0,num_players,num_passes)
+        self.ball_hidden = rng.random(num_frames) > ball_visibility
+        self._camera = None
+
+    def _draw_pitch(self,rng):
+        pitch = np.empty((self.world_height,self.world_width,3),dtype=np.uint8)
+        stripe_width = max(self.world_width//16,1)
+        for stripe_start in range(0,self.world_width,stripe_width):
+            pitch[:,stripe_start:stripe_start+stripe_width] = GRASS_COLORS[(stripe_start//stripe_width)%2]
+
+        thickness = max(self.height//270,1)
+        center = (self.world_width//2,self.world_height//2)
+        cv2.line(pitch,(center[0],0),(center[0],self.world_height),LINE_COLOR,thickness)
+        cv2.circle(pitch,center,self.world_height//6,LINE_COLOR,thickness)
+        for x in (self.world_width//12,self.world_width*11//12):
+            cv2.rectangle(pitch,(x-self.world_width//12,self.world_height//4),(x+self.world_width//12,self.world_height*3//4),
+                          LINE_COLOR,thickness)
+
+        # Texture gives the camera movement estimator corners to track
+        num_marks = self.world_width*self.world_height//2000
+        xs = rng.integers(0,self.world_width,num_marks)
+        ys = rng.integers(0,self.world_height,num_marks)
+        shades = rng.integers(-40,60,num_marks)
+        for x,y,shade in zip(xs.tolist(),ys.tolist(),shades.tolist()):
+            color = tuple(int(np.clip(c+shade,0,255)) for c in GRASS_COLORS[0])
+            cv2.circle(pitch,(x,y),max(self.height//540,1),color,-1)
+        return pitch
+
+    def camera_positions(self,frame_nums=None):
+        """
+        Returns:
+            (F, 2) top-left corner of the camera view in the pitch. The camera
+            follows the ball, smoothed over three seconds and at a limited
+            speed, within the pitch.
+        """
+        if self._camera is None:
+            all_frames = np.arange(self.num_frames)
+            ball = self._ball_positions(all_frames,self.object_positions(all_frames))
+            target = np.clip(ball-np.array([self.width/2,self.height/2]),0,[2*self.pan_x,2*self.pan_y])
+            window = min(3*self.fps,self.num_frames)
+            cumulative = np.cumsum(np.pad(target,((window//2,window-window//2-1),(0,0)),mode='edge'),axis=0)
+            cumulative = np.concatenate([np.zeros((1,2)),cumulative])
+            smoothed = (cumulative[window:]-cumulative[:-window])/window
+            # Pan at most half a percent of the frame width per frame
+            max_step = 0.005*self.width
+            steps = np.clip(np.diff(smoothed,axis=0),-max_step,max_step)
+            camera = smoothed[:1]+np.concatenate([np.zeros((1,2)),np.cumsum(steps,axis=0)])
+            self._camera = camera.round()
+        return self._camera if frame_nums is None else self._camera[np.asarray(frame_nums)]
+
+    def object_positions(self,frame_nums=None):
+        """
+        Returns:
+            (F, num_objects, 2) foot positions in the pitch, players first
+        """
+        frame_nums = np.arange(self.num_frames) if frame_nums is None else np.asarray(frame_nums)
+        t = frame_nums[:,None,None,None]
+        offsets = (self.amplitudes*np.sin(self.frequencies*t+self.phases)).sum(axis=-1)
+        return self.base_positions[None]+offsets
+
+    def _ball_positions(self,frame_nums,object_positions):
+        pass_num = frame_nums//self.pass_frames
+        pass_progress = np.clip((frame_nums%self.pass_frames)/(self.fps/2),0,1)[:,None]
+        frame_index = np.arange(len(frame_nums))
+        # The ball lies just in front of the holder's feet, passes are straight lines
+        start = object_positions[frame_index,self.ball_holders[pass_num]]
+        end = object_positions[frame_index,self.ball_holders[pass_num+1]]
+        positions = end+(start-end)*(1-pass_progress)
+        return positions+np.array([self.object_width,-self.ball_size])
+
+    def ball_positions(self,frame_nums=None,object_positions=None):
+        """
+        Returns:
+            (F, 2) ball centers in the pitch, NaN while the ball is hidden
+        """
+        frame_nums = np.arange(self.num_frames) if frame_nums is None else np.asarray(frame_nums)
+        if object_positions is None:
+            object_positions = self.object_positions(frame_nums)
+        positions = self._ball_positions(frame_nums,object_positions)
+        positions[self.ball_hidden[frame_nums]] = np.nan
+        return positions
+
+    def _object_bboxes(self,positions):
+        half_width = self.object_width/2
+        return np.stack([
+            positions[...,0]-half_width,
+            positions[...,1]-self.object_height,
+            positions[...,0]+half_width,
+            positions[...,1]
+        ],axis=-1)
+
+    def render_frame(self,frame_num):
+        camera = self.camera_positions([frame_num])[0].astype(int)
+        frame = self.pitch[camera[1]:camera[1]+self.height,camera[0]:camera[0]+self.width].copy()
+
+        positions = self.object_positions([frame_num])
+        bboxes = self._object_bboxes(positions[0]-camera).round().astype(int)
+        for object_num,(x1,y1,x2,y2) in enumerate(bboxes.tolist()):
+            if object_num < self.num_players:
+                color = TEAM_COLORS[object_num%2]
+            else:
+                color = REFEREE_COLOR
+            cv2.rectangle(frame,(x1,y1),(x2,y2),color,-1)
+
+        ball = self.ball_positions([frame_num],positions)[0]
+        if not np.isnan(ball).any():
+            center = tuple((ball-camera).round().astype(int).tolist())
+            cv2.circle(frame,center,self.ball_size//2,BALL_COLOR,-1)
+        return frame
+
+    def frames(self):
+        for frame_num in range(self.num_frames):
+            yield self.render_frame(frame_num)
+
+    def write_video(self,path):
+        save_video(self.frames(),path,fps=self.fps)
+        return path
+
+    def track_table(self,id_switch_interval=None):
+        """
+        Ground truth tracks, as seen by the camera, of every object whose box
+        is at least partly in the frame
+        Args:
+            id_switch_interval: Every this many frames one player gets a new
+                track id, like ByteTrack losing a player (for adjust_tracks)
+        Returns:
+            TrackTable
+        """
+        frame_nums = np.arange(self.num_frames)
+        camera = self.camera_positions(frame_nums)
+        positions = self.object_positions(frame_nums)
+        bboxes = self._object_bboxes(positions-camera[:,None,:])
+
+        num_objects = positions.shape[1]
+        track_ids = np.broadcast_to(np.arange(1,num_objects+1),(self.num_frames,num_objects)).copy()
+        if id_switch_interval:
+            rng = np.random.default_rng(self.seed+1)
+            next_track_id = num_objects+1
+            for frame_num in range(id_switch_interval,self.num_frames,id_switch_interval):
+                player = rng.integers(0,self.num_players)
+                track_ids[frame_num:,player] = next_track_id
+                next_track_id += 1
+        class_ids = np.where(np.arange(num_objects) < self.num_players,
+                             TRACK_CLASSES.index('players'),TRACK_CLASSES.index('referees'))
+        class_ids = np.broadcast_to(class_ids,(self.num_frames,num_objects))
+
+        ball = self.ball_positions(frame_nums,positions)-camera
+        half_ball = self.ball_size/2
+        ball_bboxes = np.concatenate([ball-half_ball,ball+half_ball],axis=1)
+
+        visible = (bboxes[...,2] > 0) & (bboxes[...,0] < self.width) & (bboxes[...,3] > 0) & (bboxes[...,1] < self.height)
+        ball_visible = ~np.isnan(ball).any(axis=1)
+        ball_visible[ball_visible] = (
+            (ball_bboxes[ball_visible,2] > 0) & (ball_bboxes[ball_visible,0] < self.width) &
+            (ball_bboxes[ball_visible,3] > 0) & (ball_bboxes[ball_visible,1] < self.height)
+        )
+        frames = np.concatenate([np.broadcast_to(frame_nums[:,None],visible.shape)[visible],frame_nums[ball_visible]])
+        return TrackTable(
+            frames,
+            np.concatenate([track_ids[visible],np.full(ball_visible.sum(),BALL_TRACK_ID)]),
+            np.concatenate([class_ids[visible],np.full(ball_visible.sum(),TRACK_CLASSES.index('ball'))]),
+            np.concatenate([bboxes[visible],ball_bboxes[ball_visible]]),
+            num_frames=self.num_frames
+        )
+
+    def tracks(self,id_switch_interval=None):
+        """
+        Ground truth tracks in the nested per-frame dict shape of
+        Tracker.get_object_tracks, see track_table
+        """
+        return self.track_table(id_switch_interval).to_tracks()
+
+    def camera_movement(self):
+        """
+        Returns:
+            (F, 2) true camera shift of every frame relative to the previous one
+        """
+        camera = self.camera_positions()
+        return np.diff(camera,axis=0,prepend=camera[:1])
@@ -2,11 +2,50 @@ import cv2
 import numpy as np
 import pickle 
 import sys,os
+from concurrent.futures import ProcessPoolExecutor,as_completed
 sys.path.append('../')
-from utils import measure_xy_distance,measure_distance
+from utils import draw_transparent_rectangle,TrackTable,iter_video_frames,get_frame_count,FrameStore
+
+def _estimate_chunk_camera_movement(estimator,video_path,start_frame,end_frame,overlap,frame_store_path=None):
+    """
+    Worker of get_camera_movement_parallel: camera movement of frames
+    start_frame to end_frame, with optical flow started overlap frames earlier,
+    read from the frame store at frame_store_path if given
+    """
+    # Every worker is one process, don't let OpenCV start a thread pool in each
+    cv2.setNumThreads(1)
+    estimator.old_gray = None
+    estimator.old_features = None
+
+    warmup_start_frame = max(start_frame-overlap,0)
+    camera_movement = []
+    if frame_store_path is not None:
+        frame_store = FrameStore(frame_store_path)
+        frames = estimator._get_store_frames(frame_store,warmup_start_frame,end_frame)
+    else:
+        frames = iter_video_frames(video_path,warmup_start_frame,end_frame)
+    estimator.update_camera_movement(camera_movement,frames)
+    return start_frame,camera_movement[start_frame-warmup_start_frame:]
 
 class CameraMovementEstimator():
-    def __init__(self,frame):
+    def __init__(self,frame,method='median',downscale=1.0):
+        """
+        Args:
+            frame: First frame of the video
+            method: How the per-frame shift is estimated from the tracked features:
+                'median' - median displacement of the tracked features
+                'ransac' - translation of a RANSAC similarity fit
+                           (cv2.estimateAffinePartial2D)
+                'max'    - displacement of the feature that moved the most
+                           (the original estimator, sensitive to outliers)
+            downscale: Factor applied to the grayscale frames before optical
+                flow, e.g. 0.5 on 4K sources. Shifts are reported in full
+                resolution pixels.
+        """
+        if method not in ('median','ransac','max'):
+            raise ValueError(f"Unknown camera movement method: {method}")
+        self.method = method
+        self.downscale = downscale
         
         self.minimum_distance = 5
 
@@ -20,6 +59,8 @@ class CameraMovementEstimator():
         mask_features = np.zeros_like(first_frame_grayscale)
         mask_features[:,0:20] = 1
         mask_features[:,900:1050] = 1
+        if downscale != 1.0:
+            mask_features = cv2.resize(mask_features,None,fx=downscale,fy=downscale,interpolation=cv2.INTER_NEAREST)
 
         self.features = dict(
             maxCorners=100,
@@ -29,8 +70,88 @@ class CameraMovementEstimator():
             mask=mask_features
         )
 
+        # Corners are only searched inside the mask, so only its bounding box
+        # (plus a margin for the corner filter) has to be processed
+        margin = self.features['blockSize']+3
+        ys,xs = np.nonzero(mask_features)
+        self.features_roi = (
+            max(int(ys.min())-margin,0),min(int(ys.max())+1+margin,mask_features.shape[0]),
+            max(int(xs.min())-margin,0),min(int(xs.max())+1+margin,mask_features.shape[1])
+        ) if len(xs) else (0,mask_features.shape[0],0,mask_features.shape[1])
+
+        # Optical flow state carried between windows of frames
+        self.old_gray = None
+        self.old_features = None
+
+    def _to_gray(self,frame):
+        if frame.ndim == 2:
+            # Already converted and downscaled, see FrameStore.gray_frames
+            return frame
+        frame_gray = cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)
+        if self.downscale != 1.0:
+            frame_gray = cv2.resize(frame_gray,None,fx=self.downscale,fy=self.downscale,interpolation=cv2.INTER_AREA)
+        return frame_gray
+
+    def _get_store_frames(self,frame_store,start_frame=0,end_frame=None):
+        # The grayscale companion fits if it has the downscale of the optical flow
+        if frame_store.gray_scale == self.downscale:
+            return frame_store.gray_frames(start_frame,end_frame)
+        return frame_store.frames(start_frame,end_frame)
+
+    def _get_features(self,frame_gray):
+        y1,y2,x1,x2 = self.features_roi
+        features = dict(self.features,mask=self.features['mask'][y1:y2,x1:x2])
+        corners = cv2.goodFeaturesToTrack(frame_gray[y1:y2,x1:x2],**features)
+        if corners is not None:
+            corners += np.array([x1,y1],dtype=np.float32)
+        return corners
+
+    def estimate_shift(self,old_features,new_features,status=None):
+        """
+        Estimate the camera shift between two frames from tracked features, as
+        one vectorized operation over all features
+        Args:
+            old_features: (N, 1, 2) feature positions in the previous frame
+            new_features: (N, 1, 2) positions of the same features in this frame
+            status: Optional (N, 1) optical flow status, 0 for lost features
+        Returns:
+            (shift_x, shift_y, magnitude) in full resolution pixels, shift being
+            old - new like measure_xy_distance
+        """
+        old_points = old_features.reshape(-1,2)
+        new_points = new_features.reshape(-1,2)
+        if self.method != 'max' and status is not None:
+            is_tracked = status.ravel() == 1
+            old_points,new_points = old_points[is_tracked],new_points[is_tracked]
+        if len(old_points) == 0:
+            return 0,0,0
+
+        displacement = old_points-new_points
+        if self.method == 'max':
+            # Displacement of the first feature with the largest movement
+            squared_distance = displacement[:,0]*displacement[:,0]+displacement[:,1]*displacement[:,1]
+            largest = int(np.argmax(squared_distance))
+            shift_x,shift_y = displacement[largest]
+        elif self.method == 'ransac' and len(old_points) >= 3:
+            transform,_ = cv2.estimateAffinePartial2D(new_points,old_points,method=cv2.RANSAC,ransacReprojThreshold=3.0)
+            if transform is None:
+                shift_x,shift_y = np.median(displacement,axis=0)
+            else:
+                # Shift of the frame center under the fitted similarity transform
+                height,width = self.old_gray.shape[:2]
+                center = np.array([width/2,height/2,1.0])
+                shift_x,shift_y = transform@center-center[:2]
+        else:
+            shift_x,shift_y = np.median(displacement,axis=0)
+
+        shift_x,shift_y = shift_x/self.downscale,shift_y/self.downscale
+        return shift_x,shift_y,float(np.sqrt(shift_x*shift_x+shift_y*shift_y))
+
     def adjust_position_to_tracks(self,tracks,camera_movement_per_frame):
-         
+         if isinstance(tracks,TrackTable):
+             tracks.adjust_positions(camera_movement_per_frame)
+             return
+
          for obj_name,obj in tracks.items():
                 for frame_num,frame in enumerate(obj):
                     if obj_name!='ball':
@@ -45,65 +166,239 @@ class CameraMovementEstimator():
                         adjusted_position = (position[0]-camera_movement[0],position[1]-camera_movement[1])
                         tracks[obj_name][frame_num]['adjusted_position'] = adjusted_position
 
-    def get_camera_movement(self,frames,read_from_stub=False,stub_path=None):
+    def get_cache_params(self,parallel=False,chunk_size=300,overlap=30):
+        """
+        Parameters that change the camera movement, part of the stub cache key
+        Args:
+            parallel: Whether get_camera_movement_parallel computes it, chunk
+                boundaries change which features are tracked
+            chunk_size, overlap: As given to get_camera_movement_parallel
+        """
+        features = {key:value for key,value in self.features.items() if key != 'mask'}
+        params = {
+            'method':self.method,
+            'downscale':self.downscale,
+            'minimum_distance':self.minimum_distance,
+            'lk_params':self.lk_params,
+            'features':features,
+            'parallel':parallel
+        }
+        if parallel:
+            params.update(chunk_size=chunk_size,overlap=max(overlap,1))
+        return params
+
+    def get_camera_movement(self,frames,read_from_stub=False,stub_path=None,stub_cache=None):
+        """
+        Estimate the camera movement for every frame. frames can be a list or a
+        lazy iterable, only the previous grayscale frame is kept in memory.
+        Args:
+            frames: Frames of the whole video, starting at frame 0
+            read_from_stub: Reuse cached results
+            stub_path: Path of a pickle stub holding all camera movement
+            stub_cache: StageCache to use instead of stub_path. Results are
+                saved in chunks and an interrupted run resumes from the last
+                saved chunk
+        """
+        if stub_cache is not None:
+            return self._get_cached_camera_movement(frames,read_from_stub,stub_cache)
 
         #read the camera movement from stub path
         if stub_path and read_from_stub and os.path.exists(stub_path):
             with open(stub_path,'rb') as f:
                 return pickle.load(f)
-            
-        camera_movement = [[0,0]]*len(frames)
 
-        old_gray = cv2.cvtColor(frames[0],cv2.COLOR_BGR2GRAY) #old gray iamge
-        old_features = cv2.goodFeaturesToTrack(old_gray,**self.features)
+        camera_movement = []
+        self.update_camera_movement(camera_movement,frames)
+
+        if stub_path:     
+            with open(stub_path,'wb') as f:
+                pickle.dump(camera_movement,f)
 
-        for frame_num,frame in enumerate(frames[1:],1):
-            
-            frame_gray = cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)
+        return camera_movement
 
-            new_features,_,_ = cv2.calcOpticalFlowPyrLK(old_gray,frame_gray,old_features,None,**self.lk_params)
+    def _get_cached_camera_movement(self,frames,read_from_stub,stub_cache):
+        if not read_from_stub:
+            stub_cache.clear()
 
-            max_distance = 0
-            camera_x_movement,camera_y_movement = (0,0)
+        num_cached_frames,arrays = stub_cache.read_arrays()
+        camera_movement = arrays['camera_movement'].tolist() if num_cached_frames else []
+        if stub_cache.is_complete():
+            return camera_movement
 
-            for (old,new) in zip(old_features,new_features):
-                old = old.ravel()
-                new = new.ravel()
+        chunk_start_frame = num_cached_frames
+        for frame_num,frame in enumerate(frames):
+            if frame_num < num_cached_frames-1:
+                continue
+            if frame_num == num_cached_frames-1:
+                # Resuming: start optical flow from the last cached frame
+                self.old_gray = self._to_gray(frame)
+                self.old_features = self._get_features(self.old_gray)
+                continue
 
-                distance = measure_distance(old,new)
+            self.update_camera_movement(camera_movement,[frame])
+            if len(camera_movement)-chunk_start_frame >= stub_cache.chunk_size:
+                stub_cache.write_chunk(
+                    chunk_start_frame,
+                    len(camera_movement)-chunk_start_frame,
+                    camera_movement=np.array(camera_movement[chunk_start_frame:],dtype=np.float64)
+                )
+                chunk_start_frame = len(camera_movement)
 
-                if distance > max_distance:
-                    camera_x_movement,camera_y_movement = measure_xy_distance(old,new)
-                    max_distance = distance
+        if len(camera_movement) > chunk_start_frame:
+            stub_cache.write_chunk(
+                chunk_start_frame,
+                len(camera_movement)-chunk_start_frame,
+                camera_movement=np.array(camera_movement[chunk_start_frame:],dtype=np.float64)
+            )
+        stub_cache.mark_complete(len(camera_movement))
 
-            if max_distance > self.minimum_distance:
-                camera_movement[frame_num] = [camera_x_movement,camera_y_movement]
-                old_features = cv2.goodFeaturesToTrack(frame_gray,**self.features)
+        return camera_movement
 
-            old_gray = frame_gray.copy()
+    def get_camera_movement_parallel(self,video_path,num_workers=None,chunk_size=300,overlap=30,
+                                     read_from_stub=False,stub_path=None,stub_cache=None,frame_store=None):
+        """
+        Estimate the camera movement for every frame with a process pool. The
+        video is split into chunks of chunk_size frames and each worker decodes
+        and tracks its own chunk.
 
-        if stub_path:     
+        Shifts are relative to the previous frame, so chunks are stitched by
+        concatenation once every chunk knows the frame before it: each worker
+        starts optical flow overlap frames before its chunk (at least one) and
+        drops the shifts of those frames. The overlap also lets the tracked
+        features settle like in a sequential run, so the stitched result only
+        differs from get_camera_movement in which features were tracked.
+        Args:
+            video_path: Path of the video, decoded by the workers
+            num_workers: Number of processes, os.cpu_count() by default
+            chunk_size: Frames per chunk
+            overlap: Frames decoded before each chunk to warm up optical flow
+            read_from_stub, stub_path, stub_cache: As in get_camera_movement.
+                With stub_cache every chunk is saved as soon as it is done
+            frame_store: Finished FrameStore of the video, the workers map it
+                and read its grayscale frames (if stored at this downscale)
+                instead of decoding the video
+        """
+        camera_movement = []
+        if stub_cache is not None:
+            if not read_from_stub:
+                stub_cache.clear()
+            num_cached_frames,arrays = stub_cache.read_arrays()
+            camera_movement = arrays['camera_movement'].tolist() if num_cached_frames else []
+            if stub_cache.is_complete():
+                return camera_movement
+        elif stub_path and read_from_stub and os.path.exists(stub_path):
+            with open(stub_path,'rb') as f:
+                return pickle.load(f)
+
+        # The header frame count may be off, the last chunk runs to the end
+        start_frame = len(camera_movement)
+        frame_count = len(frame_store) if frame_store is not None else get_frame_count(video_path)
+        chunk_starts = list(range(start_frame,max(frame_count,start_frame+1),chunk_size))
+        chunk_ends = chunk_starts[1:]+[None]
+
+        chunk_movements = {}
+        with ProcessPoolExecutor(max_workers=num_workers or os.cpu_count()) as executor:
+            futures = [
+                executor.submit(
+                    _estimate_chunk_camera_movement,
+                    self,
+                    video_path,
+                    chunk_start,
+                    chunk_end,
+                    max(overlap,1),
+                    frame_store.path if frame_store is not None else None
+                )
+                for chunk_start,chunk_end in zip(chunk_starts,chunk_ends)
+            ]
+            for future in as_completed(futures):
+                chunk_start,chunk_movement = future.result()
+                chunk_movements[chunk_start] = chunk_movement
+                if stub_cache is not None and chunk_movement:
+                    stub_cache.write_chunk(
+                        chunk_start,
+                        len(chunk_movement),
+                        camera_movement=np.array(chunk_movement,dtype=np.float64)
+                    )
+
+        # Stitch the chunks in order, up to the first one cut short by the
+        # end of the video
+        for chunk_start,chunk_end in zip(chunk_starts,chunk_ends):
+            chunk_movement = chunk_movements[chunk_start]
+            camera_movement.extend(chunk_movement)
+            if chunk_end is not None and len(chunk_movement) < chunk_end-chunk_start:
+                break
+
+        if stub_cache is not None:
+            stub_cache.mark_complete(len(camera_movement))
+        elif stub_path:
             with open(stub_path,'wb') as f:
                 pickle.dump(camera_movement,f)
 
         return camera_movement
 
+    def estimate_frame_movement(self,frame):
+        """
+        Online mode: camera movement of the next frame of a stream, relative
+        to the previous call's frame ([0, 0] for the first frame)
+        """
+        camera_movement = [] if self.old_gray is None else [[0,0]]
+        self.update_camera_movement(camera_movement,[frame])
+        return camera_movement[-1]
 
-    def draw_camera_movement(self,frames,camera_movement_per_frame):
+    def update_camera_movement(self,camera_movement,frames):
+        """
+        Estimate the camera movement for the next window of frames and append it
+        to camera_movement. Windows must be passed in frame order.
+        """
+        for frame in frames:
+            frame_gray = self._to_gray(frame)
 
-        output_frames = []
-        for frame_num,frame in enumerate(frames):
-            frame = frame.copy()
-            overlay = frame.copy()
+            if not camera_movement:
+                camera_movement.append([0,0])
+                self.old_gray = frame_gray #old gray iamge
+                self.old_features = self._get_features(self.old_gray)
+                continue
+
+            if self.old_features is None:
+                # No features to track (e.g. a blank frame), try again on this one
+                camera_movement.append([0,0])
+                self.old_features = self._get_features(frame_gray)
+                self.old_gray = frame_gray
+                continue
+
+            new_features,status,_ = cv2.calcOpticalFlowPyrLK(self.old_gray,frame_gray,self.old_features,None,**self.lk_params)
+
+            camera_x_movement,camera_y_movement,distance = self.estimate_shift(self.old_features,new_features,status)
 
-            cv2.rectangle(overlay,(0,0),(500,100),(255,255,255),-1)
-            alpha=0.6
-            cv2.addWeighted(overlay,alpha,frame,1-alpha,0,frame)
+            if distance > self.minimum_distance:
+                camera_movement.append([camera_x_movement,camera_y_movement])
+                self.old_features = self._get_features(frame_gray)
+            else:
+                camera_movement.append([0,0])
 
-            camera_x,camera_y = camera_movement_per_frame[frame_num]
-            frame = cv2.putText(frame,f"Camera Movement x: {camera_x:.2f}",(10,60),cv2.FONT_HERSHEY_SIMPLEX,1,(0,0,0),3)
-            frame = cv2.putText(frame,f"Camera Movement y: {camera_y:.2f}",(10,90),cv2.FONT_HERSHEY_SIMPLEX,1,(0,0,0),3)
+            self.old_gray = frame_gray
 
+        return camera_movement
+
+
+    def draw_frame_camera_movement(self,frame,frame_num,camera_movement_per_frame):
+        """
+        Draw the camera movement panel of one frame in place
+        """
+        alpha=0.6
+        draw_transparent_rectangle(frame,(0,0),(500,100),(255,255,255),alpha)
+
+        camera_x,camera_y = camera_movement_per_frame[frame_num]
+        cv2.putText(frame,f"Camera Movement x: {camera_x:.2f}",(10,60),cv2.FONT_HERSHEY_SIMPLEX,1,(0,0,0),3)
+        cv2.putText(frame,f"Camera Movement y: {camera_y:.2f}",(10,90),cv2.FONT_HERSHEY_SIMPLEX,1,(0,0,0),3)
+
+        return frame
+
+    def draw_camera_movement(self,frames,camera_movement_per_frame):
+
+        output_frames = []
+        for frame_num,frame in enumerate(frames):
+            frame = self.draw_frame_camera_movement(frame.copy(),frame_num,camera_movement_per_frame)
             output_frames.append(frame)
 
         return output_frames
@@ -0,0 +1 @@
+from .live_pipeline import LivePipeline
\ No newline at end of file
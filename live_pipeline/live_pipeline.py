@@ -0,0 +1,332 @@
+import queue
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+import sys
+sys.path.append('../')
+from utils import TrackTable,StageProfiler,DEFAULT_FPS
+from trackers import Tracker
+from camera_movement_estimator import CameraMovementEstimator
+from view_transformer import ViewTransformer
+from team_assigner import TeamAssinger
+from player_ball_assigner import PlayerBallAssigner,BallControl
+from speed_and_distance_estimator import SpeedAndDistanceEstimator
+from annotation_renderer import AnnotationRenderer
+
+# Marks the end of the stream in the frame queue
+_END = object()
+
+DROP_POLICIES = ('drop_oldest','drop_newest','block')
+
+class LivePipeline():
+    """
+    Online (causal) version of process_video for live sources, e.g. an RTSP
+    stream or a file replayed at its native frame rate.
+
+        capture thread -> bounded frame queue -> process_frame -> annotated frame
+
+    Every stage only uses the current and previous frames: ByteTrack and
+    online id re-association, camera movement against the previous frame,
+    homography, team assignment from cached per-track colors, ball possession
+    and speed over a trailing window. Ball gaps are filled with a look-ahead
+    of tracker.ball_interpolator.delay frames, which adds that many frames
+    of latency.
+
+    Latency is bounded by the frame queue. When processing falls behind the
+    source, drop_policy decides which frames are skipped:
+        'drop_oldest' - drop the oldest queued frame, so the freshest frames
+                        are processed (default, lowest latency)
+        'drop_newest' - drop the incoming frame
+        'block'       - never drop, the capture waits (latency is unbounded
+                        on a live source, useful for offline replays)
+    Frames that waited longer than max_latency seconds are dropped as well.
+    """
+    def __init__(self,model_path,tracker=None,queue_size=2,drop_policy='drop_oldest',max_latency=None,
+                 realtime=False,min_players_for_teams=10,latency_window=1000,profiler=None):
+        """
+        Args:
+            model_path: Path to the YOLO weights
+            tracker: Optional Tracker to use instead of creating one
+            queue_size: Frames waiting between capture and processing
+            drop_policy: See class docstring
+            max_latency: Seconds a frame may wait before it is dropped, None for no limit
+            realtime: Replay file sources at their native frame rate, like a live stream
+            min_players_for_teams: Team colors are fitted on the first frame
+                with at least this many players
+            latency_window: Number of recent frames kept for latency statistics
+            profiler: StageProfiler of the per-frame stages and of the
+                end-to-end latency (live/latency), a new one by default
+        """
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.tracker = tracker or Tracker(model_path)
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.max_latency = max_latency
+        self.realtime = realtime
+        self.min_players_for_teams = min_players_for_teams
+
+        self.view_transformer = ViewTransformer()
+        self.team_assigner = TeamAssinger()
+        self.player_assigner = PlayerBallAssigner()
+        self.speed_distance_estimator = SpeedAndDistanceEstimator()
+        self.camera_movement_estimator = None  # Created on the first frame
+        self.team_ball_control = BallControl()
+
+        self.fps = None
+        self.stats = {'captured':0,'processed':0,'dropped':0,'stale':0}
+        self.latencies = deque(maxlen=latency_window)
+        self.profiler = profiler or StageProfiler()
+        self._stats_lock = threading.Lock()
+
+        # State of the frame being annotated, read by the renderer layers
+        self.frame_tracks = None
+        # Tracked frames waiting for the ball look-ahead
+        self.pending_frames = deque()
+        self.camera_movement = [0,0]
+        self.renderer = AnnotationRenderer([
+            ('tracks',lambda frame,frame_num: self.tracker.draw_frame_tracks(frame,0,self._single_frame_tracks())),
+            ('team_ball_control',lambda frame,frame_num: self.tracker.draw_team_ball_control(
+                frame,
+                len(self.team_ball_control)-1,
+                self.team_ball_control
+            )),
+            ('camera_movement',lambda frame,frame_num: self.camera_movement_estimator.draw_frame_camera_movement(
+                frame,
+                0,
+                [self.camera_movement]
+            )),
+            ('speed_and_distance',lambda frame,frame_num: self.speed_distance_estimator.draw_frame_speed_and_distance(
+                frame,
+                0,
+                self._single_frame_tracks()
+            )),
+        ],profiler=self.profiler)
+
+    def _single_frame_tracks(self):
+        return {obj_name:[obj] for obj_name,obj in self.frame_tracks.items()}
+
+    def _add_stat(self,name,count=1):
+        with self._stats_lock:
+            self.stats[name] += count
+
+    def _put(self,frame_queue,item,stop):
+        while not stop.is_set():
+            try:
+                frame_queue.put(item,timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _enqueue(self,frame_queue,item,stop):
+        if self.drop_policy == 'block':
+            return self._put(frame_queue,item,stop)
+
+        if self.drop_policy == 'drop_newest':
+            try:
+                frame_queue.put_nowait(item)
+            except queue.Full:
+                self._add_stat('dropped')
+            return True
+
+        # drop_oldest: make room by discarding the oldest queued frame
+        while True:
+            try:
+                frame_queue.put_nowait(item)
+                return True
+            except queue.Full:
+                try:
+                    frame_queue.get_nowait()
+                    self._add_stat('dropped')
+                except queue.Empty:
+                    pass
+
+    def _set_fps(self,fps):
+        self.fps = fps
+        self.speed_distance_estimator.frame_rate = fps
+        self.team_ball_control.fps = fps
+
+    def _capture(self,source,frame_queue,stop):
+        cap = cv2.VideoCapture(source)
+        try:
+            if not cap.isOpened():
+                raise ValueError(f"Could not open video source: {source}")
+            # Set before the first frame is queued. Streams often report 0 or
+            # a bogus rate (e.g. 90000, the RTP clock)
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            self._set_fps(fps if 0 < fps < 1000 else DEFAULT_FPS)
+            start = time.perf_counter()
+            frame_num = 0
+            while not stop.is_set():
+                if self.realtime:
+                    # Pace a file source like a live one
+                    delay = start+frame_num/self.fps-time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                ret,frame = cap.read()
+                if not ret:
+                    break
+                self._add_stat('captured')
+                if not self._enqueue(frame_queue,(frame_num,time.perf_counter(),frame),stop):
+                    return
+                frame_num += 1
+        except BaseException as e:
+            # Raised again by run()
+            self._put(frame_queue,e,stop)
+            return
+        finally:
+            cap.release()
+        # The end marker waits for room, it must not be dropped
+        self._put(frame_queue,_END,stop)
+
+    def process_frame(self,frame_num,frame):
+        """
+        Track one frame. The ball is filled in with a look-ahead of a few
+        frames (see BallInterpolator), so the frame is annotated once that
+        many newer frames have arrived.
+        Args:
+            frame_num: Frame number in the source (may skip dropped frames)
+            frame: BGR frame
+        Returns:
+            List of (frame_num, annotated frame) of the frames that are done,
+            in order
+        """
+        # Detection, tracking and online id re-association
+        start = time.perf_counter()
+        frame_tracks = self.tracker.track_frame(frame)
+        self.tracker.track_reassociator.update(frame_tracks['players'])
+        self.profiler.add_time('live/detect_and_track',time.perf_counter()-start)
+
+        # Camera movement against the previous processed frame
+        start = time.perf_counter()
+        if self.camera_movement_estimator is None:
+            self.camera_movement_estimator = CameraMovementEstimator(frame)
+        camera_movement = self.camera_movement_estimator.estimate_frame_movement(frame)
+        self.profiler.add_time('live/camera_movement',time.perf_counter()-start)
+
+        self.pending_frames.append((frame_num,frame,frame_tracks,camera_movement))
+        return [self._finish_frame(ball_track)
+                for _,ball_track in self.tracker.ball_interpolator.update(frame_num,frame_tracks['ball'])]
+
+    def flush(self):
+        """
+        Annotate the frames still waiting for the ball look-ahead, at the end
+        of a stream
+        """
+        return [self._finish_frame(ball_track)
+                for _,ball_track in self.tracker.ball_interpolator.flush()]
+
+    def _finish_frame(self,ball_track):
+        frame_num,frame,frame_tracks,camera_movement = self.pending_frames.popleft()
+        frame_tracks['ball'] = ball_track
+        self.camera_movement = camera_movement
+
+        # Positions, camera compensation and homography on a one-frame table
+        start = time.perf_counter()
+        track_table = TrackTable.from_tracks({obj_name:[obj] for obj_name,obj in frame_tracks.items()})
+        self.tracker.add_position_to_tracks(track_table)
+        self.camera_movement_estimator.adjust_position_to_tracks(track_table,[camera_movement])
+        self.view_transformer.add_transformed_position_to_tracks(track_table)
+        frame_tracks = {obj_name:obj[0] for obj_name,obj in track_table.to_tracks().items()}
+        player_track = frame_tracks['players']
+        self.profiler.add_time('live/positions',time.perf_counter()-start)
+
+        # Team colors are fitted once, then teams come from the per-track cache
+        start = time.perf_counter()
+        if self.team_assigner.kmeans is None and len(player_track) >= max(self.min_players_for_teams,2):
+            self.team_assigner.assign_team_color(frame,player_track)
+        if self.team_assigner.kmeans is not None:
+            player_teams = self.team_assigner.assign_players_team(frame,player_track,frame_num)
+            for player_id,player_team_id in player_teams.items():
+                player_track[player_id]['team'] = player_team_id
+                player_track[player_id]['team_color'] = self.team_assigner.team_colors[player_team_id]
+        self.profiler.add_time('live/team',time.perf_counter()-start)
+
+        # Ball possession
+        assigned_player = -1
+        if 'bbox' in frame_tracks['ball']:
+            assigned_player = self.player_assigner.assign_ball_to_player(player_track,frame_tracks['ball']['bbox'])
+        if assigned_player != -1 and 'team' in player_track[assigned_player]:
+            player_track[assigned_player]['has_ball'] = True
+            self.team_ball_control.append(player_track[assigned_player]['team'])
+        else:
+            last_team = self.team_ball_control[-1] if len(self.team_ball_control) else 0
+            self.team_ball_control.append(last_team)
+
+        # Speed and distance over a trailing window
+        start = time.perf_counter()
+        self.speed_distance_estimator.update_frame_speed_and_distance(frame_num,frame_tracks)
+        self.profiler.add_time('live/speed_and_distance',time.perf_counter()-start)
+
+        self.frame_tracks = frame_tracks
+        return frame_num,self.renderer.render_frame(frame,frame_num)
+
+    def run(self,source):
+        """
+        Process a live source
+        Args:
+            source: Anything cv2.VideoCapture opens (RTSP/HTTP URL, device
+                index, video file)
+        Yields:
+            (frame_num, annotated frame) as soon as each frame is processed,
+            self.fps is the source frame rate from the first frame on
+        """
+        stop = threading.Event()
+        frame_queue = queue.Queue(maxsize=self.queue_size)
+        capture_thread = threading.Thread(target=self._capture,args=(source,frame_queue,stop),daemon=True)
+        capture_thread.start()
+
+        # Capture times of the frames waiting for the ball look-ahead
+        capture_times = deque()
+
+        def finished(frames):
+            for frame_num,frame in frames:
+                latency = time.perf_counter()-capture_times.popleft()
+                self.latencies.append(latency)
+                self.profiler.add_time('live/latency',latency)
+                self._add_stat('processed')
+                yield frame_num,frame
+
+        try:
+            while True:
+                item = frame_queue.get()
+                if item is _END:
+                    break
+                if isinstance(item,BaseException):
+                    raise item
+
+                frame_num,capture_time,frame = item
+                if self.max_latency is not None and time.perf_counter()-capture_time > self.max_latency:
+                    self._add_stat('stale')
+                    continue
+
+                capture_times.append(capture_time)
+                yield from finished(self.process_frame(frame_num,frame))
+            yield from finished(self.flush())
+        finally:
+            stop.set()
+            capture_thread.join()
+
+    def get_latency_stats(self):
+        """
+        Returns:
+            {'mean', 'p50', 'p95', 'max'} end-to-end latency in seconds over
+            the recent frames, from capture to annotated frame
+        """
+        if not self.latencies:
+            return {}
+        latencies = np.asarray(self.latencies)
+        return {
+            'mean':float(latencies.mean()),
+            'p50':float(np.percentile(latencies,50)),
+            'p95':float(np.percentile(latencies,95)),
+            'max':float(latencies.max())
+        }
+
+    def format_stats(self):
+        latency = ' | '.join(f"{name}: {value*1000:.0f} ms" for name,value in self.get_latency_stats().items())
+        counts = ' | '.join(f"{name}: {count}" for name,count in self.stats.items())
+        return f"{counts} | latency {latency}"
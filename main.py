@@ -1,133 +1,597 @@
-from utils import read_video, save_video
+from utils import save_video, read_frame, get_frame_count, TrackTable, StubCache, StageProfiler, VideoReader, VideoWriter
+from utils import get_video_fps, open_frame_store, AnalyticsExporter
 from trackers import Tracker
 import cv2
 from team_assigner import TeamAssinger
-from player_ball_assigner import PlayerBallAssigner
+from player_ball_assigner import PlayerBallAssigner, BallControl
 import numpy as np
 from camera_movement_estimator import CameraMovementEstimator
 from view_transformer import ViewTransformer
 from speed_and_distance_estimator import SpeedAndDistanceEstimator
+from annotation_renderer import AnnotationRenderer
+from live_pipeline import LivePipeline
+from batch_runner import BatchRunner
+import argparse
+import json
+import time
 import os
 
-def setup_calibration_dir():
+def setup_calibration_dir(calibration_dir='calibration_results'):
     """
     Create calibration directory and return its path
     """
-    calibration_dir = 'calibration_results'
     os.makedirs(calibration_dir, exist_ok=True)
     return calibration_dir
 
-def process_video(input_path, output_path):
+def process_video(input_path, output_path, model_path="models/best.pt", tracker=None,
+                  calibration_dir='calibration_results', camera_workers=None, tracking_workers=1,
+                  profile_dir=None, video_backend='opencv', codec=None, crf=23, video_threads=0, hwaccel=None,
+                  detection_stride=1, evaluate_detection_frames=0, inference_backend='pytorch', precision='fp32',
+                  calibration_data=None, frame_store_dir=None, keep_frame_store=False, analytics_dir=None,
+                  analytics_format='npz'):
     """
-    Process a football video to track players, ball, and generate analytics
+    Process a football video to track players, ball, and generate analytics.
+    Frames are streamed from the input file instead of being loaded into memory,
+    so memory use does not grow with the length of the video. Decoding and
+    encoding run on their own threads, overlapped with the processing.
     Args:
         input_path: Path to input video file
         output_path: Path to save processed video
+        model_path: Path to the YOLO weights
+        tracker: Tracker of model_path to reuse (e.g. by a batch worker), its state is reset
+        calibration_dir: Directory of the field and trajectory visualizations
+        camera_workers: Processes of the camera movement estimation, one per CPU by default
+        tracking_workers: With more than one, the match is split into time
+            segments tracked in parallel, each process loading its own model
+        profile_dir: Run every stage under cProfile and save the stats there
+        video_backend: Video decoding and encoding backend, 'opencv' or
+            'ffmpeg' (see VideoReader and VideoWriter)
+        codec: Output codec, a FourCC for 'opencv' or an ffmpeg encoder name
+        crf: Constant rate factor of the ffmpeg encoder
+        video_threads: Decoder and encoder threads of ffmpeg, 0 for automatic
+        hwaccel: Hardware decoding method of ffmpeg, e.g. 'auto' or 'cuda'
+        detection_stride: Detect every detection_stride-th frame and propagate
+            the boxes in between (see SparseDetector)
+        evaluate_detection_frames: With a detection stride, also run full
+            detection on this many first frames and save the accuracy cost
+            of sparse detection to <output>_detection.json
+        inference_backend: 'pytorch', 'torchscript', 'onnx' or 'openvino',
+            the model is exported once and cached (see export_model). A
+            supplied tracker keeps its own backend
+        precision: 'fp32', 'fp16' or 'int8' export
+        calibration_data: Dataset YAML calibrating int8 OpenVINO exports
+        frame_store_dir: Decode the video once into a memory-mapped frame
+            store in this directory (on a local disk, height*width*3 bytes
+            per frame) that the later passes read instead of decoding the
+            video again (see FrameStore)
+        keep_frame_store: Keep the frame store for the next run on the same
+            video instead of deleting it at the end
+        analytics_dir: Export the track table, camera movement, possession
+            and per-player and per-team summaries to
+            <analytics_dir>/<output name>/ as the frames are annotated, see
+            AnalyticsExporter. Query them with AnalyticsDataset(analytics_dir)
+        analytics_format: 'npz' or 'parquet' (needs pyarrow)
+    Returns:
+        Number of frames processed
     """
+    frame_store = None
+    analytics_exporter = None
     try:
+        # Every stage is timed, the report is saved next to the video
+        profiler = StageProfiler(profile_dir=profile_dir)
+
         # Setup calibration directory
-        calibration_dir = setup_calibration_dir()
+        calibration_dir = setup_calibration_dir(calibration_dir)
         
-        # Read video frames
+        # Read the first frame, later stages re-read the video as a stream
         print("Reading video...")
-        video_frames = read_video(input_path)
-        if not video_frames:
+        with profiler.stage('read', frames=1):
+            first_frame = read_frame(input_path, 0)
+        if first_frame is None:
             raise ValueError("No frames read from video")
+        # The output keeps the timing of the source
+        fps = get_video_fps(input_path)
 
-        # Initialize and run object tracking
         print("Initializing tracker...")
-        tracker = Tracker("models/best.pt")
-        tracks = tracker.get_object_tracks(video_frames,
-                                         read_from_stub=True,
-                                         stub_path='stubs/track_stubs.pkl')
+        with profiler.stage('load_model'):
+            if tracker is None:
+                tracker = Tracker(
+                    model_path,
+                    detection_stride=detection_stride,
+                    inference_backend=inference_backend,
+                    precision=precision,
+                    calibration_data=calibration_data
+                )
+            else:
+                tracker.set_detection_stride(detection_stride)
+                tracker.reset()
+            camera_movement_estimator = CameraMovementEstimator(first_frame)
+
+        # Cached results are keyed by the video and model content and the
+        # stage parameters, and resume from the last saved chunk
+        stub_cache = StubCache('stubs')
+        track_params = tracker.get_cache_params()
+        if tracking_workers > 1:
+            # Segment boundaries change the ids, cache them separately
+            track_params.update(segment_size=1500, overlap=30)
+        track_cache = stub_cache.stage('tracks', input_path, model_path, track_params)
+        camera_movement_cache = stub_cache.stage(
+            'camera_movement',
+            input_path,
+            params=camera_movement_estimator.get_cache_params(parallel=True)
+        )
+
+        if frame_store_dir:
+            # Filled while tracking decodes the video, with grayscale frames
+            # at the scale of the camera movement optical flow
+            video_hash = stub_cache.file_hash(input_path)
+            frame_store = open_frame_store(
+                frame_store_dir,
+                f"{os.path.splitext(os.path.basename(input_path))[0]}_{video_hash[:12]}",
+                first_frame.shape[1],
+                first_frame.shape[0],
+                capacity=get_frame_count(input_path),
+                gray_scale=camera_movement_estimator.downscale,
+                source=video_hash
+            )
+
+        def read_frames(end_frame=None, frames_in_flight=0):
+            if frame_store is not None and frame_store.complete:
+                return frame_store.frames(end_frame=end_frame, release_lag=frames_in_flight + 2)
+            return VideoReader(input_path, end_frame=end_frame, backend=video_backend, threads=video_threads,
+                               hwaccel=hwaccel)
+
+        print("Tracking objects...")
+        with profiler.stage('detect_and_track') as stage:
+            if tracking_workers > 1:
+                tracks = tracker.get_object_tracks_parallel(
+                    input_path,
+                    num_workers=tracking_workers,
+                    segment_size=track_params['segment_size'],
+                    overlap=track_params['overlap'],
+                    read_from_stub=True,
+                    stub_cache=track_cache
+                )
+            else:
+                # The detection pipeline reads ahead through its decode and
+                # letterbox queues
+                pipeline = tracker.detection_pipeline
+                frames = read_frames(frames_in_flight=2 * pipeline.queue_size + pipeline.batch_size)
+                if frame_store is not None and not frame_store.complete:
+                    frames = frame_store.tee(frames)
+                tracks = tracker.get_object_tracks(
+                    frames,
+                    read_from_stub=True,
+                    stub_cache=track_cache
+                )
+            num_frames = stage['frames'] = len(tracks['players'])
+        if frame_store is not None and not frame_store.complete:
+            if len(frame_store) < num_frames:
+                # Frames tracking did not decode (cached tracks, parallel tracking)
+                with profiler.stage('frame_store') as stage:
+                    stored_frames = len(frame_store)
+                    for frame in VideoReader(input_path, start_frame=stored_frames, backend=video_backend,
+                                             threads=video_threads, hwaccel=hwaccel):
+                        frame_store.append(frame)
+                    stage['frames'] = len(frame_store) - stored_frames
+            frame_store.finish()
+        if frame_store is not None:
+            print(f"Frame store: {len(frame_store)} frames, {frame_store.nbytes / 1e9:.2f} GB in {frame_store.path}")
+        if tracker.detection_pipeline.stats:
+            print(f"Detection pipeline: {tracker.detection_pipeline.format_stats()}")
+            # Busy time of the decode, letterbox and inference threads
+            for stage_name, stage_stats in tracker.detection_pipeline.stats.items():
+                profiler.add_time(f'detect/{stage_name}', stage_stats['seconds'], frames=stage_stats['frames'])
+        if tracker.sparse_detector is not None:
+            # Nothing is detected when the tracks come from the cache
+            if tracker.sparse_detector.stats['frames']:
+                print(f"Sparse detection: {tracker.sparse_detector.format_stats()}")
+            if evaluate_detection_frames:
+                print(f"Comparing sparse with full detection over {evaluate_detection_frames} frames...")
+                with profiler.stage('evaluate_detection', frames=evaluate_detection_frames):
+                    accuracy = tracker.evaluate_sparse_detection(
+                        read_frames(end_frame=evaluate_detection_frames),
+                        tracks
+                    )
+                for class_name, class_accuracy in accuracy.items():
+                    print(f"  {class_name}: recall {class_accuracy['recall']:.3f}, "
+                          f"precision {class_accuracy['precision']:.3f}, mean IoU {class_accuracy['mean_iou']:.3f}")
+                detection_report_path = os.path.splitext(output_path)[0] + '_detection.json'
+                with open(detection_report_path, 'w') as f:
+                    json.dump({
+                        'params': tracker.sparse_detector.get_cache_params(),
+                        'stats': tracker.sparse_detector.stats,
+                        'compute_fraction': tracker.sparse_detector.get_compute_fraction(),
+                        'accuracy_against_full_detection': accuracy
+                    }, f, indent=4)
+                print(f"Sparse detection report saved to {detection_report_path}")
+
+        print("Processing camera movement...")
+        with profiler.stage('camera_movement', frames=num_frames):
+            camera_movement_per_frame = camera_movement_estimator.get_camera_movement_parallel(
+                input_path,
+                num_workers=camera_workers,
+                read_from_stub=True,
+                stub_cache=camera_movement_cache,
+                frame_store=frame_store
+            )
         
         print("Adjusting tracks...")
-        tracks = tracker.adjust_tracks(tracks)
-        tracks['ball'] = tracker.interpolate_ball_positions(tracks['ball'])
-        tracker.add_position_to_tracks(tracks)
+        with profiler.stage('adjust_tracks', frames=num_frames):
+            tracks = tracker.adjust_tracks(tracks)
+        with profiler.stage('interpolate_ball', frames=num_frames):
+            tracks['ball'] = tracker.interpolate_ball_positions(tracks['ball'])
+
+        # Per-row stages run vectorized over a columnar copy of the tracks
+        with profiler.stage('positions', frames=num_frames):
+            track_table = TrackTable.from_tracks(tracks)
+            tracker.add_position_to_tracks(track_table)
 
         # Process camera movement
         print("Processing camera movement...")
-        camera_movement_estimator = CameraMovementEstimator(video_frames[0])
-        camera_movement_per_frame = camera_movement_estimator.get_camera_movement(
-            video_frames,
-            True,
-            'stubs/camera_movement_stub.pkl'
-        )
-        camera_movement_estimator.adjust_position_to_tracks(tracks, camera_movement_per_frame)
+        with profiler.stage('adjust_positions', frames=num_frames):
+            camera_movement_estimator.adjust_position_to_tracks(track_table, camera_movement_per_frame)
 
         # Initialize view transformer with hardcoded values
         print("Setting up view transformation...")
         view_transformer = ViewTransformer()
-        view_transformer.create_visualization(video_frames[0], calibration_dir)
+        with profiler.stage('calibration_visualization'):
+            view_transformer.create_visualization(first_frame, calibration_dir)
         
         # Transform tracks to top-down view
-        tracks = view_transformer.add_transformed_position_to_tracks(tracks)
-        
-        # Initialize speed and distance estimator
+        with profiler.stage('view_transform', frames=num_frames):
+            view_transformer.add_transformed_position_to_tracks(track_table)
+
+        # Initialize speed and distance estimator. Frames are not passed, the
+        # distance visualizations are drawn while annotating instead.
         print("Setting up speed and distance measurements...")
         speed_distance_estimator = SpeedAndDistanceEstimator()
-        speed_distance_estimator.add_speed_and_distance_to_tracks(tracks, video_frames)
+        speed_distance_estimator.frame_rate = fps
+        with profiler.stage('speed_and_distance', frames=num_frames):
+            speed_distance_estimator.add_speed_and_distance_to_tracks(track_table)
+        with profiler.stage('to_tracks', frames=num_frames):
+            tracks = track_table.to_tracks()
 
+        # Ball possession does not depend on the teams, assign it for the
+        # whole match at once. The team in possession is tracked by BallControl
+        # while annotating, once the teams are known
+        player_assigner = PlayerBallAssigner()
+        with profiler.stage('possession', frames=num_frames):
+            assigned_players, _ = player_assigner.assign_ball_to_players(track_table)
+        
         # Generate additional visualizations
         print("Generating additional visualizations...")
-        view_transformer.visualize_trajectory(tracks, video_frames[0], calibration_dir)
-        view_transformer.visualize_heatmap(tracks, video_frames[0], calibration_dir)
+        with profiler.stage('trajectory_visualizations'):
+            view_transformer.visualize_trajectory(tracks, first_frame, calibration_dir)
+            view_transformer.visualize_heatmap(tracks, first_frame, calibration_dir)
 
-        # Process team assignments
+        # Fit team colors
         print("Processing team assignments...")
         team_assigner = TeamAssinger()
-        team_assigner.assign_team_color(video_frames[60], tracks['players'][60])
-        
-        for frame_num, player_track in enumerate(tracks['players']):
-            for player_id, track in player_track.items():
-                player_team_id = team_assigner.assign_player_team(
-                    video_frames[frame_num],
-                    player_id,
-                    track['bbox']
-                )
-                player_color = team_assigner.team_colors[player_team_id]
-                tracks['players'][frame_num][player_id]['team'] = player_team_id
-                tracks['players'][frame_num][player_id]['team_color'] = player_color
+        team_color_frame_num = min(60, len(tracks['players']) - 1)
+        with profiler.stage('team_fit', frames=1):
+            team_assigner.assign_team_color(
+                frame_store[team_color_frame_num] if frame_store is not None
+                else read_frame(input_path, team_color_frame_num),
+                tracks['players'][team_color_frame_num]
+            )
 
-        # Process ball possession
-        print("Processing ball possession...")
-        player_assigner = PlayerBallAssigner()
-        team_ball_control = []
-        for frame_num, player_track in enumerate(tracks['players']):
-            ball_bbox = tracks['ball'][frame_num]['bbox']
-            assigned_player = player_assigner.assign_ball_to_player(player_track, ball_bbox)
-
-            if assigned_player != -1:
-                tracks['players'][frame_num][assigned_player]['has_ball'] = True
-                team_ball_control.append(tracks['players'][frame_num][assigned_player]['team'])
-            else:
-                team_ball_control.append(team_ball_control[-1] if team_ball_control else 0)
+        # Running ball control, each overlay is a lookup in its cumulative counts
+        team_ball_control = BallControl(fps=fps)
 
-        team_ball_control = np.array(team_ball_control)
+        if analytics_dir:
+            # Rows are exported as soon as their frame's teams and possession are final
+            analytics_exporter = AnalyticsExporter(
+                os.path.join(analytics_dir, os.path.splitext(os.path.basename(output_path))[0]),
+                fps=fps,
+                format=analytics_format,
+                video=os.path.abspath(input_path)
+            )
 
-        # Generate output video with annotations
-        print("Generating output video...")
-        output_video_frames = tracker.draw_annotations(video_frames, tracks, team_ball_control)
-        output_video_frames = camera_movement_estimator.draw_camera_movement(
-            output_video_frames, 
-            camera_movement_per_frame
-        )
-        output_video_frames = speed_distance_estimator.draw_speed_and_distance(
-            output_video_frames, 
-            tracks
-        )
+        # Every annotation is drawn in place by one renderer, in a single pass
+        renderer = AnnotationRenderer([
+            ('distance_visualizations', speed_distance_estimator.draw_distance_visualizations),
+            ('tracks', lambda frame, frame_num: tracker.draw_frame_tracks(frame, frame_num, tracks)),
+            ('team_ball_control', lambda frame, frame_num: tracker.draw_team_ball_control(
+                frame,
+                frame_num,
+                team_ball_control
+            )),
+            ('camera_movement', lambda frame, frame_num: camera_movement_estimator.draw_frame_camera_movement(
+                frame,
+                frame_num,
+                camera_movement_per_frame
+            )),
+            ('speed_and_distance', lambda frame, frame_num: speed_distance_estimator.draw_frame_speed_and_distance(
+                frame,
+                frame_num,
+                tracks
+            )),
+        ], profiler=profiler)
+
+        def annotate_frames():
+            """
+            Assign teams and ball possession causally and render every
+            annotation, one frame at a time
+            """
+            frames = iter(read_frames())
+            frame_num = 0
+            while True:
+                start = time.perf_counter()
+                frame = next(frames, None)
+                if frame is None:
+                    break
+                if frame_store is not None:
+                    # Store frames are read-only views, draw on a copy
+                    frame = frame.copy()
+                profiler.add_time('annotate/read', time.perf_counter() - start)
+                player_track = tracks['players'][frame_num]
+
+                # Process team assignments, cached per track and batched per frame
+                start = time.perf_counter()
+                player_teams = team_assigner.assign_players_team(frame, player_track, frame_num)
+                for player_id, player_team_id in player_teams.items():
+                    player_color = team_assigner.team_colors[player_team_id]
+                    player_track[player_id]['team'] = player_team_id
+                    player_track[player_id]['team_color'] = player_color
+                profiler.add_time('annotate/team', time.perf_counter() - start)
+
+                # Process ball possession
+                assigned_player = int(assigned_players[frame_num])
 
-        # Save the processed video
-        print(f"Saving video to {output_path}...")
-        save_video(output_video_frames, output_path)
+                if assigned_player != -1:
+                    player_track[assigned_player]['has_ball'] = True
+                    team_ball_control.append(player_track[assigned_player]['team'])
+                else:
+                    team_ball_control.append(team_ball_control[-1] if len(team_ball_control) else 0)
+
+                if analytics_exporter is not None:
+                    start = time.perf_counter()
+                    analytics_exporter.add_frame(
+                        frame_num,
+                        track_table,
+                        player_track,
+                        ball_player=assigned_player,
+                        camera_movement=camera_movement_per_frame[frame_num],
+                        ball_control_team=team_ball_control[-1]
+                    )
+                    profiler.add_time('annotate/analytics_export', time.perf_counter() - start)
+
+                # Generate output frame with annotations, the time until the
+                # next frame is requested is spent encoding it
+                frame = renderer.render_frame(frame, frame_num)
+                start = time.perf_counter()
+                yield frame
+                profiler.add_time('annotate/save', time.perf_counter() - start)
+                frame_num += 1
+
+        # Annotate and save the processed video as a stream
+        print(f"Generating output video and saving to {output_path}...")
+        with profiler.stage('annotate_and_save', frames=num_frames):
+            save_video(
+                annotate_frames(),
+                output_path,
+                fps=fps,
+                backend=video_backend,
+                codec=codec,
+                crf=crf,
+                threads=video_threads
+            )
+
+        # Export the ball control series next to the video
+        stats_path = os.path.splitext(output_path)[0] + '_ball_control.csv'
+        team_ball_control.save_stats(stats_path)
+        print(f"Ball control statistics saved to {stats_path}")
+
+        if analytics_exporter is not None:
+            with profiler.stage('analytics_summaries'):
+                analytics_exporter.close()
+            print(f"Analytics of {analytics_exporter.num_frames} frames exported to {analytics_exporter.path}")
+
+        profile_path = os.path.splitext(output_path)[0] + '_profile.json'
+        profiler.save(profile_path)
+        print(profiler.format_report())
+        print(f"Stage profile saved to {profile_path}")
         print("Processing completed successfully!")
+        return num_frames
 
     except Exception as e:
         print(f"Error processing video: {str(e)}")
         raise
+    finally:
+        if frame_store is not None:
+            if keep_frame_store and frame_store.complete:
+                frame_store.close()
+            else:
+                frame_store.delete()
+
+def process_stream(source, output_path, drop_policy='drop_oldest', max_latency=None, realtime=False,
+                   video_backend='opencv', codec=None, crf=23, video_threads=0, detection_stride=1,
+                   inference_backend='pytorch', precision='fp32', calibration_data=None):
+    """
+    Process a live source (RTSP/HTTP stream, camera or a file replayed in
+    real time) online, with bounded latency: when processing falls behind,
+    frames are dropped according to drop_policy (see LivePipeline).
+    Args:
+        source: Stream URL, device index or video file
+        output_path: Path to save the annotated stream
+        drop_policy: 'drop_oldest', 'drop_newest' or 'block'
+        max_latency: Seconds a frame may wait before it is dropped
+        realtime: Replay a file source at its native frame rate
+        video_backend, codec, crf, video_threads: Encoding of the output, see
+            process_video
+        detection_stride: Detect every detection_stride-th frame, see process_video
+        inference_backend, precision, calibration_data: Inference runtime of
+            the model, see process_video
+    """
+    try:
+        print(f"Processing stream {source}...")
+        pipeline = LivePipeline(
+            "models/best.pt",
+            tracker=Tracker(
+                "models/best.pt",
+                detection_stride=detection_stride,
+                inference_backend=inference_backend,
+                precision=precision,
+                calibration_data=calibration_data
+            ),
+            drop_policy=drop_policy,
+            max_latency=max_latency,
+            realtime=realtime
+        )
+        # Frames are encoded on the writer's thread, at the source frame rate
+        # known once the pipeline has opened the source
+        writer = None
+        try:
+            for _, frame in pipeline.run(source):
+                if writer is None:
+                    writer = VideoWriter(
+                        output_path,
+                        fps=pipeline.fps,
+                        backend=video_backend,
+                        codec=codec,
+                        crf=crf,
+                        threads=video_threads
+                    )
+                writer.write(frame)
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        if writer is None:
+            raise ValueError("No frames to save")
+        writer.close()
+        print(f"Live pipeline: {pipeline.format_stats()}")
+
+        # Per-frame stage timings and the end-to-end latency histogram
+        profile_path = os.path.splitext(output_path)[0] + '_profile.json'
+        pipeline.profiler.save(profile_path)
+        print(pipeline.profiler.format_report())
+        print(f"Stage profile saved to {profile_path}")
+
+        stats_path = os.path.splitext(output_path)[0] + '_ball_control.csv'
+        pipeline.team_ball_control.save_stats(stats_path)
+        print(f"Ball control statistics saved to {stats_path}")
+
+    except Exception as e:
+        print(f"Error processing stream: {str(e)}")
+        raise
+
+def process_batch(input_path, output_dir, num_workers=2, memory_limit_mb=None, tracker_options=None, **video_options):
+    """
+    Process every video of a directory or manifest over a pool of worker
+    processes, each loading the model once. Progress is kept in
+    <output_dir>/batch_status.json, so an interrupted batch resumes where it
+    stopped (see BatchRunner).
+    Args:
+        input_path: Directory of videos or manifest file
+        output_dir: Directory of the output videos
+        num_workers: Number of worker processes
+        memory_limit_mb: Memory limit of each job
+        tracker_options: inference_backend, precision and calibration_data
+            of the workers' trackers, see process_video
+        video_options: video_backend, codec, crf, video_threads, hwaccel,
+            detection_stride, frame_store_dir, keep_frame_store,
+            analytics_dir and analytics_format of every job, see process_video
+    Returns:
+        {job name: status}
+    """
+    # The workers split the CPUs, don't let each one start a camera movement pool
+    runner = BatchRunner(
+        process_video,
+        num_workers=num_workers,
+        memory_limit_mb=memory_limit_mb,
+        tracker_options=tracker_options,
+        camera_workers=1,
+        **video_options
+    )
+    return runner.run(input_path, output_dir)
 
 def main():
+    parser = argparse.ArgumentParser(description="Football video analysis")
+    parser.add_argument('--batch', help="Directory or manifest of videos to process in a batch")
+    parser.add_argument('--stream', default=None,
+                        help="Process a live source online: RTSP/HTTP URL, camera index or video file")
+    parser.add_argument('--drop-policy', choices=['drop_oldest', 'drop_newest', 'block'], default='drop_oldest',
+                        help="What to do with frames of a live source when processing falls behind")
+    parser.add_argument('--max-latency', type=float, default=None,
+                        help="Seconds a live frame may wait before it is dropped")
+    parser.add_argument('--realtime', action='store_true',
+                        help="Replay a video file given to --stream at its native frame rate")
+    parser.add_argument('--output-dir', default='output_videos', help="Output directory of a batch")
+    parser.add_argument('--workers', type=int, default=2, help="Worker processes of a batch")
+    parser.add_argument('--memory-limit', type=int, default=None, help="Memory limit per batch job, in MB")
+    parser.add_argument('--tracking-workers', type=int, default=1,
+                        help="Track time segments of the video in parallel processes")
+    parser.add_argument('--profile-dir', default=None, help="Save cProfile stats of every stage to this directory")
+    parser.add_argument('--video-backend', choices=['opencv', 'ffmpeg'], default='opencv',
+                        help="Video decoding and encoding backend")
+    parser.add_argument('--codec', default=None,
+                        help="Output codec: FourCC for opencv (mp4v), ffmpeg encoder for ffmpeg (libx264, h264_nvenc)")
+    parser.add_argument('--crf', type=int, default=23, help="Constant rate factor of the ffmpeg encoder")
+    parser.add_argument('--video-threads', type=int, default=0,
+                        help="ffmpeg decoder and encoder threads, 0 for automatic")
+    parser.add_argument('--hwaccel', default=None, help="ffmpeg hardware decoding method, e.g. auto or cuda")
+    parser.add_argument('--detection-stride', type=int, default=1,
+                        help="Detect every k-th frame and propagate the boxes in between with optical flow")
+    parser.add_argument('--evaluate-detection', type=int, default=0,
+                        help="Compare sparse with full detection over this many first frames")
+    parser.add_argument('--inference-backend', choices=['pytorch', 'torchscript', 'onnx', 'openvino'], default='pytorch',
+                        help="Inference runtime, the model is exported once to models/exported")
+    parser.add_argument('--precision', choices=['fp32', 'fp16', 'int8'], default='fp32',
+                        help="Precision of the exported model (fp16: openvino, int8: onnx and openvino)")
+    parser.add_argument('--calibration-data', default=None,
+                        help="Dataset YAML calibrating int8 OpenVINO exports")
+    parser.add_argument('--frame-store', default=None,
+                        help="Decode the video once into a memory-mapped frame store in this directory (local disk)")
+    parser.add_argument('--keep-frame-store', action='store_true',
+                        help="Keep the frame store for the next run on the same video")
+    parser.add_argument('--analytics-dir', default=None,
+                        help="Export tracks, possession and player and team summaries to this directory")
+    parser.add_argument('--analytics-format', choices=['npz', 'parquet'], default='npz',
+                        help="File format of the analytics export (parquet needs pyarrow)")
+    args = parser.parse_args()
+
+    video_options = {
+        'video_backend': args.video_backend,
+        'codec': args.codec,
+        'crf': args.crf,
+        'video_threads': args.video_threads,
+        'hwaccel': args.hwaccel,
+        'detection_stride': args.detection_stride,
+        'frame_store_dir': args.frame_store,
+        'keep_frame_store': args.keep_frame_store,
+        'analytics_dir': args.analytics_dir,
+        'analytics_format': args.analytics_format
+    }
+    tracker_options = {
+        'inference_backend': args.inference_backend,
+        'precision': args.precision,
+        'calibration_data': args.calibration_data
+    }
+
+    if args.batch:
+        process_batch(args.batch, args.output_dir, args.workers, args.memory_limit, tracker_options, **video_options)
+        return
+
+    if args.stream is not None:
+        os.makedirs('output_videos', exist_ok=True)
+        process_stream(
+            # A bare number is a camera index
+            int(args.stream) if args.stream.isdigit() else args.stream,
+            'output_videos/output_stream.mp4',
+            drop_policy=args.drop_policy,
+            max_latency=args.max_latency,
+            realtime=args.realtime,
+            video_backend=args.video_backend,
+            codec=args.codec,
+            crf=args.crf,
+            video_threads=args.video_threads,
+            detection_stride=args.detection_stride,
+            **tracker_options
+        )
+        return
+
     # Define input and output paths
     input_video = 'input_videos/bundesliga.mp4'
     output_video = 'output_videos/output_video.mp4'
@@ -136,7 +600,15 @@ def main():
     os.makedirs(os.path.dirname(output_video), exist_ok=True)
 
     # Process the video
-    process_video(input_video, output_video)
+    process_video(
+        input_video,
+        output_video,
+        tracking_workers=args.tracking_workers,
+        profile_dir=args.profile_dir,
+        evaluate_detection_frames=args.evaluate_detection,
+        **video_options,
+        **tracker_options
+    )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
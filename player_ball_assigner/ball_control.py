@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+class BallControl():
+    """
+    Running team ball control of a match.
+
+    Stores the cumulative number of frames each team had the ball, so the
+    ball control of the match so far, or of any trailing window (e.g. the
+    last 5 minutes), is a difference of two cumulative counts: O(1) per
+    frame instead of re-counting every previous frame.
+
+    Frames are added one at a time while annotating (append), since the team
+    of a player is only known once its frame is annotated, or for a whole
+    match of known teams at once (extend).
+    """
+    def __init__(self,fps=24,windows=None):
+        """
+        Args:
+            fps: Frame rate, to turn window lengths in seconds into frames
+            windows: {name: seconds} of the trailing windows to export,
+                the last 5 minutes by default
+        """
+        self.fps = fps
+        self.windows = {'last_5_min':5*60} if windows is None else dict(windows)
+        self.team_ball_control = []
+        # cumulative_team_1[n] is the number of team 1 frames among the first n
+        self.cumulative_team_1 = [0]
+        self.cumulative_team_2 = [0]
+
+    def __len__(self):
+        return len(self.team_ball_control)
+
+    def __getitem__(self,frame_num):
+        return self.team_ball_control[frame_num]
+
+    def append(self,team):
+        team = int(team)
+        self.team_ball_control.append(team)
+        self.cumulative_team_1.append(self.cumulative_team_1[-1]+(team == 1))
+        self.cumulative_team_2.append(self.cumulative_team_2[-1]+(team == 2))
+
+    def extend(self,team_ball_control):
+        team_ball_control = np.asarray(team_ball_control,dtype=np.int64)
+        self.team_ball_control.extend(team_ball_control.tolist())
+        self.cumulative_team_1.extend((self.cumulative_team_1[-1]+np.cumsum(team_ball_control == 1)).tolist())
+        self.cumulative_team_2.extend((self.cumulative_team_2[-1]+np.cumsum(team_ball_control == 2)).tolist())
+
+    def _window_frames(self,window):
+        if window is None:
+            return None
+        if isinstance(window,str):
+            window = self.windows[window]
+            return int(round(window*self.fps))
+        return int(window)
+
+    def get_ball_control(self,frame_num,window=None):
+        """
+        Args:
+            frame_num: Last frame counted
+            window: None for the whole match so far, a name from windows, or
+                a number of frames
+        Returns:
+            (team 1 fraction, team 2 fraction). Like the original overlay,
+            frames before anyone had the ball count for team 2.
+        """
+        end = frame_num+1
+        window_frames = self._window_frames(window)
+        start = 0 if window_frames is None else max(end-window_frames,0)
+        team_1 = (self.cumulative_team_1[end]-self.cumulative_team_1[start])/(end-start)
+        return team_1,1-team_1
+
+    def get_stats(self):
+        """
+        Returns:
+            DataFrame with one row per frame: the team in possession and the
+            ball control of both teams over the match so far and over every
+            trailing window, as fractions
+        """
+        num_frames = len(self)
+        end = np.arange(1,num_frames+1)
+        cumulative_team_1 = np.asarray(self.cumulative_team_1)
+        cumulative_team_2 = np.asarray(self.cumulative_team_2)
+
+        stats = {'frame':np.arange(num_frames),'team_ball_control':np.asarray(self.team_ball_control,dtype=np.int64)}
+        stats['team_1_match'] = cumulative_team_1[1:]/end
+        stats['team_2_match'] = 1-stats['team_1_match']
+        for name in self.windows:
+            start = np.maximum(end-self._window_frames(name),0)
+            stats[f'team_1_{name}'] = (cumulative_team_1[end]-cumulative_team_1[start])/(end-start)
+            stats[f'team_2_{name}'] = 1-stats[f'team_1_{name}']
+        stats['team_1_frames'] = cumulative_team_1[1:]
+        stats['team_2_frames'] = cumulative_team_2[1:]
+
+        return pd.DataFrame(stats)
+
+    def save_stats(self,path):
+        """
+        Export the per-frame ball control series, as JSON if path ends with
+        .json and as CSV otherwise
+        """
+        stats = self.get_stats()
+        if path.endswith('.json'):
+            stats.to_json(path,orient='records',indent=4)
+        else:
+            stats.to_csv(path,index=False)
@@ -1,4 +1,5 @@
 import sys
+import numpy as np
 sys.path.append('../')
 from utils import get_center_bbox,measure_distance
 
@@ -14,14 +15,98 @@ class PlayerBallAssigner():
 
         for player_id,player in players.items():
             player_bbox = player['bbox']
-            
+
             distance_left = measure_distance((player_bbox[0],player_bbox[-1]),(ball_position))
             distance_right = measure_distance((player_bbox[2],player_bbox[-1]),(ball_position))
 
             distance = min(distance_left,distance_right)
 
-            if self.max_player_ball_distance and distance < minimum_distance:
+            if self.max_player_ball_distance and distance >= self.max_player_ball_distance:
+                continue
+            if distance < minimum_distance:
                 minimum_distance = distance
                 assigned_player = player_id
-            
-        return assigned_player
\ No newline at end of file
+
+        return assigned_player
+
+    def get_ball_possession(self,ball_positions,player_frames,player_ids,player_bboxes):
+        """
+        Assign the ball for a whole match in one NumPy computation, same rule
+        as assign_ball_to_player: the player whose foot corner (bottom left or
+        bottom right of the bbox) is closest to the ball, if closer than
+        max_player_ball_distance.
+        Args:
+            ball_positions: (F, 2) ball center of every frame, NaN if no ball
+            player_frames: (N,) frame of every player row
+            player_ids: (N,) track id of every player row
+            player_bboxes: (N, 4) bbox of every player row
+        Returns:
+            assigned_player: (F,) track id with the ball, -1 if none
+            assigned_row: (F,) player row with the ball, -1 if none
+        """
+        ball_positions = np.asarray(ball_positions,dtype=np.float64).reshape(-1,2)
+        player_frames = np.asarray(player_frames,dtype=np.int64)
+        player_bboxes = np.asarray(player_bboxes,dtype=np.float64).reshape(-1,4)
+        num_frames = len(ball_positions)
+
+        # Distance from every player row to the ball of its frame
+        ball_x = ball_positions[player_frames,0]
+        ball_y = ball_positions[player_frames,1]
+        delta_y = player_bboxes[:,3]-ball_y
+        delta_left = player_bboxes[:,0]-ball_x
+        delta_right = player_bboxes[:,2]-ball_x
+        distance = np.minimum(
+            np.sqrt(delta_left*delta_left+delta_y*delta_y),
+            np.sqrt(delta_right*delta_right+delta_y*delta_y)
+        )
+
+        is_candidate = ~np.isnan(distance)
+        if self.max_player_ball_distance:
+            is_candidate &= distance < self.max_player_ball_distance
+
+        # Closest candidate per frame, the first row wins ties like the loop
+        candidate_rows = np.flatnonzero(is_candidate)
+        order = np.lexsort((candidate_rows,distance[candidate_rows],player_frames[candidate_rows]))
+        candidate_rows = candidate_rows[order]
+        frames_with_ball,first = np.unique(player_frames[candidate_rows],return_index=True)
+
+        assigned_row = np.full(num_frames,-1,dtype=np.int64)
+        assigned_row[frames_with_ball] = candidate_rows[first]
+        assigned_player = np.full(num_frames,-1,dtype=np.int64)
+        assigned_player[frames_with_ball] = np.asarray(player_ids,dtype=np.int64)[candidate_rows[first]]
+
+        return assigned_player,assigned_row
+
+    def assign_ball_to_players(self,track_table):
+        """
+        Bulk possession over a TrackTable: sets has_ball on the assigned
+        player rows
+        Returns:
+            assigned_player: (F,) track id with the ball, -1 if none
+            assigned_row: (F,) table row with the ball, -1 if none
+        """
+        ball_positions = np.full((track_table.num_frames,2),np.nan)
+        is_ball = track_table.class_mask('ball')
+        ball_bboxes = track_table.bbox[is_ball]
+        # Whole pixels like get_center_bbox
+        ball_positions[track_table.frame[is_ball]] = np.trunc(np.stack([
+            (ball_bboxes[:,0]+ball_bboxes[:,2])/2,
+            (ball_bboxes[:,1]+ball_bboxes[:,3])/2
+        ],axis=1))
+
+        player_rows = np.flatnonzero(track_table.class_mask('players'))
+        assigned_player,assigned_row = self.get_ball_possession(
+            ball_positions,
+            track_table.frame[player_rows],
+            track_table.track_id[player_rows],
+            track_table.bbox[player_rows]
+        )
+
+        # Map back from player rows to table rows
+        has_ball = assigned_row != -1
+        assigned_row[has_ball] = player_rows[assigned_row[has_ball]]
+        track_table.has_ball[:] = False
+        track_table.has_ball[assigned_row[has_ball]] = True
+        track_table.computed.add('has_ball')
+
+        return assigned_player,assigned_row
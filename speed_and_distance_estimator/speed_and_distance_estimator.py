@@ -1,10 +1,8 @@
 import cv2
 import numpy as np
 import sys
-import os
-import json
 sys.path.append('../')
-from utils import measure_distance, get_foot_position
+from utils import get_foot_position, TrackTable, TRACK_CLASSES
 
 class SpeedAndDistanceEstimator():
     def __init__(self):
@@ -15,123 +13,249 @@ class SpeedAndDistanceEstimator():
         self.min_speed = 0.1  # Minimum reasonable speed in km/h
         self.speed_history = {}  # Store speed history for smoothing
         self.debug_log = []  # Store debug information
+        # Online mode state (update_frame_speed_and_distance)
+        self.live_windows = {}  # (object, track_id) -> [start frame, start position, last seen frame]
+        self.live_measurements = {}  # (object, track_id) -> (speed, distance)
+        self._last_prune = 0  # Frame of the last pass over stale live tracks
+        # Distance segments drawn on the first frame of every window, as
+        # columns sorted by frame: frame, start, end, distance, speed
+        self.distance_visualizations = {
+            'frame': np.empty(0, dtype=np.int64),
+            'start': np.empty((0, 2)),
+            'end': np.empty((0, 2)),
+            'distance': np.empty(0),
+            'speed': np.empty(0)
+        }
 
     def add_speed_and_distance_to_tracks(self, tracks, frames=None):
         """
         Add speed and distance measurements to all tracks
         Args:
-            tracks: Dictionary containing track data with transformed positions
-            frames: Optional list of video frames for visualization
+            tracks: Dictionary containing track data with transformed positions,
+                or a TrackTable
+            frames: Optional list of video frames for visualization. When frames
+                are streamed instead, the segments are kept in
+                self.distance_visualizations and drawn later with
+                draw_distance_visualizations
         """
-        total_distance_covered = {}
-        for obj_name, obj in tracks.items():
+        if isinstance(tracks, TrackTable):
+            self._add_speed_and_distance_to_table(tracks, frames)
+            return tracks
+
+        track_table = TrackTable.from_tracks(tracks)
+        rows = self._add_speed_and_distance_to_table(track_table, frames)
+
+        # Write the measured rows back into the dicts
+        for class_id, frame_num, track_id, speed, distance in zip(
+            track_table.class_id[rows].tolist(),
+            track_table.frame[rows].tolist(),
+            track_table.track_id[rows].tolist(),
+            track_table.speed[rows].tolist(),
+            track_table.distance[rows].tolist()
+        ):
+            track_info = tracks[TRACK_CLASSES[class_id]][frame_num][track_id]
+            track_info['speed'] = speed
+            track_info['distance'] = distance
+        return tracks
+
+    def _add_speed_and_distance_to_table(self, track_table, frames=None):
+        """
+        Vectorized speed and distance over a whole match. Same logic as the
+        original per-window loop, with every step as array operations:
+
+        - every track present in frame w (w a multiple of frame_window) and in
+          frame last = min(w + frame_window, number_of_frames - 1) gets one
+          measurement from its transformed positions
+        - the speed is the mean of the track's last 5 measurements, capped at
+          max_speed (with the distance capped to match); windows slower than
+          min_speed are dropped
+        - the distance is the cumulative sum of the kept windows, and speed and
+          distance are written to the track's rows of frames w to last - 1
+        Returns:
+            Indices of the rows that were written
+        """
+        table = track_table
+        num_frames = table.num_frames
+        table.speed = np.full(len(table), np.nan)
+        table.distance = np.full(len(table), np.nan)
+        table.computed.update(['speed', 'distance'])
+
+        # Rows of every object but the ball in (class, track, frame) order, so
+        # their (track, frame) keys are sorted
+        rows = table.track_order[~table.class_mask('ball')[table.track_order]]
+        track_num = np.empty(len(table), dtype=np.int64)
+        track_num[table.track_order] = np.repeat(np.arange(len(table.track_keys)), np.diff(table.track_offsets))
+        row_frame = table.frame[rows]
+        row_keys = track_num[rows] * (num_frames + 1) + row_frame
+
+        # One measurement per track per window, where both ends are on the field
+        is_window_start = row_frame % self.frame_window == 0
+        start_rows = rows[is_window_start]
+        window_start = row_frame[is_window_start]
+        window_end = np.minimum(window_start + self.frame_window, num_frames - 1)
+        end_keys = row_keys[is_window_start] - window_start + window_end
+        end_index = np.searchsorted(row_keys, end_keys).clip(0, max(len(rows) - 1, 0))
+        end_rows = rows[end_index] if len(rows) else end_index
+        is_measured = ((row_keys[end_index] == end_keys if len(rows) else np.zeros(0, dtype=bool))
+                       & ~np.isnan(table.position_transformed[start_rows, 0])
+                       & ~np.isnan(table.position_transformed[end_rows, 0]))
+        start_rows, end_rows = start_rows[is_measured], end_rows[is_measured]
+        window_start, window_end = window_start[is_measured], window_end[is_measured]
+        num_measurements = len(start_rows)
+
+        start_position = table.position_transformed[start_rows]
+        end_position = table.position_transformed[end_rows]
+        distance_covered = np.linalg.norm(end_position - start_position, axis=1)
+        time_elapsed = (window_end - window_start) / self.frame_rate
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speed_km_per_hour = distance_covered / time_elapsed * 3.6
+
+        # Speed history is keyed by track id and filled players first, then
+        # referees, in frame order
+        track_id = table.track_id[start_rows]
+        order = np.lexsort((window_start, table.class_id[start_rows], track_id))
+        sorted_track_id = track_id[order]
+        is_new_history = np.ones(num_measurements, dtype=bool)
+        is_new_history[1:] = sorted_track_id[1:] != sorted_track_id[:-1]
+        history_start = np.maximum.accumulate(np.where(is_new_history, np.arange(num_measurements), 0))
+        history_position = np.arange(num_measurements) - history_start
+
+        # Moving average of the last 5 speeds, summed oldest first like np.mean
+        sorted_speed = speed_km_per_hour[order]
+        speed_sum = np.zeros(num_measurements)
+        for lag in range(4, -1, -1):
+            lagged_speed = np.zeros(num_measurements)
+            lagged_speed[lag:] = sorted_speed[:num_measurements - lag]
+            lagged_speed[history_position < lag] = 0.0
+            speed_sum = speed_sum + lagged_speed
+        smoothed_speed = np.empty(num_measurements)
+        smoothed_speed[order] = speed_sum / np.minimum(history_position + 1, 5)
+
+        # Validate speed: cap unrealistic speeds and drop very slow movements
+        is_capped = smoothed_speed > self.max_speed
+        if is_capped.any():
+            print(f"Warning: {int(is_capped.sum())} unrealistic speeds above {self.max_speed} km/h capped "
+                  f"(up to {smoothed_speed[is_capped].max():.2f} km/h)")
+        smoothed_speed[is_capped] = self.max_speed
+        distance_covered[is_capped] = (smoothed_speed[is_capped] / 3.6) * time_elapsed[is_capped]
+        kept = np.flatnonzero(~(smoothed_speed < self.min_speed))
+
+        # Cumulative distance per track, measurements are already in track and
+        # frame order
+        kept_track_num = track_num[start_rows[kept]]
+        track_starts = np.flatnonzero(np.diff(kept_track_num)) + 1
+        total_distance = np.concatenate(
+            [np.cumsum(part) for part in np.split(distance_covered[kept], track_starts)]
+        ) if len(kept) else np.empty(0)
+
+        # Every row takes the kept measurement of its window, if any: the last
+        # window start row before it, when that row is of the same track and
+        # window
+        kept_index = np.full(len(rows), -1, dtype=np.int64)
+        kept_index[np.flatnonzero(is_window_start)[is_measured][kept]] = np.arange(len(kept))
+        window_start_position = np.maximum.accumulate(np.where(is_window_start, np.arange(len(rows)), 0))
+        index = kept_index[window_start_position]
+        is_written = ((index >= 0)
+                      & (row_keys[window_start_position] == row_keys - row_frame % self.frame_window))
+        is_written[is_written] &= row_frame[is_written] < window_end[kept[index[is_written]]]
+        written_rows = rows[is_written]
+        table.speed[written_rows] = smoothed_speed[kept[index[is_written]]]
+        table.distance[written_rows] = total_distance[index[is_written]]
+
+        # Segment drawn on the first frame of every kept window, in row order
+        visualized = kept[window_end[kept] > window_start[kept]]
+        visualized = visualized[np.argsort(start_rows[visualized], kind='stable')]
+        visualizations = {
+            'frame': window_start[visualized],
+            'start': start_position[visualized],
+            'end': end_position[visualized],
+            'distance': distance_covered[visualized],
+            'speed': smoothed_speed[visualized]
+        }
+        self.distance_visualizations = {
+            name: np.concatenate([self.distance_visualizations[name], column])
+            for name, column in visualizations.items()
+        }
+        order = np.argsort(self.distance_visualizations['frame'], kind='stable')
+        self.distance_visualizations = {name: column[order] for name, column in self.distance_visualizations.items()}
+
+        if frames is not None:
+            for frame_num in np.unique(visualizations['frame']).tolist():
+                frame = frames[frame_num].copy()
+                self.draw_distance_visualizations(frame, frame_num)
+                frames[frame_num] = frame
+
+        return written_rows
+
+    def update_frame_speed_and_distance(self, frame_num, frame_tracks):
+        """
+        Online mode: speed and distance over a trailing window, for the next
+        frame of a stream. A track is measured once its last measurement is
+        frame_window frames old, with the same smoothing, capping and
+        cumulative distance as add_speed_and_distance_to_tracks, and its
+        latest measurement is written to every frame until the next one.
+        Frame numbers may skip frames (dropped frames), time is taken from them.
+        Args:
+            frame_num: Frame number in the stream
+            frame_tracks: {'players': {track_id: track_info}, ...} of one frame,
+                with transformed positions
+        """
+        for obj_name, obj in frame_tracks.items():
             if obj_name == 'ball' or obj_name == 'referee':
                 continue
 
-            number_of_frames = len(obj)
+            for track_id, track_info in obj.items():
+                track_key = (obj_name, track_id)
+                position_transformed = track_info.get('position_transformed')
+                window = self.live_windows.get(track_key)
 
-            for frame_num in range(0, number_of_frames, self.frame_window):
-                last_frame = min(frame_num + self.frame_window, number_of_frames - 1)
+                if position_transformed is not None:
+                    if window is None:
+                        window = self.live_windows[track_key] = [frame_num, position_transformed, frame_num]
+                    elif frame_num - window[0] >= self.frame_window:
+                        self._add_live_measurement(track_key, window, frame_num, position_transformed)
+                        window[0], window[1] = frame_num, position_transformed
+                if window is not None:
+                    window[2] = frame_num
 
-                for track_id, track_info in obj[frame_num].items():
-                    if track_id not in obj[last_frame]:
-                        continue
-                    
-                    # Get both original and transformed positions
-                    start_position = track_info['position']
-                    end_position = obj[last_frame][track_id]['position']
-                    start_position_transformed = track_info['position_transformed']
-                    end_position_transformed = obj[last_frame][track_id]['position_transformed']
+                if track_key in self.live_measurements:
+                    track_info['speed'], track_info['distance'] = self.live_measurements[track_key]
 
-                    if start_position_transformed is None or end_position_transformed is None:
-                        continue
+        # Forget tracks that have not been seen for 10 seconds, checked about
+        # once a second (the frame rate need not be an integer and dropped
+        # frames skip frame numbers)
+        if frame_num - self._last_prune >= self.frame_rate:
+            self._last_prune = frame_num
+            for track_key in [key for key, window in self.live_windows.items()
+                              if frame_num - window[2] > 10 * self.frame_rate]:
+                self.live_windows.pop(track_key)
+                self.live_measurements.pop(track_key, None)
+                self.speed_history.pop(track_key, None)
+                self.total_distance_covered.get(track_key[0], {}).pop(track_key[1], None)
 
-                    # Calculate distance in meters using transformed positions
-                    distance_covered = np.linalg.norm(np.array(end_position_transformed) - np.array(start_position_transformed))
+    def _add_live_measurement(self, track_key, window, frame_num, end_position_transformed):
+        obj_name, track_id = track_key
+        start_frame, start_position_transformed, _ = window
 
-                    
-                    # Calculate time in seconds
-                    time_elapsed = (last_frame - frame_num) / self.frame_rate
-                    
-                    # Calculate speed in km/h
-                    speed_meters_per_second = distance_covered / time_elapsed
-                    speed_km_per_hour = speed_meters_per_second * 3.6
-
-                    # # Log positions for debugging (every 30 frames)
-                    # # if frame_num % 30 == 0:
-                    # debug_info = {
-                    #     'frame': frame_num,
-                    #     'track_id': track_id,
-                    #     'start_pos': start_position,
-                    #     'end_pos': end_position,
-                    #     'start_pos_transformed': start_position_transformed,
-                    #     'end_pos_transformed': end_position_transformed
-                    # }
-                    # self.debug_log.append(debug_info)
-                    # print(f"\nDebug Info for Frame {frame_num}, Track {track_id}:")
-                    # print(f"Original Start: {start_position}")
-                    # print(f"Original End: {end_position}")
-                    # print(f"Transformed Start: {start_position_transformed}")
-                    # print(f"Transformed End: {end_position_transformed}")
-                    # print(f"Distance Covered: {distance_covered}")
-                    # print(f"Time Elapsed: {time_elapsed}")
-                    # print(f"Speed: {speed_km_per_hour}")
-
-                    # Initialize speed history for this track if not exists
-                    if track_id not in self.speed_history:
-                        self.speed_history[track_id] = []
-
-                    # Add current speed to history
-                    self.speed_history[track_id].append(speed_km_per_hour)
-                    
-                    # Keep only last 5 speed measurements
-                    if len(self.speed_history[track_id]) > 5:
-                        self.speed_history[track_id].pop(0)
-                    
-                    # Calculate smoothed speed using moving average
-                    smoothed_speed = np.mean(self.speed_history[track_id])
-
-                    # Validate speed
-                    if smoothed_speed > self.max_speed:
-                        print(f"Warning: Unrealistic speed detected: {smoothed_speed:.2f} km/h")
-                        # Cap the speed and adjust distance accordingly
-                        smoothed_speed = self.max_speed
-                        distance_covered = (smoothed_speed / 3.6) * time_elapsed
-                    elif smoothed_speed < self.min_speed:
-                        # Ignore very slow movements (likely noise)
-                        continue
+        distance_covered = np.linalg.norm(np.array(end_position_transformed) - np.array(start_position_transformed))
+        time_elapsed = (frame_num - start_frame) / self.frame_rate
+        speed_km_per_hour = distance_covered / time_elapsed * 3.6
 
-                    if obj_name not in total_distance_covered:
-                        total_distance_covered[obj_name] = {}
-
-                    if track_id not in total_distance_covered[obj_name]:
-                        total_distance_covered[obj_name][track_id] = 0
-
-                    total_distance_covered[obj_name][track_id] += distance_covered
-
-                    # Add measurements to all frames in the window
-                    for frame_num_batch in range(frame_num, last_frame):
-                        if track_id not in tracks[obj_name][frame_num_batch]:
-                            continue
-                        tracks[obj_name][frame_num_batch][track_id]['speed'] = smoothed_speed
-                        tracks[obj_name][frame_num_batch][track_id]['distance'] = total_distance_covered[obj_name][track_id]
-                        
-                        # Visualize distance and speed for the first frame in the window
-                        if frame_num_batch == frame_num and frames is not None:
-                            frame = frames[frame_num_batch].copy()
-                            self._visualize_distance_between_frames(
-                                frame,
-                                start_position_transformed,
-                                end_position_transformed,
-                                distance_covered,
-                                smoothed_speed
-                            )
-                            frames[frame_num_batch] = frame
-
-        # Save debug log to file
-        if self.debug_log:
-            with open('debug_positions.json', 'w') as f:
-                json.dump(self.debug_log, f, indent=4)
+        speed_history = self.speed_history.setdefault(track_key, [])
+        speed_history.append(speed_km_per_hour)
+        if len(speed_history) > 5:
+            speed_history.pop(0)
+        smoothed_speed = np.mean(speed_history)
+
+        if smoothed_speed > self.max_speed:
+            smoothed_speed = self.max_speed
+            distance_covered = (smoothed_speed / 3.6) * time_elapsed
+        elif smoothed_speed < self.min_speed:
+            return
+
+        total_distance_covered = self.total_distance_covered.setdefault(obj_name, {})
+        total_distance_covered[track_id] = total_distance_covered.get(track_id, 0) + distance_covered
+        self.live_measurements[track_key] = (smoothed_speed, total_distance_covered[track_id])
 
     def _visualize_distance_between_frames(self, frame, start_pos, end_pos, distance, speed):
         """
@@ -156,6 +280,56 @@ class SpeedAndDistanceEstimator():
                    (mid_point[0], mid_point[1] + 10),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
 
+    def draw_distance_visualizations(self, frame, frame_num):
+        """
+        Draw the distance segments recorded for frame_num onto frame in place
+        """
+        visualizations = self.distance_visualizations
+        first, last = np.searchsorted(visualizations['frame'], [frame_num, frame_num + 1])
+        for index in range(first, last):
+            self._visualize_distance_between_frames(
+                frame,
+                visualizations['start'][index].tolist(),
+                visualizations['end'][index].tolist(),
+                visualizations['distance'][index],
+                visualizations['speed'][index]
+            )
+        return frame
+
+    def draw_frame_speed_and_distance(self, frame, frame_num, tracks):
+        """
+        Draw speed and distance measurements on a single frame in place
+        """
+        for obj_name, obj in tracks.items():
+            if obj_name == 'ball' or obj_name == 'referee':
+                continue
+
+            for _, track_info in obj[frame_num].items():
+                if "speed" in track_info:
+                    speed = track_info.get('speed', None)
+                    distance = track_info.get('distance', None)
+
+                    if speed is None or distance is None:
+                        continue
+
+                    bbox = track_info['bbox']
+                    position = list(get_foot_position(bbox))
+                    position[1] += 40
+
+                    position = tuple(map(int, position))
+                    # Draw speed with background for better visibility
+                    cv2.putText(frame, f"{speed:.2f} km/h", position, 
+                              cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 3)
+                    cv2.putText(frame, f"{speed:.2f} km/h", position, 
+                              cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
+                    
+                    # Draw distance with background
+                    cv2.putText(frame, f"{distance:.2f} m", (position[0], position[1] + 20), 
+                              cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 3)
+                    cv2.putText(frame, f"{distance:.2f} m", (position[0], position[1] + 20), 
+                              cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
+        return frame
+
     def draw_speed_and_distance(self, frames, tracks):
         """
         Draw speed and distance measurements on frames
@@ -163,34 +337,7 @@ class SpeedAndDistanceEstimator():
         output_frames = []
 
         for frame_num, frame in enumerate(frames):
-            for obj_name, obj in tracks.items():
-                if obj_name == 'ball' or obj_name == 'referee':
-                    continue
-
-                for _, track_info in obj[frame_num].items():
-                    if "speed" in track_info:
-                        speed = track_info.get('speed', None)
-                        distance = track_info.get('distance', None)
-
-                        if speed is None or distance is None:
-                            continue
-
-                        bbox = track_info['bbox']
-                        position = list(get_foot_position(bbox))
-                        position[1] += 40
-
-                        position = tuple(map(int, position))
-                        # Draw speed with background for better visibility
-                        cv2.putText(frame, f"{speed:.2f} km/h", position, 
-                                  cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 3)
-                        cv2.putText(frame, f"{speed:.2f} km/h", position, 
-                                  cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
-                        
-                        # Draw distance with background
-                        cv2.putText(frame, f"{distance:.2f} m", (position[0], position[1] + 20), 
-                                  cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 3)
-                        cv2.putText(frame, f"{distance:.2f} m", (position[0], position[1] + 20), 
-                                  cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
+            frame = self.draw_frame_speed_and_distance(frame, frame_num, tracks)
             output_frames.append(frame)
 
         return output_frames
@@ -1,13 +1,29 @@
+from collections import Counter, OrderedDict, deque
 from sklearn.cluster import KMeans
 import numpy as np
 
 class TeamAssinger():
+    """
+    Assigns players to teams by jersey color.
 
-    def __init__(self):
+    Fitting KMeans on a player crop is the expensive part, so the team of
+    every track is cached: a track is sampled on consecutive frames until
+    stable_samples predictions agree, after which the label is reused and
+    the track is only re-sampled every resample_interval frames. A track
+    whose re-sample disagrees (e.g. its id moved to another player) goes back
+    to sampling every frame and keeps the majority label of its recent
+    samples until they agree again. Tracks unseen for more than
+    resample_interval frames are forgotten, and at most max_cached_tracks
+    tracks are kept (least recently seen first out).
+    """
+    def __init__(self,stable_samples=3,resample_interval=30,max_cached_tracks=256):
         self.kmeans = None
         self.team_colors={}
         self.player_team_dict = {}
-        self.player_team_history = {}
+        self.stable_samples = stable_samples
+        self.resample_interval = resample_interval
+        self.max_cached_tracks = max_cached_tracks
+        self.track_team_cache = OrderedDict()
 
     def get_clustering_model(self,image):
         #reshape the image
@@ -41,12 +57,110 @@ class TeamAssinger():
 
         return player_color
 
+    @staticmethod
+    def _two_means(pixels,centers,iterations):
+        """
+        Lloyd iterations of 2-means on every crop at once
+        Args:
+            pixels: (N, P, 3) pixels of N crops
+            centers: (N, 2, 3) initial centers
+        Returns:
+            (labels (N, P) bool, True for cluster 1, centers, inertia (N,))
+        """
+        num_pixels = pixels.shape[1]
+        pixel_sums = pixels.sum(axis=1)
+        labels = None
+        for _ in range(iterations):
+            # Nearest of two centers: which side of their bisecting plane
+            direction = centers[:,1]-centers[:,0]
+            offset = ((centers[:,1]**2).sum(axis=1)-(centers[:,0]**2).sum(axis=1))/2
+            new_labels = np.einsum('bpc,bc->bp',pixels,direction) > offset[:,None]
+            if labels is not None and np.array_equal(new_labels,labels):
+                break
+            labels = new_labels
+
+            counts = labels.sum(axis=1)[:,None]
+            sums = np.einsum('bp,bpc->bc',labels.astype(np.float32),pixels)
+            # Keep the previous center of a cluster that lost all its pixels
+            centers[:,1] = np.where(counts > 0,sums/np.maximum(counts,1),centers[:,1])
+            centers[:,0] = np.where(counts < num_pixels,(pixel_sums-sums)/np.maximum(num_pixels-counts,1),centers[:,0])
+
+        nearest = np.where(labels[:,:,None],centers[:,None,1],centers[:,None,0])
+        inertia = ((pixels-nearest)**2).sum(axis=(1,2))
+        return labels,centers,inertia
+
+    def get_player_colors(self,frame,bboxes,grid_size=16,iterations=10):
+        """
+        Jersey color of every player of a frame in one vectorized pass.
+
+        Same idea as get_player_color, without sklearn: the top half of every
+        crop is sampled on a grid_size x grid_size grid (border included) and
+        all crops are split in two clusters at once by 2-means. Like the
+        n_init restarts of KMeans, two initializations are run and the split
+        with the lower inertia is kept. The background is the cluster of the
+        four crop corners, as in get_player_color; when the corners fall in
+        both clusters, the cluster of the crop center is the jersey.
+        Args:
+            frame: Frame the players are in
+            bboxes: (N, 4) array of player bboxes
+        Returns:
+            (N, 3) array of BGR jersey colors
+        """
+        bboxes = np.asarray(bboxes,dtype=np.float64).reshape(-1,4)
+        if len(bboxes) == 0:
+            return np.empty((0,3))
+        height,width = frame.shape[:2]
+
+        # Same crop as get_player_color, clipped to the frame
+        x1 = bboxes[:,0].astype(int).clip(0,width-1)
+        y1 = bboxes[:,1].astype(int).clip(0,height-1)
+        x2 = bboxes[:,2].astype(int).clip(x1+1,width)
+        y2 = (y1+(bboxes[:,3].astype(int)-bboxes[:,1].astype(int))//2).clip(y1+1,height)
+
+        steps = np.linspace(0,1,grid_size)
+        rows = np.rint(y1[:,None]+steps*(y2-y1-1)[:,None]).astype(int)
+        cols = np.rint(x1[:,None]+steps*(x2-x1-1)[:,None]).astype(int)
+        pixels = frame[rows[:,:,None],cols[:,None,:]].reshape(len(bboxes),-1,3).astype(np.float32)
+        crops = np.arange(len(bboxes))
+
+        # First start: the mean color of the crop border (background) and of
+        # its central quarter (jersey)
+        grid = np.arange(grid_size*grid_size).reshape(grid_size,grid_size)
+        border_index = np.concatenate([grid[0],grid[-1],grid[1:-1,0],grid[1:-1,-1]])
+        quarter = slice(grid_size*3//8,grid_size*5//8)
+        center_index = grid[quarter,quarter].ravel()
+        labels,centers,inertia = self._two_means(
+            pixels,
+            np.stack([pixels[:,border_index].mean(axis=1),pixels[:,center_index].mean(axis=1)],axis=1),
+            iterations
+        )
+
+        # Second start: the pixel farthest from the crop mean and the pixel
+        # farthest from that one, which finds small clusters of a distinct
+        # color (e.g. a referee covering most of the crop)
+        first = ((pixels-pixels.mean(axis=1,keepdims=True))**2).sum(axis=2).argmax(axis=1)
+        second = ((pixels-pixels[crops,first][:,None])**2).sum(axis=2).argmax(axis=1)
+        other_labels,other_centers,other_inertia = self._two_means(
+            pixels,
+            np.stack([pixels[crops,first],pixels[crops,second]],axis=1),
+            iterations
+        )
+        better = other_inertia < inertia
+        labels = np.where(better[:,None],other_labels,labels)
+        centers = np.where(better[:,None,None],other_centers,centers)
+
+        # The corners of the sampled grid are the corners of the crop
+        corner_labels = labels[:,[grid[0,0],grid[0,-1],grid[-1,0],grid[-1,-1]]]
+        center_label = 2*labels[:,center_index].sum(axis=1) > len(center_index)
+        non_player_cluster = np.where(
+            corner_labels.all(axis=1) | ~corner_labels.any(axis=1),
+            corner_labels[:,0],
+            ~center_label
+        ).astype(int)
+        return centers[crops,1-non_player_cluster].astype(np.float64)
 
     def assign_team_color(self,frame,player_detections):
-        player_colors = []
-        for _,player in player_detections.items():
-            player_color = self.get_player_color(frame,player['bbox'])
-            player_colors.append(player_color)
+        player_colors = self.get_player_colors(frame,[player['bbox'] for player in player_detections.values()])
 
         kmeans = KMeans(n_clusters=2,init='k-means++',n_init=5,random_state=42)
         kmeans.fit(player_colors)
@@ -55,29 +169,100 @@ class TeamAssinger():
         self.team_colors[1]=kmeans.cluster_centers_[0]
         self.team_colors[2]=kmeans.cluster_centers_[1]
 
-    def assign_player_team(self, frame, player_id, bbox):
-        player_color = self.get_player_color(frame, bbox)
-        predicted_team_id = self.kmeans.predict(player_color.reshape(1, -1))[0] + 1
-
-        if player_id == 86:
-            predicted_team_id = 2  # Special case for player 86 goal keeper
+    def predict_player_teams(self,frame,bboxes):
+        """
+        Returns:
+            List of team ids (1 or 2), one per bbox
+        """
+        if len(bboxes) == 0:
+            return []
+        player_colors = self.get_player_colors(frame,bboxes)
+        return (self.kmeans.predict(player_colors)+1).tolist()
 
-        # Store team history for last 10 frames
-        if player_id not in self.player_team_history:
-            self.player_team_history[player_id] = []  # Initialize list
+    def predict_player_team(self,frame,bbox):
+        return self.predict_player_teams(frame,[bbox])[0]
 
-        self.player_team_history[player_id].append(predicted_team_id)
+    def _get_cache_entry(self,player_id,frame_num):
+        entry = self.track_team_cache.pop(player_id,None)
+        if frame_num is None:
+            frame_num = entry['last_seen']+1 if entry is not None else 0
+        if entry is not None and frame_num-entry['last_seen'] > self.resample_interval:
+            # The id was gone for a while, it may be another player now
+            entry = None
+        if entry is None:
+            entry = {'samples':deque(maxlen=self.stable_samples),'team':None,'stable':False,'last_sampled':None}
+        return entry,frame_num
 
-        # Keep only last 10 frames of history
-        if len(self.player_team_history[player_id]) > 10:
-            self.player_team_history[player_id].pop(0)
+    def _needs_sample(self,entry,frame_num):
+        return not entry['stable'] or frame_num-entry['last_sampled'] >= self.resample_interval
 
-        # Check if the last 10 frames had the same team_id
-        if len(set(self.player_team_history[player_id])) == 1:  
-            self.player_team_dict[player_id] = self.player_team_history[player_id][0]  # Fix team_id
+    def _add_sample(self,entry,predicted_team_id,frame_num):
+        entry['samples'].append(predicted_team_id)
+        entry['last_sampled'] = frame_num
+        entry['stable'] = len(entry['samples']) == self.stable_samples and len(set(entry['samples'])) == 1
+        if entry['stable']:
+            entry['team'] = predicted_team_id
         else:
-            self.player_team_dict[player_id] = predicted_team_id
+            # Majority of the recent samples, the latest one breaks ties
+            counts = Counter(entry['samples'])
+            entry['team'] = max(reversed(entry['samples']),key=lambda team_id: counts[team_id])
+
+    def _store_cache_entry(self,player_id,entry,frame_num):
+        entry['last_seen'] = frame_num
+
+        # LRU bound: the most recently seen track goes last
+        self.track_team_cache[player_id] = entry
+        while len(self.track_team_cache) > self.max_cached_tracks:
+            self.track_team_cache.popitem(last=False)
+
+        self.player_team_dict[player_id] = entry['team']
+
+    def assign_player_team(self,frame,player_id,bbox,frame_num=None):
+        """
+        Args:
+            frame: Frame the player is in
+            player_id: Track id
+            bbox: Player bbox in frame
+            frame_num: Frame number, used to notice tracks that disappeared.
+                If None, every call counts as the track's next frame.
+        Returns:
+            Team id (1 or 2)
+        """
+        return self.assign_players_team(frame,{player_id:{'bbox':bbox}},frame_num)[player_id]
+
+    def assign_players_team(self,frame,player_track,frame_num=None):
+        """
+        Team of every player of a frame. The colors of all the tracks that
+        need a sample are extracted in one get_player_colors call.
+        Args:
+            frame: Frame the players are in
+            player_track: {player_id: {'bbox': ...}} of the frame
+            frame_num: As in assign_player_team
+        Returns:
+            {player_id: team id}
+        """
+        entries = {}
+        sampled_ids = []
+        for player_id in player_track:
+            if player_id == 86:
+                continue
+            entry,entry_frame_num = self._get_cache_entry(player_id,frame_num)
+            entries[player_id] = (entry,entry_frame_num)
+            if self._needs_sample(entry,entry_frame_num):
+                sampled_ids.append(player_id)
 
-        return self.player_team_dict[player_id]
+        predicted_team_ids = self.predict_player_teams(frame,[player_track[player_id]['bbox'] for player_id in sampled_ids])
+        for player_id,predicted_team_id in zip(sampled_ids,predicted_team_ids):
+            entry,entry_frame_num = entries[player_id]
+            self._add_sample(entry,predicted_team_id,entry_frame_num)
 
+        player_teams = {}
+        for player_id in player_track:
+            if player_id == 86:
+                self.player_team_dict[player_id] = 2  # Special case for player 86 goal keeper
+            else:
+                entry,entry_frame_num = entries[player_id]
+                self._store_cache_entry(player_id,entry,entry_frame_num)
+            player_teams[player_id] = self.player_team_dict[player_id]
 
+        return player_teams
@@ -0,0 +1,124 @@
+from collections import deque
+import numpy as np
+
+def interpolate_bboxes(bboxes):
+    """
+    Fill missing bboxes by linear interpolation between the surrounding
+    detections; frames before the first and after the last detection take
+    the nearest detection (pandas interpolate() followed by bfill())
+    Args:
+        bboxes: (F, 4) array, NaN rows where the bbox is missing
+    Returns:
+        (F, 4) float64 array, all NaN if there is no detection at all
+    """
+    bboxes = np.asarray(bboxes,dtype=np.float64).reshape(-1,4)
+    known = ~np.isnan(bboxes).any(axis=1)
+    if known.all() or not known.any():
+        return bboxes.copy()
+
+    frames = np.arange(len(bboxes))
+    known_frames = frames[known]
+    return np.stack([np.interp(frames,known_frames,bboxes[known,i]) for i in range(4)],axis=1)
+
+class BallInterpolator():
+    """
+    Online ball gap filler for the streaming path.
+
+    Ball positions are emitted with a fixed latency of delay frames: a frame
+    is held in a look-ahead buffer until delay newer frames have arrived, so
+    gaps of up to delay frames are filled by linear interpolation between the
+    detections around them, exactly like the batch interpolation. Longer gaps
+    are predicted from the last known position with a constant velocity (for
+    at most max_prediction frames, then the position is held) and joined back
+    to the next detection by interpolation. Memory is O(delay).
+    """
+    def __init__(self,delay=3,max_prediction=12):
+        """
+        Args:
+            delay: Look-ahead in frames, i.e. the latency of the output
+            max_prediction: Maximum number of frames extrapolated with the
+                constant velocity model
+        """
+        self.delay = delay
+        self.max_prediction = max_prediction
+        self.reset()
+
+    def reset(self):
+        # [frame_num, bbox or None] of the frames not emitted yet
+        self.buffer = deque()
+        # Last emitted position, (frame_num, bbox)
+        self.anchor = None
+        # Last detection, (frame_num, bbox), and bbox change per frame
+        self.last_detection = None
+        self.velocity = None
+        self.num_predicted = 0
+
+    def _fill_gap(self,frame_num,bbox):
+        # Missing frames at the end of the buffer lie between the previous
+        # known position and this detection
+        gap = []
+        previous = self.anchor
+        for entry in reversed(self.buffer):
+            if entry[1] is not None:
+                previous = entry
+                break
+            gap.append(entry)
+
+        if previous is None:
+            # No earlier position: back fill like bfill()
+            for entry in gap:
+                entry[1] = bbox
+        else:
+            previous_frame,previous_bbox = previous
+            for entry in gap:
+                t = (entry[0]-previous_frame)/(frame_num-previous_frame)
+                entry[1] = previous_bbox+(bbox-previous_bbox)*t
+
+        if self.last_detection is not None:
+            last_frame,last_bbox = self.last_detection
+            self.velocity = (bbox-last_bbox)/(frame_num-last_frame)
+        self.last_detection = (frame_num,bbox)
+
+    def _emit(self):
+        frame_num,bbox = self.buffer.popleft()
+        if bbox is None:
+            if self.anchor is None:
+                return frame_num,{}
+            anchor_frame,anchor_bbox = self.anchor
+            bbox = anchor_bbox
+            if self.velocity is not None and self.num_predicted < self.max_prediction:
+                bbox = anchor_bbox+self.velocity*(frame_num-anchor_frame)
+            self.num_predicted += 1
+        else:
+            self.num_predicted = 0
+        self.anchor = (frame_num,bbox)
+        return frame_num,{'bbox':bbox.tolist()}
+
+    def update(self,frame_num,ball_track):
+        """
+        Args:
+            frame_num: Frame number, increasing (frames may be skipped)
+            ball_track: {'bbox': ...} of the frame, {} if no ball was detected
+        Returns:
+            List of (frame_num, {'bbox': ...}) of the frames that left the
+            look-ahead buffer, {} if no ball has been seen yet
+        """
+        bbox = ball_track.get('bbox')
+        if bbox is not None:
+            bbox = np.asarray(bbox,dtype=np.float64)
+            self._fill_gap(frame_num,bbox)
+        self.buffer.append([frame_num,bbox])
+
+        emitted = []
+        while len(self.buffer) > self.delay:
+            emitted.append(self._emit())
+        return emitted
+
+    def flush(self):
+        """
+        Emit the frames still in the look-ahead buffer, at the end of a stream
+        """
+        emitted = []
+        while self.buffer:
+            emitted.append(self._emit())
+        return emitted
@@ -0,0 +1,260 @@
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+import supervision as sv
+
+# Marks the end of the frame stream in every queue
+_END = object()
+
+def letterbox(frame,new_shape=640,stride=32,color=(114,114,114)):
+    """
+    Resize and pad a frame the same way the YOLO predictor does (minimum
+    rectangle padded to a multiple of stride), so the predictor's own
+    letterbox becomes a no-op.
+    Returns:
+        image, (ratio, left_pad, top_pad, original_width, original_height)
+    """
+    if isinstance(new_shape,int):
+        new_shape = (new_shape,new_shape)
+    height,width = frame.shape[:2]
+    ratio = min(new_shape[0]/height,new_shape[1]/width)
+
+    new_width,new_height = int(round(width*ratio)),int(round(height*ratio))
+    pad_width = np.mod(new_shape[1]-new_width,stride)/2
+    pad_height = np.mod(new_shape[0]-new_height,stride)/2
+
+    if (width,height) != (new_width,new_height):
+        frame = cv2.resize(frame,(new_width,new_height),interpolation=cv2.INTER_LINEAR)
+    top,bottom = int(round(pad_height-0.1)),int(round(pad_height+0.1))
+    left,right = int(round(pad_width-0.1)),int(round(pad_width+0.1))
+    image = cv2.copyMakeBorder(frame,top,bottom,left,right,cv2.BORDER_CONSTANT,value=color)
+
+    return image,(ratio,left,top,width,height)
+
+class DetectionPipeline():
+    """
+    Producer/consumer detection stage.
+
+        decode -> letterbox -> inference (num_workers threads) -> reorder -> callback
+
+    The frame iterable is consumed (and therefore decoded) on its own thread,
+    letterboxing runs on another, and each inference worker owns one model so
+    workers can run predict concurrently. Workers batch adaptively: they take
+    whatever preprocessed frames are ready, up to batch_size, instead of
+    waiting for a fixed slice. Results go through a reorder buffer so the
+    callback (ByteTrack) always sees frames in order.
+
+    All queues are bounded, so only a few batches of frames are in flight.
+    """
+    def __init__(self,models,batch_size=20,conf=0.1,imgsz=640,stride=32,preprocess=True,
+                 queue_size=None,batch_timeout=0.01):
+        self.models = list(models)
+        self.batch_size = batch_size
+        self.conf = conf
+        self.imgsz = imgsz
+        self.stride = stride
+        self.preprocess = preprocess
+        self.queue_size = queue_size or 2*batch_size*len(self.models)
+        self.batch_timeout = batch_timeout
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def num_workers(self):
+        return len(self.models)
+
+    def _add_stat(self,stage,num_frames,seconds):
+        with self._stats_lock:
+            stage_stats = self.stats.setdefault(stage,{'frames':0,'seconds':0.0})
+            stage_stats['frames'] += num_frames
+            stage_stats['seconds'] += seconds
+
+    def _put(self,target_queue,item,stop):
+        while not stop.is_set():
+            try:
+                target_queue.put(item,timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self,source_queue,stop,timeout=None):
+        deadline = None if timeout is None else time.perf_counter()+timeout
+        while not stop.is_set():
+            wait = 0.1 if deadline is None else min(0.1,deadline-time.perf_counter())
+            if wait <= 0:
+                raise queue.Empty
+            try:
+                return source_queue.get(timeout=wait)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _run_stage(self,target,output_queue,stop,*args):
+        try:
+            target(*args)
+        except BaseException as e:
+            stop.set()
+            # The consumer may be waiting on output_queue, make room for the error
+            while True:
+                try:
+                    output_queue.put_nowait(e)
+                    break
+                except queue.Full:
+                    try:
+                        output_queue.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def _decode(self,frames,frame_queue,stop):
+        frames = iter(frames)
+        frame_num = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            frame = next(frames,_END)
+            if frame is _END:
+                break
+            self._add_stat('decode',1,time.perf_counter()-start)
+            if not self._put(frame_queue,(frame_num,frame),stop):
+                return
+            frame_num += 1
+        self._put(frame_queue,_END,stop)
+
+    def _letterbox(self,frame_queue,input_queue,stop):
+        while True:
+            item = self._get(frame_queue,stop)
+            if item is _END:
+                break
+            frame_num,frame = item
+            start = time.perf_counter()
+            if self.preprocess:
+                image,transform = letterbox(frame,self.imgsz,self.stride)
+            else:
+                image,transform = frame,None
+            self._add_stat('preprocess',1,time.perf_counter()-start)
+            if not self._put(input_queue,(frame_num,frame,image,transform),stop):
+                return
+        for _ in range(self.num_workers):
+            self._put(input_queue,_END,stop)
+
+    def _to_detections(self,result,transform):
+        detections = sv.Detections.from_ultralytics(result)
+        if transform is not None and len(detections) > 0:
+            ratio,left,top,width,height = transform
+            xyxy = (detections.xyxy-np.array([left,top,left,top],dtype=np.float32))/ratio
+            xyxy[:,[0,2]] = xyxy[:,[0,2]].clip(0,width)
+            xyxy[:,[1,3]] = xyxy[:,[1,3]].clip(0,height)
+            detections.xyxy = xyxy
+        return detections
+
+    def _infer(self,model,input_queue,output_queue,stop):
+        finished = False
+        while not finished:
+            item = self._get(input_queue,stop)
+            if item is _END:
+                break
+            batch = [item]
+            deadline = time.perf_counter()+self.batch_timeout
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._get(input_queue,stop,timeout=max(deadline-time.perf_counter(),1e-3))
+                except queue.Empty:
+                    break
+                if item is _END:
+                    finished = True
+                    break
+                batch.append(item)
+
+            start = time.perf_counter()
+            results = model.predict([image for _,_,image,_ in batch],conf=self.conf,imgsz=self.imgsz,verbose=False)
+            outputs = [
+                (frame_num,frame,self._to_detections(result,transform))
+                for (frame_num,frame,_,transform),result in zip(batch,results)
+            ]
+            self._add_stat('inference',len(batch),time.perf_counter()-start)
+            if not self._put(output_queue,outputs,stop):
+                return
+        self._put(output_queue,_END,stop)
+
+    def run(self,frames,on_detection):
+        """
+        Detect objects in a stream of frames
+        Args:
+            frames: Iterable of frames, consumed on a background thread
+            on_detection: Called as on_detection(frame_num, frame, detections)
+                in frame order, detections being supervision Detections in
+                original frame coordinates
+        Returns:
+            Number of frames processed
+        """
+        self.stats = {}
+        stop = threading.Event()
+        frame_queue = queue.Queue(maxsize=self.queue_size)
+        input_queue = queue.Queue(maxsize=self.queue_size)
+        output_queue = queue.Queue(maxsize=self.queue_size)
+
+        threads = [
+            threading.Thread(target=self._run_stage,args=(self._decode,output_queue,stop,frames,frame_queue,stop),daemon=True),
+            threading.Thread(target=self._run_stage,args=(self._letterbox,output_queue,stop,frame_queue,input_queue,stop),daemon=True),
+        ]
+        for model in self.models:
+            threads.append(threading.Thread(
+                target=self._run_stage,
+                args=(self._infer,output_queue,stop,model,input_queue,output_queue,stop),
+                daemon=True
+            ))
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        # Reorder buffer: results arrive per batch, possibly out of order
+        pending = {}
+        next_frame_num = 0
+        finished_workers = 0
+        try:
+            while finished_workers < self.num_workers:
+                item = output_queue.get()
+                if item is _END:
+                    finished_workers += 1
+                    continue
+                if isinstance(item,BaseException):
+                    raise item
+                for frame_num,frame,detections in item:
+                    pending[frame_num] = (frame,detections)
+                while next_frame_num in pending:
+                    frame,detections = pending.pop(next_frame_num)
+                    track_start = time.perf_counter()
+                    on_detection(next_frame_num,frame,detections)
+                    self._add_stat('track',1,time.perf_counter()-track_start)
+                    next_frame_num += 1
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        # A stage may have failed after the last result was consumed
+        while not output_queue.empty():
+            item = output_queue.get_nowait()
+            if isinstance(item,BaseException):
+                raise item
+
+        self._add_stat('total',next_frame_num,time.perf_counter()-start)
+        return next_frame_num
+
+    def get_fps(self):
+        """
+        Returns:
+            {stage: frames/sec} where a stage's rate is its frames divided by
+            the time spent in it (summed over its workers for inference), and
+            'total' is the end-to-end wall clock rate
+        """
+        return {
+            stage:(stage_stats['frames']/stage_stats['seconds'] if stage_stats['seconds'] > 0 else float('inf'))
+            for stage,stage_stats in self.stats.items()
+        }
+
+    def format_stats(self):
+        return ' | '.join(f"{stage}: {fps:.1f} fps" for stage,fps in self.get_fps().items())
@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import sys
+import numpy as np
+import supervision as sv
+sys.path.append('../')
+from utils import hash_file
+from .segment_stitching import match_bboxes
+
+# Precisions of every inference backend on CPU. fp16 ONNX export needs a GPU
+# in ultralytics; int8 ONNX is dynamically quantized with onnxruntime, int8
+# OpenVINO is calibrated by ultralytics (NNCF) on a dataset
+INFERENCE_BACKENDS = {
+    'pytorch':('fp32',),
+    'torchscript':('fp32',),
+    'onnx':('fp32','int8'),
+    'openvino':('fp32','fp16','int8')
+}
+
+# Cache of exported models
+EXPORT_DIR = os.path.join('models','exported')
+
+# Suffix of the exported model, ultralytics picks the runtime from it
+_EXPORT_SUFFIXES = {
+    'torchscript':'.torchscript',
+    'onnx':'.onnx',
+    'openvino':'_openvino_model'
+}
+
+def check_backend(backend,precision='fp32'):
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {', '.join(INFERENCE_BACKENDS)}")
+    if precision not in INFERENCE_BACKENDS[backend]:
+        raise ValueError(f"Precision {precision!r} is not supported by the {backend} backend, "
+                         f"expected one of {', '.join(INFERENCE_BACKENDS[backend])}")
+
+def get_export_path(model_path,backend,precision='fp32',imgsz=None,export_dir=EXPORT_DIR):
+    """
+    Returns:
+        Path of the cached export of model_path, keyed by the weights content,
+        so retrained weights are exported again
+    """
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    name = f"{stem}_{hash_file(model_path)[:12]}_{precision}"
+    if imgsz:
+        name += f"_{imgsz}"
+    return os.path.join(export_dir,name+_EXPORT_SUFFIXES[backend])
+
+def load_export_metadata(export_path):
+    """
+    Returns:
+        Metadata saved with an exported model (source model hash, backend,
+        precision, imgsz, export time), None if the export is not complete
+    """
+    metadata_path = export_path+'.json'
+    if not os.path.exists(metadata_path) or not os.path.exists(export_path):
+        return None
+    with open(metadata_path) as f:
+        return json.load(f)
+
+def _quantize_onnx(fp32_path,int8_path):
+    try:
+        import onnx
+        from onnxruntime.quantization import quantize_dynamic
+    except ImportError:
+        raise ImportError("int8 ONNX export needs onnxruntime (pip install onnxruntime)")
+    quantize_dynamic(fp32_path,int8_path)
+    # Keep the class names and input size ultralytics saved in the model
+    source = onnx.load(fp32_path)
+    quantized = onnx.load(int8_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(source.metadata_props)
+    onnx.save(quantized,int8_path)
+
+def export_model(model_path,backend='onnx',precision='fp32',imgsz=None,export_dir=EXPORT_DIR,calibration_data=None):
+    """
+    Export YOLO weights once to a CPU inference format and cache the result,
+    later calls return the cached export. ONNX and OpenVINO models are
+    exported with dynamic shapes, so they take the same batches and
+    letterboxed frames as the PyTorch model; TorchScript runs at a fixed
+    square input.
+
+    The export is written to a temporary directory and moved into the cache
+    when complete, so several processes can export the same model at once.
+    Args:
+        model_path: Path to the PyTorch YOLO weights
+        backend: 'pytorch' (no export, model_path is returned), 'torchscript',
+            'onnx' or 'openvino'
+        precision: 'fp32', 'fp16' or 'int8', see INFERENCE_BACKENDS
+        imgsz: Inference size, the size the model was trained at by default
+        export_dir: Cache directory of the exported models
+        calibration_data: Dataset YAML used to calibrate int8 OpenVINO models
+    Returns:
+        Path of the exported model
+    """
+    check_backend(backend,precision)
+    if backend == 'pytorch':
+        return model_path
+    if backend == 'openvino' and precision == 'int8' and calibration_data is None:
+        raise ValueError("int8 OpenVINO export needs calibration_data, the dataset YAML of the model "
+                         "(e.g. training/football-players-detection-1/data.yaml)")
+
+    export_path = get_export_path(model_path,backend,precision,imgsz,export_dir)
+    if load_export_metadata(export_path) is not None:
+        return export_path
+
+    from ultralytics import YOLO
+    import ultralytics
+    os.makedirs(export_dir,exist_ok=True)
+    start = time.perf_counter()
+    tmp_dir = tempfile.mkdtemp(dir=export_dir)
+    try:
+        # Exports are written next to the weights, export a copy
+        weights_path = os.path.join(tmp_dir,os.path.basename(model_path))
+        shutil.copy(model_path,weights_path)
+        model = YOLO(weights_path)
+        imgsz = imgsz or model.overrides.get('imgsz',640)
+
+        export_args = {'format':backend,'imgsz':imgsz,'device':'cpu'}
+        if backend != 'torchscript':
+            export_args['dynamic'] = True
+        if backend == 'openvino':
+            export_args['half'] = precision == 'fp16'
+            export_args['int8'] = precision == 'int8'
+            if calibration_data is not None:
+                export_args['data'] = calibration_data
+        exported_path = model.export(**export_args)
+
+        if backend == 'onnx' and precision == 'int8':
+            quantized_path = os.path.join(tmp_dir,'quantized.onnx')
+            _quantize_onnx(exported_path,quantized_path)
+            exported_path = quantized_path
+
+        try:
+            os.replace(exported_path,export_path)
+        except OSError:
+            # Another process finished the same export first
+            if not os.path.exists(export_path):
+                raise
+
+        metadata = {
+            'model':os.path.abspath(model_path),
+            'model_sha256':hash_file(model_path),
+            'backend':backend,
+            'precision':precision,
+            'imgsz':imgsz,
+            'dynamic':export_args.get('dynamic',False),
+            'calibration_data':calibration_data,
+            'ultralytics':ultralytics.__version__,
+            'export_seconds':round(time.perf_counter()-start,3)
+        }
+        metadata_tmp_path = os.path.join(tmp_dir,'metadata.json')
+        with open(metadata_tmp_path,'w') as f:
+            json.dump(metadata,f,indent=4)
+        os.replace(metadata_tmp_path,export_path+'.json')
+    finally:
+        shutil.rmtree(tmp_dir,ignore_errors=True)
+
+    print(f"Exported {model_path} to {export_path} ({backend}, {precision}) in {time.perf_counter()-start:.1f}s")
+    return export_path
+
+def check_parity(reference_model,model,frames,conf=0.1,imgsz=640,batch_size=8,min_iou=0.5,min_recall=0.95):
+    """
+    Compare the detections of a model (e.g. exported) with those of a
+    reference model (the PyTorch one) on the same frames. In every frame the
+    boxes of a class are matched one-to-one to the reference boxes by
+    decreasing IoU, down to min_iou.
+    Args:
+        reference_model, model: YOLO models with the same classes
+        frames: List of frames
+        min_recall: Recall and precision needed for the check to pass
+    Returns:
+        {'classes': {class name: {'recall', 'precision', 'mean_iou',
+        'mean_confidence_difference', 'reference_boxes', 'boxes'}},
+        'overall': the same over all classes, 'passed': bool}
+    """
+    counts = {}
+    for start in range(0,len(frames),batch_size):
+        batch = frames[start:start+batch_size]
+        reference_results = reference_model.predict(batch,conf=conf,imgsz=imgsz,verbose=False)
+        results = model.predict(batch,conf=conf,imgsz=imgsz,verbose=False)
+        for reference_result,result in zip(reference_results,results):
+            reference_detections = sv.Detections.from_ultralytics(reference_result)
+            detections = sv.Detections.from_ultralytics(result)
+            class_ids = np.union1d(reference_detections.class_id,detections.class_id)
+            for class_id in class_ids.tolist():
+                reference_rows = np.flatnonzero(reference_detections.class_id == class_id)
+                rows = np.flatnonzero(detections.class_id == class_id)
+                class_counts = counts.setdefault(reference_model.names[class_id],np.zeros(5))
+                matches = match_bboxes(reference_detections.xyxy[reference_rows],detections.xyxy[rows],min_iou)
+                class_counts[0] += len(reference_rows)
+                class_counts[1] += len(rows)
+                class_counts[2] += len(matches)
+                class_counts[3] += sum(iou for _,_,iou in matches)
+                class_counts[4] += sum(
+                    abs(float(reference_detections.confidence[reference_rows[reference_index]])-
+                        float(detections.confidence[rows[index]]))
+                    for reference_index,index,_ in matches
+                )
+
+    def summarize(class_counts):
+        num_reference,num_boxes,num_matched,iou_sum,confidence_difference_sum = class_counts.tolist()
+        return {
+            'recall':num_matched/num_reference if num_reference else 1.0,
+            'precision':num_matched/num_boxes if num_boxes else 1.0,
+            'mean_iou':iou_sum/num_matched if num_matched else 0.0,
+            'mean_confidence_difference':confidence_difference_sum/num_matched if num_matched else 0.0,
+            'reference_boxes':int(num_reference),
+            'boxes':int(num_boxes)
+        }
+
+    overall = summarize(sum(counts.values(),np.zeros(5)))
+    return {
+        'classes':{class_name:summarize(class_counts) for class_name,class_counts in sorted(counts.items())},
+        'overall':overall,
+        'passed':overall['recall'] >= min_recall and overall['precision'] >= min_recall
+    }
@@ -0,0 +1,114 @@
+from collections import Counter
+import numpy as np
+import sys
+sys.path.append('../')
+from utils import TRACK_CLASSES
+
+def bbox_iou(bboxes_a,bboxes_b):
+    """
+    Returns:
+        (len(bboxes_a), len(bboxes_b)) IoU of every pair of x1, y1, x2, y2 bboxes
+    """
+    bboxes_a = np.asarray(bboxes_a,dtype=np.float64).reshape(-1,1,4)
+    bboxes_b = np.asarray(bboxes_b,dtype=np.float64).reshape(1,-1,4)
+    width = np.clip(np.minimum(bboxes_a[...,2],bboxes_b[...,2])-np.maximum(bboxes_a[...,0],bboxes_b[...,0]),0,None)
+    height = np.clip(np.minimum(bboxes_a[...,3],bboxes_b[...,3])-np.maximum(bboxes_a[...,1],bboxes_b[...,1]),0,None)
+    intersection = width*height
+    area_a = (bboxes_a[...,2]-bboxes_a[...,0])*(bboxes_a[...,3]-bboxes_a[...,1])
+    area_b = (bboxes_b[...,2]-bboxes_b[...,0])*(bboxes_b[...,3]-bboxes_b[...,1])
+    union = area_a+area_b-intersection
+    return np.divide(intersection,union,out=np.zeros_like(intersection),where=union > 0)
+
+def match_bboxes(bboxes_a,bboxes_b,min_iou=0.5):
+    """
+    Match two sets of bboxes one-to-one by decreasing IoU, down to min_iou
+    Returns:
+        List of (index in bboxes_a, index in bboxes_b, IoU) of the matches
+    """
+    if not len(bboxes_a) or not len(bboxes_b):
+        return []
+    iou = bbox_iou(bboxes_a,bboxes_b)
+    matches = []
+    while True:
+        index_a,index_b = np.unravel_index(np.argmax(iou),iou.shape)
+        if iou[index_a,index_b] < min_iou:
+            break
+        matches.append((int(index_a),int(index_b),float(iou[index_a,index_b])))
+        iou[index_a,:] = 0
+        iou[:,index_b] = 0
+    return matches
+
+def match_overlap_ids(previous_arrays,segment_arrays,min_iou=0.5):
+    """
+    Match the track ids of a segment to the stitched ids of the frames before
+    it, over the frames both have tracked (the overlap). In every overlap
+    frame, detections of the same class with IoU >= min_iou vote for the pair
+    of ids; pairs are then taken one-to-one by decreasing number of votes.
+    Args:
+        previous_arrays: Stitched TrackTable arrays of the overlap frames
+        segment_arrays: Segment TrackTable arrays of the overlap frames
+    Returns:
+        {segment track id: stitched track id}
+    """
+    ball_class_id = TRACK_CLASSES.index('ball')
+    votes = Counter()
+    for frame_num in np.unique(segment_arrays['frame']):
+        previous_rows = np.flatnonzero(
+            (previous_arrays['frame'] == frame_num) & (previous_arrays['class_id'] != ball_class_id)
+        )
+        segment_rows = np.flatnonzero(
+            (segment_arrays['frame'] == frame_num) & (segment_arrays['class_id'] != ball_class_id)
+        )
+        if not len(previous_rows) or not len(segment_rows):
+            continue
+
+        iou = bbox_iou(segment_arrays['bbox'][segment_rows],previous_arrays['bbox'][previous_rows])
+        same_class = segment_arrays['class_id'][segment_rows][:,None] == previous_arrays['class_id'][previous_rows][None,:]
+        for segment_index,previous_index in zip(*np.nonzero(same_class & (iou >= min_iou))):
+            votes[(
+                int(segment_arrays['track_id'][segment_rows[segment_index]]),
+                int(previous_arrays['track_id'][previous_rows[previous_index]])
+            )] += 1
+
+    id_map = {}
+    used_ids = set()
+    for (segment_id,previous_id),_ in sorted(votes.items(),key=lambda item:(-item[1],item[0])):
+        if segment_id in id_map or previous_id in used_ids:
+            continue
+        id_map[segment_id] = previous_id
+        used_ids.add(previous_id)
+    return id_map
+
+def stitch_segment(previous_arrays,segment_arrays,start_frame,next_track_id,min_iou=0.5):
+    """
+    Give the tracks of a segment the stitched ids: ids matched in the overlap
+    (frames before start_frame) continue the previous tracks, other ids are
+    offset to start at next_track_id
+    Args:
+        previous_arrays: Stitched TrackTable arrays, at least of the overlap frames
+        segment_arrays: TrackTable arrays of the segment, overlap included,
+            with absolute frame numbers
+        start_frame: First frame of the segment after the overlap
+        next_track_id: First unused stitched track id
+    Returns:
+        (arrays of the segment from start_frame on with stitched ids, next_track_id)
+    """
+    is_overlap = segment_arrays['frame'] < start_frame
+    overlap_arrays = {name:array[is_overlap] for name,array in segment_arrays.items()}
+    id_map = match_overlap_ids(previous_arrays,overlap_arrays,min_iou)
+
+    arrays = {name:array[~is_overlap] for name,array in segment_arrays.items()}
+    track_ids = arrays['track_id'].copy()
+    is_ball = arrays['class_id'] == TRACK_CLASSES.index('ball')
+    segment_ids,inverse = np.unique(track_ids[~is_ball],return_inverse=True)
+    # New ids keep the ByteTrack numbering, offset past the stitched ids
+    new_ids = [segment_id for segment_id in segment_ids.tolist() if segment_id not in id_map]
+    if new_ids:
+        id_offset = next_track_id-new_ids[0]
+        id_map.update({segment_id:segment_id+id_offset for segment_id in new_ids})
+        next_track_id = new_ids[-1]+id_offset+1
+    stitched_ids = np.asarray([id_map[segment_id] for segment_id in segment_ids.tolist()],dtype=np.int64)
+    track_ids[~is_ball] = stitched_ids[inverse]
+    arrays['track_id'] = track_ids
+
+    return arrays,next_track_id
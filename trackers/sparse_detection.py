@@ -0,0 +1,338 @@
+import math
+import cv2
+import numpy as np
+import supervision as sv
+from .segment_stitching import match_bboxes
+
+class SparseDetector():
+    """
+    Detect objects every stride-th frame only, and propagate the boxes to the
+    frames in between with sparse optical flow, for about stride times less
+    inference compute.
+
+    Between detections every box moves by the median Lucas-Kanade flow (on a
+    downscaled grayscale frame) of the corners found inside it at the last
+    detection, or with the camera when too few of them are still followed.
+    The ball is too small and fast to follow and is left to the ball
+    interpolation. Propagated boxes go through ByteTrack like detections, so
+    the track ids carry over.
+
+    While the camera is static, detection is limited to dilated regions
+    around the current boxes, each predicted at the scale of a full-frame
+    detection, so the compute follows the area of the regions. Every
+    full_detection_interval-th detection still covers the whole frame, for
+    players coming into view.
+
+    Full-frame detection is run at once when the track confidence drops:
+    when fewer than min_confidence of the boxes could be followed by the
+    flow, or when a region detection finds fewer than min_confidence of the
+    objects being tracked.
+    """
+    def __init__(self,model,stride=4,imgsz=640,conf=0.1,flow_scale=0.5,min_confidence=0.7,static_threshold=1.0,
+                 roi_margin=0.5,roi_max_fraction=0.5,full_detection_interval=5,min_box_points=3):
+        """
+        Args:
+            model: YOLO model
+            stride: Detect every stride-th frame
+            imgsz: Inference size of a full frame
+            conf: Detection confidence threshold
+            flow_scale: Downscaling of the frames the flow is computed on
+            min_confidence: Fraction of the boxes that must be followed (or
+                found again by a region detection) before falling back to
+                full-frame detection
+            static_threshold: Camera shift per frame, in pixels, below which
+                the camera counts as static
+            roi_margin: Dilation of the boxes into detection regions, as a
+                fraction of the box height
+            roi_max_fraction: Regions covering more of the frame than this
+                are detected as a full frame
+            full_detection_interval: Every this many detections, detect the
+                full frame even when the camera is static
+            min_box_points: Corners a box needs to be followed by its own flow
+        """
+        self.model = model
+        self.stride = stride
+        self.imgsz = imgsz
+        self.conf = conf
+        self.flow_scale = flow_scale
+        self.min_confidence = min_confidence
+        self.static_threshold = static_threshold
+        self.roi_margin = roi_margin
+        self.roi_max_fraction = roi_max_fraction
+        self.full_detection_interval = full_detection_interval
+        self.min_box_points = min_box_points
+
+        self.lk_params = dict(
+            winSize=(15,15),
+            maxLevel=2,
+            criteria=(cv2.TERM_CRITERIA_EPS|cv2.TERM_CRITERIA_COUNT,10,0.03)
+        )
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the previous frames, e.g. before the next video
+        """
+        self.previous_gray = None
+        self.previous_detections = None
+        self.points = np.zeros((0,2),dtype=np.float32)
+        self.point_boxes = np.zeros(0,dtype=np.int64)
+        self.frames_since_detection = 0
+        self.detections_since_full = 0
+        self.camera_static = False
+        self.stats = {'frames':0,'full':0,'roi':0,'propagated':0,'fallbacks':0,'inference_area':0.0}
+
+    def get_cache_params(self):
+        """
+        Parameters that change the detections, part of the stub cache key
+        """
+        return {
+            'detection_stride':self.stride,
+            'flow_scale':self.flow_scale,
+            'min_confidence':self.min_confidence,
+            'static_threshold':self.static_threshold,
+            'roi_margin':self.roi_margin,
+            'roi_max_fraction':self.roi_max_fraction,
+            'full_detection_interval':self.full_detection_interval
+        }
+
+    def _to_gray(self,frame):
+        gray = cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)
+        if self.flow_scale != 1.0:
+            gray = cv2.resize(gray,None,fx=self.flow_scale,fy=self.flow_scale,interpolation=cv2.INTER_AREA)
+        return gray
+
+    def _is_ball(self,detections):
+        if not len(detections) or 'class_name' not in detections.data:
+            return np.zeros(len(detections),dtype=bool)
+        return detections.data['class_name'] == 'ball'
+
+    def _init_points(self,gray,detections):
+        """
+        Corners to follow from gray on: up to 20 in every box (the ball
+        excepted), found in each box on its own so the quality level is
+        relative to the box rather than to the frame, and up to 200 in the
+        background for the camera movement
+        """
+        boxes = detections.xyxy[~self._is_ball(detections)]*self.flow_scale
+        height,width = gray.shape
+        box_mask = np.zeros_like(gray)
+        point_sets = []
+        point_boxes = []
+        for box_index,(x1,y1,x2,y2) in enumerate(boxes.round().astype(int).clip(0,[width,height,width,height]).tolist()):
+            box_mask[y1:y2,x1:x2] = 255
+            if x2-x1 < 3 or y2-y1 < 3:
+                continue
+            points = cv2.goodFeaturesToTrack(gray[y1:y2,x1:x2],maxCorners=20,qualityLevel=0.01,minDistance=2)
+            if points is not None:
+                point_sets.append(points.reshape(-1,2)+np.array([x1,y1],dtype=np.float32))
+                point_boxes.append(np.full(len(points),box_index))
+        background_points = cv2.goodFeaturesToTrack(gray,maxCorners=200,qualityLevel=0.01,minDistance=7,mask=255-box_mask)
+        if background_points is not None:
+            point_sets.append(background_points.reshape(-1,2))
+            point_boxes.append(np.full(len(background_points),-1))
+
+        self.points = np.concatenate(point_sets).astype(np.float32) if point_sets else np.zeros((0,2),dtype=np.float32)
+        self.point_boxes = np.concatenate(point_boxes) if point_boxes else np.zeros(0,dtype=np.int64)
+
+    def _propagate(self,new_gray,detections):
+        """
+        Move the boxes of detections (the ball excepted) from the previous
+        frame to new_gray with the flow of the followed corners, and keep
+        following the corners that were found again
+        Returns:
+            (propagated detections, fraction of the boxes followed by their
+            own flow, camera shift (dx, dy) in frame pixels)
+        """
+        detections = detections[~self._is_ball(detections)]
+        boxes = detections.xyxy*self.flow_scale
+        height,width = new_gray.shape
+
+        if len(self.points):
+            new_points,status,_ = cv2.calcOpticalFlowPyrLK(
+                self.previous_gray,new_gray,self.points.reshape(-1,1,2),None,**self.lk_params
+            )
+            new_points = new_points.reshape(-1,2)
+            good = status.reshape(-1) == 1
+        else:
+            new_points = self.points
+            good = np.zeros(0,dtype=bool)
+        shifts = new_points-self.points
+
+        is_background = good & (self.point_boxes == -1)
+        camera_shift = np.median(shifts[is_background],axis=0) if is_background.any() else np.zeros(2)
+
+        box_shifts = np.tile(camera_shift,(len(boxes),1))
+        followed = np.zeros(len(boxes),dtype=bool)
+        for box_index in range(len(boxes)):
+            inside = good & (self.point_boxes == box_index)
+            if inside.sum() >= self.min_box_points:
+                box_shifts[box_index] = np.median(shifts[inside],axis=0)
+                followed[box_index] = True
+
+        keep = np.ones(len(detections),dtype=bool)
+        if len(detections):
+            shift = np.concatenate([box_shifts,box_shifts],axis=1)/self.flow_scale
+            xyxy = detections.xyxy+shift.astype(np.float32)
+            xyxy[:,[0,2]] = xyxy[:,[0,2]].clip(0,width/self.flow_scale)
+            xyxy[:,[1,3]] = xyxy[:,[1,3]].clip(0,height/self.flow_scale)
+            detections.xyxy = xyxy
+            # Boxes that left the frame
+            keep = (xyxy[:,2] > xyxy[:,0]) & (xyxy[:,3] > xyxy[:,1])
+            detections = detections[keep]
+
+        # Box indices of the followed corners in the propagated detections
+        new_box_indices = np.append(np.where(keep,np.cumsum(keep)-1,-2),-1)
+        point_boxes = new_box_indices[self.point_boxes]
+        found = good & (point_boxes != -2)
+        self.points = new_points[found]
+        self.point_boxes = point_boxes[found]
+
+        confidence = followed.mean() if len(boxes) else 1.0
+        return detections,float(confidence),camera_shift/self.flow_scale
+
+    def _predict(self,image,imgsz):
+        result = self.model.predict([image],conf=self.conf,imgsz=imgsz,verbose=False)[0]
+        return sv.Detections.from_ultralytics(result)
+
+    def get_regions(self,xyxy,width,height):
+        """
+        Detection regions around boxes: every box dilated by roi_margin of its
+        height (at least 32 pixels), overlapping regions merged
+        Returns:
+            List of [x1, y1, x2, y2] integer regions
+        """
+        margins = np.maximum((xyxy[:,3]-xyxy[:,1])*self.roi_margin,32)[:,None]
+        regions = np.concatenate([xyxy[:,:2]-margins,xyxy[:,2:]+margins],axis=1)
+        regions = np.clip(regions,0,[width,height,width,height]).round().astype(int).tolist()
+
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i+1,len(regions)):
+                    a,b = regions[i],regions[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        regions[i] = [min(a[0],b[0]),min(a[1],b[1]),max(a[2],b[2]),max(a[3],b[3])]
+                        del regions[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return regions
+
+    def _detect_regions(self,frame,regions):
+        height,width = frame.shape[:2]
+        region_detections = []
+        for x1,y1,x2,y2 in regions:
+            # The scale of a full-frame detection, so the compute follows the area
+            imgsz = max(math.ceil(self.imgsz*max(x2-x1,y2-y1)/max(width,height)/32)*32,32)
+            detections = self._predict(frame[y1:y2,x1:x2],imgsz)
+            if len(detections):
+                detections.xyxy = detections.xyxy+np.array([x1,y1,x1,y1],dtype=np.float32)
+            region_detections.append(detections)
+        if not any(len(detections) for detections in region_detections):
+            return region_detections[0]
+        return sv.Detections.merge([detections for detections in region_detections if len(detections)])
+
+    def detect(self,frame):
+        """
+        Detections of the next frame of the video, detected or propagated
+        Returns:
+            supervision Detections in frame coordinates
+        """
+        height,width = frame.shape[:2]
+        gray = self._to_gray(frame)
+        self.stats['frames'] += 1
+
+        mode = 'full'
+        propagated = None
+        if self.previous_detections is not None:
+            propagated,confidence,camera_shift = self._propagate(gray,self.previous_detections)
+            self.camera_static = self.camera_static and bool(np.abs(camera_shift).max() <= self.static_threshold)
+            if confidence < self.min_confidence:
+                self.stats['fallbacks'] += 1
+            elif self.frames_since_detection+1 < self.stride:
+                mode = 'propagate'
+            elif self.camera_static and self.detections_since_full < self.full_detection_interval and len(propagated):
+                mode = 'roi'
+
+        if mode == 'propagate':
+            detections = propagated
+            self.frames_since_detection += 1
+            self.stats['propagated'] += 1
+        else:
+            if mode == 'roi':
+                regions = self.get_regions(propagated.xyxy,width,height)
+                area = sum((x2-x1)*(y2-y1) for x1,y1,x2,y2 in regions)/(width*height)
+                if area > self.roi_max_fraction:
+                    mode = 'full'
+            if mode == 'roi':
+                detections = self._detect_regions(frame,regions)
+                self.stats['roi'] += 1
+                self.stats['inference_area'] += area
+                self.detections_since_full += 1
+                # Objects the regions missed, detect the full frame instead
+                if (~self._is_ball(detections)).sum() < self.min_confidence*len(propagated):
+                    self.stats['fallbacks'] += 1
+                    mode = 'full'
+            if mode == 'full':
+                detections = self._predict(frame,self.imgsz)
+                self.stats['full'] += 1
+                self.stats['inference_area'] += 1.0
+                self.detections_since_full = 0
+            self.frames_since_detection = 0
+            # Regions are only used if the camera stays static until the next detection
+            self.camera_static = True
+            self._init_points(gray,detections)
+
+        self.previous_gray = gray
+        self.previous_detections = detections
+        return detections
+
+    def get_compute_fraction(self):
+        """
+        Returns:
+            Inference compute relative to full-frame detection of every frame
+        """
+        return self.stats['inference_area']/self.stats['frames'] if self.stats['frames'] else 1.0
+
+    def format_stats(self):
+        stats = self.stats
+        return (f"{stats['frames']} frames: {stats['full']} full, {stats['roi']} region, {stats['propagated']} propagated, "
+                f"{stats['fallbacks']} fallbacks, {self.get_compute_fraction():.1%} of the full detection compute")
+
+def _get_bboxes(frame_tracks,class_name):
+    if class_name == 'ball':
+        return [frame_tracks['bbox']] if 'bbox' in frame_tracks else []
+    return [track['bbox'] for track in frame_tracks.values()]
+
+def compare_tracks(reference_tracks,tracks,min_iou=0.5):
+    """
+    Accuracy of tracks against reference tracks of the same frames, e.g.
+    sparse against full detection. In every frame the boxes of a class are
+    matched one-to-one to the reference boxes by decreasing IoU, down to
+    min_iou. Track ids are not compared.
+    Returns:
+        {class name: {'recall', 'precision', 'mean_iou', 'reference_boxes', 'boxes'}}
+    """
+    report = {}
+    for class_name in ('players','referees','ball'):
+        num_reference = num_boxes = num_matched = 0
+        iou_sum = 0.0
+        for reference_frame,frame in zip(reference_tracks[class_name],tracks[class_name]):
+            reference_bboxes = _get_bboxes(reference_frame,class_name)
+            bboxes = _get_bboxes(frame,class_name)
+            num_reference += len(reference_bboxes)
+            num_boxes += len(bboxes)
+            matches = match_bboxes(reference_bboxes,bboxes,min_iou)
+            num_matched += len(matches)
+            iou_sum += sum(iou for _,_,iou in matches)
+        report[class_name] = {
+            'recall':num_matched/num_reference if num_reference else 1.0,
+            'precision':num_matched/num_boxes if num_boxes else 1.0,
+            'mean_iou':iou_sum/num_matched if num_matched else 0.0,
+            'reference_boxes':num_reference,
+            'boxes':num_boxes
+        }
+    return report
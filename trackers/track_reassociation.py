@@ -0,0 +1,118 @@
+from collections import Counter, deque
+import numpy as np
+
+class TrackReassociator():
+    """
+    Re-associates new player track ids with ids seen in the last window_size
+    frames, so a player who briefly loses their ByteTrack id gets it back.
+
+    The previous frames are kept in a ring buffer of per-frame id and bbox
+    arrays, and a counter of the ids in the buffer answers "was this id seen
+    recently" in O(1). Distances between a new id and every bbox in the window
+    are computed in one NumPy operation, so the cost per frame does not depend
+    on the length of the match.
+
+    method='greedy' reproduces the original behaviour: each new id, in frame
+    order, takes the id of the nearest bbox in the window (top-left corner
+    distance) unless that id is already in the frame. method='hungarian'
+    solves one optimal assignment per frame between the new ids and the
+    recent ids missing from the frame instead.
+    """
+    def __init__(self,window_size=30,method='greedy'):
+        if method not in ('greedy','hungarian'):
+            raise ValueError(f"Unknown re-association method: {method}")
+        self.window_size = window_size
+        self.method = method
+        self.reset()
+
+    def reset(self):
+        self.window = deque()
+        self.window_ids = Counter()
+
+    def adjust(self,player_tracks):
+        """
+        Re-associate ids in place
+        Args:
+            player_tracks: List of per-frame {track_id: {'bbox': ...}} dicts
+        Returns:
+            player_tracks
+        """
+        self.reset()
+        for frame in player_tracks:
+            self.update(frame)
+        return player_tracks
+
+    def update(self,frame):
+        """
+        Online version of adjust: re-associate the ids of the next frame in
+        place, using the frames passed to previous calls
+        Args:
+            frame: {track_id: {'bbox': ...}} of the next frame
+        Returns:
+            frame
+        """
+        window = self.window
+        window_ids = self.window_ids
+
+        if window:
+            new_track_ids = [track_id for track_id in frame
+                             if track_id is not None and window_ids[track_id] == 0]
+            # Without players in the window (empty first frames, a cutaway
+            # longer than the window) there is nothing to take, ids are kept
+            if new_track_ids and any(len(ids) for ids,_ in window):
+                prev_track_ids = np.concatenate([ids for ids,_ in window])
+                prev_track_bboxes = np.concatenate([bboxes for _,bboxes in window])
+                if self.method == 'greedy':
+                    self._assign_greedy(frame,new_track_ids,prev_track_ids,prev_track_bboxes)
+                else:
+                    self._assign_hungarian(frame,new_track_ids,prev_track_ids,prev_track_bboxes)
+
+        # Push the (re-associated) frame into the ring buffer
+        ids = np.fromiter(frame.keys(),dtype=np.int64,count=len(frame))
+        bboxes = np.array([track_info['bbox'] for track_info in frame.values()],dtype=np.float64).reshape(-1,4)
+        window.append((ids,bboxes))
+        window_ids.update(ids.tolist())
+        if len(window) > self.window_size:
+            old_ids,_ = window.popleft()
+            window_ids.subtract(old_ids.tolist())
+
+        return frame
+
+    def _squared_distances(self,bboxes,prev_track_bboxes):
+        # Same metric as measure_bbox_distances (top-left corners), squared
+        delta_x = bboxes[:,0,None] - prev_track_bboxes[None,:,0]
+        delta_y = bboxes[:,1,None] - prev_track_bboxes[None,:,1]
+        return delta_x*delta_x + delta_y*delta_y
+
+    def _assign_greedy(self,frame,new_track_ids,prev_track_ids,prev_track_bboxes):
+        bboxes = np.array([frame[track_id]['bbox'] for track_id in new_track_ids],dtype=np.float64)
+        nearest = self._squared_distances(bboxes,prev_track_bboxes).argmin(axis=1)
+
+        for track_id,prev_index in zip(new_track_ids,nearest):
+            min_distance_track_id = int(prev_track_ids[prev_index])
+            if min_distance_track_id not in frame:
+                frame[min_distance_track_id] = {'bbox':frame[track_id]['bbox']}
+                frame.pop(track_id)
+
+    def _assign_hungarian(self,frame,new_track_ids,prev_track_ids,prev_track_bboxes):
+        from scipy.optimize import linear_sum_assignment
+
+        # Only recent ids that are missing from this frame can be taken
+        frame_track_ids = np.fromiter(frame.keys(),dtype=np.int64,count=len(frame))
+        is_missing = ~np.isin(prev_track_ids,frame_track_ids)
+        if not is_missing.any():
+            return
+        candidate_ids,candidate_index = np.unique(prev_track_ids[is_missing],return_inverse=True)
+
+        bboxes = np.array([frame[track_id]['bbox'] for track_id in new_track_ids],dtype=np.float64)
+        distances = self._squared_distances(bboxes,prev_track_bboxes[is_missing])
+
+        # Distance to a candidate id is its closest bbox in the window
+        cost = np.full((len(candidate_ids),len(new_track_ids)),np.inf)
+        np.minimum.at(cost,candidate_index,distances.T)
+
+        columns,rows = linear_sum_assignment(cost)
+        for row,column in zip(rows,columns):
+            track_id = new_track_ids[row]
+            frame[int(candidate_ids[column])] = {'bbox':frame[track_id]['bbox']}
+            frame.pop(track_id)
@@ -2,61 +2,151 @@ from ultralytics import YOLO
 import supervision as sv
 import pickle
 import os
+import itertools
 import sys
+from concurrent.futures import ProcessPoolExecutor,as_completed
 sys.path.append('../')
-from utils import get_center_bbox,get_bbox_width,get_foot_position,measure_bbox_distances
+from utils import get_center_bbox,get_bbox_width,get_foot_position,batch_frames,draw_transparent_rectangle,TrackTable
+from utils import iter_video_frames,get_frame_count
 import cv2
 import numpy as np
-import pandas as pd
+from .track_reassociation import TrackReassociator
+from .ball_interpolation import BallInterpolator,interpolate_bboxes
+from .detection_pipeline import DetectionPipeline
+from .segment_stitching import stitch_segment
+from .sparse_detection import SparseDetector,compare_tracks
+from .model_export import export_model,load_export_metadata
+
+# Tracker of a segment worker process, the model is loaded once per worker
+_segment_tracker = None
+
+def _init_segment_worker(model_path,batch_size,letterbox,detection_stride=1,inference_backend='pytorch',precision='fp32',
+                         calibration_data=None):
+    global _segment_tracker
+    # Every worker is one process, don't let OpenCV start a thread pool in each
+    cv2.setNumThreads(1)
+    _segment_tracker = Tracker(
+        model_path,
+        batch_size=batch_size,
+        letterbox=letterbox,
+        detection_stride=detection_stride,
+        inference_backend=inference_backend,
+        precision=precision,
+        calibration_data=calibration_data
+    )
+
+def _track_segment(video_path,start_frame,end_frame,overlap):
+    """
+    Worker of get_object_tracks_parallel: tracks of frames start_frame to
+    end_frame, with ByteTrack started overlap frames earlier
+    Returns:
+        (start_frame, number of frames tracked, TrackTable arrays with
+        absolute frame numbers, overlap frames included)
+    """
+    tracker = _segment_tracker
+    tracker.reset()
+    warmup_start_frame = max(start_frame-overlap,0)
+    tracks = tracker.track_frames(tracker.init_tracks(),iter_video_frames(video_path,warmup_start_frame,end_frame))
+
+    arrays = TrackTable.from_tracks(tracks).to_arrays()
+    arrays['frame'] = arrays['frame']+warmup_start_frame
+    return start_frame,len(tracks['players'])-(start_frame-warmup_start_frame),arrays
 
 
 class Tracker:
-    def __init__(self,model_path):
-        self.model = YOLO(model_path)
+    def __init__(self,model_path,batch_size=20,reassociation_method='greedy',detection_workers=1,letterbox=True,
+                 detection_stride=1,inference_backend='pytorch',precision='fp32',calibration_data=None):
+        """
+        Args:
+            model_path: Path to the YOLO weights
+            batch_size: Maximum number of frames per predict call
+            reassociation_method: 'greedy' or 'hungarian', see TrackReassociator
+            detection_workers: Number of inference threads, each with its own model
+            letterbox: Letterbox frames on a separate thread before inference
+            detection_stride: Detect every detection_stride-th frame and
+                propagate the boxes in between (see SparseDetector)
+            inference_backend: 'pytorch' runs the weights as they are,
+                'torchscript', 'onnx' or 'openvino' export them once to
+                models/exported and run the export (see export_model)
+            precision: 'fp32', 'fp16' or 'int8' (quantized) export
+            calibration_data: Dataset YAML calibrating int8 OpenVINO exports
+        """
+        self.model_path = model_path
+        self.inference_backend = inference_backend
+        self.precision = precision
+        self.calibration_data = calibration_data
+        self.inference_model_path = export_model(model_path,inference_backend,precision,calibration_data=calibration_data)
+        self.model = self._load_model()
         self.tracker = sv.ByteTrack()
+        self.batch_size = batch_size
+        self.track_reassociator = TrackReassociator(window_size=30,method=reassociation_method)
+        self.ball_interpolator = BallInterpolator(delay=3)
+
+        if inference_backend == 'pytorch':
+            imgsz = self.model.overrides.get('imgsz',640)
+        else:
+            imgsz = load_export_metadata(self.inference_model_path)['imgsz']
+        models = [self.model]+[self._load_model() for _ in range(detection_workers-1)]
+        self.detection_pipeline = DetectionPipeline(
+            models,
+            batch_size=batch_size,
+            conf=0.1,
+            imgsz=imgsz,
+            preprocess=letterbox
+        )
 
-    def adjust_tracks(self, tracks):
-        for obj_name, obj in tracks.items():
-            if obj_name == 'players':
-                for frame_num, frame in enumerate(obj[1:], 1):
-                    # Consider bounding boxes from the last 30 frames (or as many as available)
-                    min_frame = max(0, frame_num - 30)
-                    prev_tracks = obj[min_frame:frame_num]  # Last 30 frames
-
-                    prev_track_ids = []
-                    prev_track_bboxes = []
-
-                    # Collect all previous track IDs and bounding boxes
-                    for prev_frame in prev_tracks:
-                        for prev_track_id, prev_track_info in prev_frame.items():
-                            prev_track_ids.append(prev_track_id)
-                            prev_track_bboxes.append(prev_track_info['bbox'])
-
-                    current_track = frame
-
-                    for track_id in list(current_track.keys()):  # Iterate over a copy of keys
-                        track_info = current_track[track_id]
-                        if track_id is not None and track_id not in prev_track_ids:
-                            current_track_bbox = track_info['bbox']
-                            min_distance = float('inf')
-                            min_distance_track_id = None
-
-                            # Compare with all collected previous bounding boxes
-                            for prev_track_id, prev_track_bbox in zip(prev_track_ids, prev_track_bboxes):
-                                distance = measure_bbox_distances(current_track_bbox, prev_track_bbox)
-                                if distance < min_distance:
-                                    min_distance = distance
-                                    min_distance_track_id = prev_track_id
-
-                            if min_distance_track_id is not None and min_distance_track_id not in current_track:
-                                tracks[obj_name][frame_num][min_distance_track_id] = {'bbox': track_info['bbox']}
-                                tracks[obj_name][frame_num].pop(track_id)  # remove after iterating over keys
+        self.sparse_detector = None
+        self.set_detection_stride(detection_stride)
+
+        # Added to ByteTrack ids, used when resuming a partially cached run
+        self.track_id_offset = 0
+
+    def _load_model(self):
+        if self.inference_backend == 'pytorch':
+            return YOLO(self.inference_model_path)
+        # Exported models don't carry the task in a form ultralytics can guess
+        return YOLO(self.inference_model_path,task='detect')
+
+    def set_detection_stride(self,detection_stride):
+        """
+        Detect every frame (1) or every detection_stride-th frame with
+        SparseDetector, which runs on the calling thread
+        """
+        if detection_stride > 1:
+            self.sparse_detector = SparseDetector(
+                self.model,
+                stride=detection_stride,
+                imgsz=self.detection_pipeline.imgsz,
+                conf=self.detection_pipeline.conf
+            )
+        else:
+            self.sparse_detector = None
+
+    def reset(self):
+        """
+        Forget the tracking state of the previous video, so one Tracker (and
+        its loaded model) can be reused for the next one
+        """
+        self.tracker = sv.ByteTrack()
+        self.track_reassociator.reset()
+        self.ball_interpolator.reset()
+        if self.sparse_detector is not None:
+            self.sparse_detector.reset()
+        self.track_id_offset = 0
 
+    def adjust_tracks(self, tracks):
+        """
+        Give new player ids back the id of the nearest player seen in the last
+        30 frames (see TrackReassociator)
+        """
+        self.track_reassociator.adjust(tracks['players'])
         return tracks
 
-
-
     def add_position_to_tracks(self,tracks):
+        if isinstance(tracks,TrackTable):
+            tracks.add_positions()
+            return
+
         for obj_name,obj in tracks.items():
                 for frame_num,frame in enumerate(obj):
                     if obj_name!='ball':
@@ -71,80 +161,318 @@ class Tracker:
                 
 
     def interpolate_ball_positions(self,ball_positions):
-        ball_positions = [x.get('bbox',[]) for x in ball_positions]
-        df_ball_positions = pd.DataFrame(ball_positions,columns=['x1','y1','x2','y2'])
-
-        #Interpolate ball  positions
-        df_ball_positions = df_ball_positions.interpolate()
-        df_ball_positions = df_ball_positions.bfill() #edge case for first frames
-
-        ball_positions = [{'bbox':x} for x in df_ball_positions.to_numpy().tolist()]
+        """
+        Fill the frames without a ball detection by linear interpolation
+        (NumPy, see interpolate_bboxes). The streaming path uses
+        self.ball_interpolator instead, which only looks a few frames ahead.
+        """
+        missing = (np.nan,)*4
+        bboxes = np.array([ball.get('bbox',missing) for ball in ball_positions],dtype=np.float64).reshape(-1,4)
+        if np.isnan(bboxes).all():
+            return ball_positions
+
+        ball_positions = [{'bbox':x} for x in interpolate_bboxes(bboxes).tolist()]
 
         return ball_positions
 
     def detect_frames(self,frames):
         detections = []
-        batch_size = 20
-        for idx in range(0,len(frames),batch_size):
-            batch_detections = self.model.predict(frames[idx:idx+batch_size],conf=0.1)
+        for _,batch in batch_frames(frames,self.batch_size):
+            batch_detections = self.model.predict(batch,conf=0.1)
             detections+=batch_detections
         return detections
 
-    def get_object_tracks(self,frames,read_from_stub=False,stub_path=None):
-
-        if read_from_stub and stub_path and os.path.exists(stub_path):
-            with open(stub_path,'rb') as f:
-                tracks = pickle.load(f)
-            return tracks
-
-        detections = self.detect_frames(frames)
-
-        tracks = {
+    def init_tracks(self):
+        return {
             'players':[],
             'referees':[],
             'ball':[]
         }
 
-        for frame_num,detection in enumerate(detections):
-            class_names = detection.names
-            class_names_inv = {v:k for (k,v) in class_names.items()}
+    def track_frames(self,tracks,frames,frame_callback=None):
+        """
+        Detect and track a stream of frames through the detection pipeline,
+        appending the results to tracks
+        Args:
+            tracks: Tracks to append to (see init_tracks)
+            frames: Iterable of frames, decoded on a background thread
+            frame_callback: Optional frame_callback(frame_num, frame), called in
+                frame order after the frame is tracked, so other per-frame stages
+                can share the same decoding pass
+        """
+        if self.sparse_detector is not None:
+            # Whether a frame is detected depends on the previous ones, frames
+            # go one at a time instead of through the batched pipeline
+            for frame_num,frame in enumerate(frames):
+                self.add_detection_to_tracks(tracks,self.sparse_detector.detect(frame))
+                if frame_callback is not None:
+                    frame_callback(frame_num,frame)
+            return tracks
+
+        def on_detection(frame_num,frame,detection):
+            self.add_detection_to_tracks(tracks,detection)
+            if frame_callback is not None:
+                frame_callback(frame_num,frame)
+
+        self.detection_pipeline.run(frames,on_detection)
+        return tracks
 
-            # Convert to supervision detection format
+    def track_frame(self,frame):
+        """
+        Online mode: detect and track a single frame, e.g. from a live stream
+        Returns:
+            {'players': {track_id: {'bbox': ...}}, 'referees': {...}, 'ball': {'bbox': ...}}
+            of the frame
+        """
+        tracks = self.init_tracks()
+        if self.sparse_detector is not None:
+            detection = self.sparse_detector.detect(frame)
+        else:
+            detection = self.model.predict([frame],conf=0.1,verbose=False)[0]
+        self.add_detection_to_tracks(tracks,detection)
+        return {obj_name:obj[0] for obj_name,obj in tracks.items()}
+
+    def add_detection_to_tracks(self,tracks,detection):
+        """
+        Run ByteTrack on one frame's detections and append the frame to tracks
+        Args:
+            detection: supervision Detections, or an ultralytics result
+        """
+        frame_num = len(tracks['players'])
+        class_names = self.model.names
+        class_names_inv = {v:k for (k,v) in class_names.items()}
+
+        # Convert to supervision detection format
+        if isinstance(detection,sv.Detections):
+            detection_supervision = detection
+        else:
             detection_supervision = sv.Detections.from_ultralytics(detection) #return detection obj
 
-            # Convert goalkeeper to player object
-            for obj_idx,class_id in enumerate(detection_supervision.class_id):
-                if class_names[class_id] == 'goalkeeper':
-                    detection_supervision.class_id[obj_idx] = class_names_inv['player']
+        # Convert goalkeeper to player object
+        for obj_idx,class_id in enumerate(detection_supervision.class_id):
+            if class_names[class_id] == 'goalkeeper':
+                detection_supervision.class_id[obj_idx] = class_names_inv['player']
+
+        #Track objects
+        detection_with_tracks = self.tracker.update_with_detections(detection_supervision)
+
+        tracks['players'].append({})
+        tracks['referees'].append({})
+        tracks['ball'].append({})
+
+        bboxes = detection_with_tracks.xyxy.tolist() #bboxes from xyxy attribute
+        class_ids = detection_with_tracks.class_id.tolist() #class_id
+        tracker_ids = (detection_with_tracks.tracker_id+self.track_id_offset).tolist()  #tracker id
+        class_names= detection_with_tracks.data['class_name'].tolist()  #class names
+
+
+        for bbox,class_id,track_id,class_name in zip(bboxes,class_ids,tracker_ids,class_names):
+            if str(class_name) == 'player': #if detected object is player
+                tracks['players'][frame_num][track_id] = {'bbox':bbox}
+
+            if str(class_name) == 'referee': #if detected object is referee
+                tracks['referees'][frame_num][track_id] = {'bbox':bbox}
 
-            #Track objects
-            detection_with_tracks = self.tracker.update_with_detections(detection_supervision)
+        for obj_in_frame in detection_supervision:
+            if str(obj_in_frame[5]['class_name']) == 'ball': #if detected object is ball
+                tracks['ball'][frame_num]={'bbox': obj_in_frame[0].tolist()}
 
-            tracks['players'].append({})
-            tracks['referees'].append({})
-            tracks['ball'].append({})
+    def get_cache_params(self):
+        """
+        Parameters that change the detections, part of the stub cache key
+        """
+        params = {
+            'conf':self.detection_pipeline.conf,
+            'imgsz':self.detection_pipeline.imgsz,
+            'letterbox':self.detection_pipeline.preprocess,
+            'tracker':'ByteTrack'
+        }
+        if self.inference_backend != 'pytorch':
+            params.update(inference_backend=self.inference_backend,precision=self.precision)
+        if self.sparse_detector is not None:
+            params.update(self.sparse_detector.get_cache_params())
+        return params
+
+    def evaluate_sparse_detection(self,frames,tracks):
+        """
+        Accuracy cost of sparse detection: detect and track frames with
+        full detection of every frame and compare the sparse tracks of the
+        same frames against it (see compare_tracks). The tracking state is
+        left untouched.
+        Args:
+            frames: Frames from the start of the video, e.g. its first minute
+            tracks: Tracks of the video from sparse detection
+        """
+        tracker,self.tracker = self.tracker,sv.ByteTrack()
+        sparse_detector,self.sparse_detector = self.sparse_detector,None
+        try:
+            reference_tracks = self.track_frames(self.init_tracks(),frames)
+        finally:
+            self.tracker = tracker
+            self.sparse_detector = sparse_detector
+        return compare_tracks(reference_tracks,tracks)
+
+    def get_object_tracks(self,frames,read_from_stub=False,stub_path=None,stub_cache=None):
+        """
+        Detect and track objects over frames. frames can be a list or a lazy
+        iterable; detection results are converted to tracks as they come out of
+        the detection pipeline so neither the frames nor the raw detections are
+        kept alive.
+        Args:
+            frames: Frames of the whole video, starting at frame 0
+            read_from_stub: Reuse cached results
+            stub_path: Path of a pickle stub holding all tracks
+            stub_cache: StageCache to use instead of stub_path. Tracks are saved
+                in chunks as they are produced and an interrupted run resumes
+                from the last saved chunk
+        """
+        if stub_cache is not None:
+            return self._get_cached_object_tracks(frames,read_from_stub,stub_cache)
 
-            bboxes = detection_with_tracks.xyxy.tolist() #bboxes from xyxy attribute
-            class_ids = detection_with_tracks.class_id.tolist() #class_id
-            tracker_ids = detection_with_tracks.tracker_id.tolist()  #tracker id
-            class_names= detection_with_tracks.data['class_name'].tolist()  #class names
+        if read_from_stub and stub_path and os.path.exists(stub_path):
+            with open(stub_path,'rb') as f:
+                tracks = pickle.load(f)
+            return tracks
+
+        tracks = self.init_tracks()
+        self.track_frames(tracks,frames)
 
+        if stub_path is not None:
+            with open(stub_path,'wb') as f:
+                pickle.dump(tracks,f)
 
-            for bbox,class_id,track_id,class_name in zip(bboxes,class_ids,tracker_ids,class_names):
-                if str(class_name) == 'player': #if detected object is player
-                    tracks['players'][frame_num][track_id] = {'bbox':bbox}
+        return tracks
+
+    def get_object_tracks_parallel(self,video_path,num_workers=None,segment_size=1500,overlap=30,
+                                   read_from_stub=False,stub_path=None,stub_cache=None):
+        """
+        Detect and track a long video with a process pool. The video is split
+        into time segments of segment_size frames, each worker (with its own
+        model, loaded once) decodes, detects and runs ByteTrack on its segment,
+        starting overlap frames early.
+
+        Segments are stitched in order: the ids of a segment are matched to the
+        stitched ids by IoU over the overlap frames, which both have tracked, so
+        a player keeps one id across segment boundaries (see stitch_segment).
+        Later stages (camera movement, speed and distance) run on the stitched
+        tracks and carry over segment boundaries like in a sequential run.
+        Args:
+            video_path: Path of the video, decoded by the workers
+            num_workers: Number of processes, os.cpu_count() by default
+            segment_size: Frames per segment
+            overlap: Frames tracked before each segment to match the ids
+            read_from_stub, stub_path, stub_cache: As in get_object_tracks.
+                With stub_cache every segment is saved as soon as it is stitched
+        """
+        if stub_cache is None and read_from_stub and stub_path and os.path.exists(stub_path):
+            with open(stub_path,'rb') as f:
+                return pickle.load(f)
+
+        overlap = min(max(overlap,1),segment_size)
+        num_cached_frames = 0
+        chunks = []
+        if stub_cache is not None:
+            if not read_from_stub:
+                stub_cache.clear()
+            num_cached_frames,arrays = stub_cache.read_arrays()
+            if num_cached_frames:
+                chunks.append(arrays)
+            if stub_cache.is_complete():
+                return TrackTable.from_arrays(arrays,num_frames=num_cached_frames).to_tracks()
+
+        # The header frame count may be off, the last segment runs to the end
+        frame_count = get_frame_count(video_path)
+        segment_starts = list(range(num_cached_frames,max(frame_count,num_cached_frames+1),segment_size))
+        segment_ends = segment_starts[1:]+[None]
+
+        next_track_id = int(max((chunk['track_id'].max() for chunk in chunks if len(chunk['track_id'])),default=0))+1
+        num_frames = num_cached_frames
+        segments = {}
+        with ProcessPoolExecutor(
+            max_workers=num_workers or os.cpu_count(),
+            initializer=_init_segment_worker,
+            initargs=(
+                self.model_path,
+                self.batch_size,
+                self.detection_pipeline.preprocess,
+                self.sparse_detector.stride if self.sparse_detector is not None else 1,
+                self.inference_backend,
+                self.precision,
+                self.calibration_data
+            )
+        ) as executor:
+            futures = [
+                executor.submit(_track_segment,video_path,segment_start,segment_end,overlap)
+                for segment_start,segment_end in zip(segment_starts,segment_ends)
+            ]
+            for future in as_completed(futures):
+                segment_start,segment_num_frames,segment_arrays = future.result()
+                segments[segment_start] = (segment_num_frames,segment_arrays)
+
+                # Stitch the segments that are now contiguous, up to the first
+                # one cut short by the end of the video
+                while num_frames in segments:
+                    segment_num_frames,segment_arrays = segments.pop(num_frames)
+                    previous_arrays = chunks[-1] if chunks else {name:array[:0] for name,array in segment_arrays.items()}
+                    arrays,next_track_id = stitch_segment(previous_arrays,segment_arrays,num_frames,next_track_id)
+                    if stub_cache is not None and segment_num_frames:
+                        stub_cache.write_chunk(num_frames,segment_num_frames,**arrays)
+                    chunks.append(arrays)
+                    num_frames += segment_num_frames
+                    if segment_num_frames < segment_size:
+                        for pending in futures:
+                            pending.cancel()
+                        segments.clear()
+                        break
+
+        arrays = {name:np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+        tracks = TrackTable.from_arrays(arrays,num_frames=num_frames).to_tracks()
+
+        if stub_cache is not None:
+            stub_cache.mark_complete(num_frames)
+        elif stub_path is not None:
+            with open(stub_path,'wb') as f:
+                pickle.dump(tracks,f)
+
+        return tracks
+
+    def _write_track_chunk(self,stub_cache,tracks,start_frame,end_frame):
+        chunk_tracks = {obj_name:obj[start_frame:end_frame] for obj_name,obj in tracks.items()}
+        arrays = TrackTable.from_tracks(chunk_tracks).to_arrays()
+        arrays['frame'] = arrays['frame']+start_frame
+        stub_cache.write_chunk(start_frame,end_frame-start_frame,**arrays)
+
+    def _get_cached_object_tracks(self,frames,read_from_stub,stub_cache):
+        if not read_from_stub:
+            stub_cache.clear()
+
+        num_cached_frames,arrays = stub_cache.read_arrays()
+        if num_cached_frames:
+            tracks = TrackTable.from_arrays(arrays,num_frames=num_cached_frames).to_tracks()
+        else:
+            tracks = self.init_tracks()
+        if stub_cache.is_complete():
+            return tracks
 
-                if str(class_name) == 'referee': #if detected object is referee
-                    tracks['referees'][frame_num][track_id] = {'bbox':bbox}
+        # ByteTrack starts over when resuming, keep its ids clear of the cached
+        # ones (adjust_tracks links the new ids back to the cached ones)
+        if len(arrays.get('track_id',[])):
+            self.track_id_offset = int(arrays['track_id'].max())+1
 
-            for obj_in_frame in detection_supervision:
-                if str(obj_in_frame[5]['class_name']) == 'ball': #if detected object is ball
-                    tracks['ball'][frame_num]={'bbox': obj_in_frame[0].tolist()}
+        chunk_start_frame = num_cached_frames
+        def save_chunk(frame_num,frame):
+            nonlocal chunk_start_frame
+            num_frames = len(tracks['players'])
+            if num_frames-chunk_start_frame >= stub_cache.chunk_size:
+                self._write_track_chunk(stub_cache,tracks,chunk_start_frame,num_frames)
+                chunk_start_frame = num_frames
 
-            if stub_path is not None:
-                with open(stub_path,'wb') as f:
-                    pickle.dump(tracks,f)
+        self.track_frames(tracks,itertools.islice(frames,num_cached_frames,None),save_chunk)
 
+        num_frames = len(tracks['players'])
+        if num_frames > chunk_start_frame:
+            self._write_track_chunk(stub_cache,tracks,chunk_start_frame,num_frames)
+        stub_cache.mark_complete(num_frames)
 
         return tracks
     
@@ -218,54 +546,69 @@ class Tracker:
 
     def draw_team_ball_control(self,frame,frame_num,team_ball_control):
         # Draw semi transparent rectangle
-        overlay = frame.copy()
-        cv2.rectangle(overlay,(1350,850),(1900,1000),(255,255,255),cv2.FILLED)
         alpha = 0.4
-        cv2.addWeighted(overlay,alpha,frame,1-alpha,0,frame)
+        draw_transparent_rectangle(frame,(1350,850),(1900,1000),(255,255,255),alpha)
 
-        team_ball_control_till_frame = team_ball_control[:frame_num+1]
-        #get number of time each team had ball control
-        team_1_num_frames = (team_ball_control_till_frame[team_ball_control_till_frame==1]).shape[0]
-        team_2_num_frames = len(team_ball_control_till_frame) - team_1_num_frames
-        
-        team_1 = (team_1_num_frames)/(team_1_num_frames+team_2_num_frames)
-        team_2 = 1-team_1
+        if hasattr(team_ball_control,'get_ball_control'):
+            # BallControl keeps cumulative counts, O(1) per frame
+            team_1,team_2 = team_ball_control.get_ball_control(frame_num)
+        else:
+            # team_ball_control may be a list that is still growing (streaming mode)
+            team_ball_control_till_frame = np.asarray(team_ball_control[:frame_num+1])
+            #get number of time each team had ball control
+            team_1_num_frames = (team_ball_control_till_frame[team_ball_control_till_frame==1]).shape[0]
+            team_2_num_frames = len(team_ball_control_till_frame) - team_1_num_frames
+
+            team_1 = (team_1_num_frames)/(team_1_num_frames+team_2_num_frames)
+            team_2 = 1-team_1
 
         cv2.putText(frame,f"Team 1 Ball Control: {team_1*100:.2f}%",(1400,900),cv2.FONT_HERSHEY_SIMPLEX,1,(0,0,0),3)
         cv2.putText(frame,f"Team 2 Ball Control: {team_2*100:.2f}%",(1400,950),cv2.FONT_HERSHEY_SIMPLEX,1,(0,0,0),3)
 
         return frame
 
-    def draw_annotations(self,video_frames,tracks,team_ball_control):
-        output_video_frames = []
+    def draw_frame_tracks(self,frame,frame_num,tracks):
+        """
+        Draw players, referees and the ball of one frame in place
+        """
+        player_dict = tracks['players'][frame_num]
+        ball_dict = tracks['ball'][frame_num]
+        referee_dict = tracks['referees'][frame_num]
+
+        #Draw players
+        for track_id,player in player_dict.items():
+            color = player.get('team_color',(0,0,255))
+            self.draw_ellipse(frame,player['bbox'],color,track_id)
+
+            if player.get('has_ball',False):
+                self.draw_traingle(frame,player['bbox'],(0,0,255))
+    
+        #Draw referees
+        for track_id,referee in referee_dict.items():
+            self.draw_ellipse(frame,referee['bbox'],(0,0,0),None)
 
-        for frame_num,frame in enumerate(video_frames):
-            frame = frame.copy()
+        #Draw ball
+        if ball_dict:
+            self.draw_traingle(frame,ball_dict['bbox'],(0,255,0))
 
-            player_dict = tracks['players'][frame_num]
-            ball_dict = tracks['ball'][frame_num]
-            referee_dict = tracks['referees'][frame_num]
+        return frame
 
-            #Draw players
-            for track_id,player in player_dict.items():
-                color = player.get('team_color',(0,0,255))
-                frame = self.draw_ellipse(frame,player['bbox'],color,track_id)
+    def draw_frame_annotations(self,frame,frame_num,tracks,team_ball_control):
+        """
+        Draw tracks and team ball control of one frame in place
+        """
+        self.draw_frame_tracks(frame,frame_num,tracks)
 
-                if player.get('has_ball',False):
-                    frame = self.draw_traingle(frame,player['bbox'],(0,0,255))
-        
-            #Draw referees
-            for track_id,referee in referee_dict.items():
-                frame = self.draw_ellipse(frame,referee['bbox'],(0,0,0),None)
+        #Draw Team ball control
+        self.draw_team_ball_control(frame,frame_num,team_ball_control)
 
-            #Draw ball
-            if ball_dict:
-                frame = self.draw_traingle(frame,ball_dict['bbox'],(0,255,0))
+        return frame
 
-            #Draw Team ball control
-            frame = self.draw_team_ball_control(frame,frame_num,team_ball_control)
-            
+    def draw_annotations(self,video_frames,tracks,team_ball_control):
+        output_video_frames = []
 
+        for frame_num,frame in enumerate(video_frames):
+            frame = self.draw_frame_annotations(frame.copy(),frame_num,tracks,team_ball_control)
             output_video_frames.append(frame)
             
         return output_video_frames
@@ -1,2 +1,9 @@
-from .video_utils import read_video,save_video
-from .bbox_utils import get_center_bbox,get_bbox_width,measure_distance,measure_xy_distance,get_foot_position,measure_bbox_distances
\ No newline at end of file
+from .video_utils import save_video,iter_video_frames,read_frame,batch_frames,get_frame_count
+from .video_io import VideoReader,VideoWriter,get_video_fps,DEFAULT_FPS
+from .bbox_utils import get_center_bbox,get_bbox_width,measure_distance,measure_xy_distance,get_foot_position,measure_bbox_distances
+from .draw_utils import draw_transparent_rectangle
+from .track_table import TrackTable,TRACK_CLASSES,BALL_TRACK_ID
+from .stub_cache import StubCache,StageCache,hash_file
+from .profiler import StageProfiler
+from .frame_store import FrameStore,open_frame_store
+from .analytics_export import AnalyticsExporter,AnalyticsDataset,ANALYTICS_FORMATS
\ No newline at end of file
@@ -0,0 +1,494 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from .track_table import TRACK_CLASSES
+
+ANALYTICS_FORMATS = ('npz','parquet')
+
+# Columns of every exported table. Float columns are float32 except the time,
+# positions are in pixels, field positions in meters, speed in km/h and
+# distance is the distance covered so far in meters.
+ANALYTICS_SCHEMA = {
+    'tracks':{
+        'frame':'int64',
+        'time':'float64',
+        'object':'str',
+        'track_id':'int64',
+        'bbox_x1':'float32',
+        'bbox_y1':'float32',
+        'bbox_x2':'float32',
+        'bbox_y2':'float32',
+        'x':'float32',
+        'y':'float32',
+        'adjusted_x':'float32',
+        'adjusted_y':'float32',
+        'field_x':'float32',
+        'field_y':'float32',
+        'speed':'float32',
+        'distance':'float32',
+        'team':'int8',
+        'has_ball':'bool'
+    },
+    'frames':{
+        'frame':'int64',
+        'time':'float64',
+        'camera_x':'float32',
+        'camera_y':'float32',
+        'ball_player':'int64',
+        'possession_team':'int8',
+        'ball_control_team':'int8'
+    },
+    'players':{
+        'track_id':'int64',
+        'team':'int8',
+        'first_frame':'int64',
+        'last_frame':'int64',
+        'frames':'int64',
+        'minutes':'float64',
+        'distance':'float32',
+        'max_speed':'float32',
+        'mean_speed':'float32',
+        'frames_with_ball':'int64'
+    },
+    'teams':{
+        'team':'int8',
+        'players':'int64',
+        'distance':'float32',
+        'possession_frames':'int64',
+        'possession':'float64',
+        'ball_control_frames':'int64',
+        'ball_control':'float64'
+    }
+}
+
+FILTER_OPS = ('==','!=','<','<=','>','>=','in','not in')
+
+def _check_format(format):
+    if format not in ANALYTICS_FORMATS:
+        raise ValueError(f"Unknown analytics format {format!r}, expected one of {', '.join(ANALYTICS_FORMATS)}")
+    if format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("Parquet analytics export needs pyarrow (pip install pyarrow), or use format='npz'")
+
+def _column_stats(values):
+    """
+    Returns:
+        [min, max] of a column chunk ignoring NaN, None if it has no values
+    """
+    if values.dtype.kind == 'U':
+        values = np.unique(values)
+        return [str(values[0]),str(values[-1])] if len(values) else None
+    if values.dtype.kind == 'f':
+        values = values[~np.isnan(values)]
+    if not len(values):
+        return None
+    return [values.min().item(),values.max().item()]
+
+def _check_filter(column,op):
+    if op not in FILTER_OPS:
+        raise ValueError(f"Unknown filter operator {op!r} on {column!r}, expected one of {', '.join(FILTER_OPS)}")
+
+def _may_match(stats,op,value):
+    """
+    Whether a chunk with [min, max] stats of a column may have rows matching
+    the filter (predicate pushdown). NaN never compares true, so a chunk
+    without values only matches != and not in.
+    """
+    if op in ('!=','not in'):
+        return True
+    if stats is None:
+        return False
+    low,high = stats
+    if op == '==':
+        return low <= value <= high
+    if op == '<':
+        return low < value
+    if op == '<=':
+        return low <= value
+    if op == '>':
+        return high > value
+    if op == '>=':
+        return high >= value
+    return any(low <= item <= high for item in value)
+
+def _filter_mask(values,op,value):
+    if op == '==':
+        return values == value
+    if op == '!=':
+        return values != value
+    if op == '<':
+        return values < value
+    if op == '<=':
+        return values <= value
+    if op == '>':
+        return values > value
+    if op == '>=':
+        return values >= value
+    mask = np.isin(values,list(value))
+    return mask if op == 'in' else ~mask
+
+class AnalyticsExporter():
+    """
+    Streaming columnar export of the analytics of one match: the per-frame
+    track table, per-frame camera movement and possession, and per-player and
+    per-team summaries.
+
+    Frames are added one at a time as they are finished (teams and possession
+    assigned) and written in chunks of chunk_size frames, so memory does not
+    grow with the match and a run that fails keeps every chunk written so
+    far. Chunks are compressed .npz files (one array per column, read
+    column by column) or Parquet files with format='parquet' (needs pyarrow).
+    Every chunk is written to a temporary file and renamed, and the manifest
+    is rewritten after every chunk with the [min, max] of each of its
+    columns, which AnalyticsDataset uses to skip the chunks a query can't
+    match. The summaries are written by close(), which marks the match
+    complete.
+
+    Layout:
+        path/manifest.json                 match, fps, format, complete, tables
+        path/<table>/part-000000.<format>  tables tracks, frames, players, teams
+    """
+    def __init__(self,path,fps=24,chunk_size=500,format='npz',match=None,video=None):
+        """
+        Args:
+            path: Directory of the match, replaced if it exists
+            fps: Frame rate, for the time column and minutes played
+            chunk_size: Frames per chunk
+            format: 'npz' or 'parquet'
+            match: Name of the match, the directory name by default
+            video: Source video kept in the manifest
+        """
+        _check_format(format)
+        self.path = path
+        self.fps = fps
+        self.chunk_size = chunk_size
+        self.format = format
+        self.match = match or os.path.basename(os.path.normpath(path))
+        self.video = video
+        self.num_frames = 0
+        self.complete = False
+        self.tables = {name:{'columns':columns,'chunks':[]} for name,columns in ANALYTICS_SCHEMA.items()}
+        self._pending = {'tracks':[],'frames':[]}
+        self._pending_frames = 0
+        # Running per-player sums, summarized by close()
+        self._players = {}
+        self._team_frames = {'possession':{},'ball_control':{}}
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        for name in self.tables:
+            os.makedirs(os.path.join(path,name))
+        self._save_manifest()
+
+    def _save_manifest(self):
+        tmp_path = os.path.join(self.path,'manifest.json.tmp')
+        with open(tmp_path,'w') as f:
+            json.dump({
+                'match':self.match,
+                'video':self.video,
+                'fps':self.fps,
+                'format':self.format,
+                'num_frames':self.num_frames,
+                'complete':self.complete,
+                'tables':self.tables
+            },f,indent=4)
+        os.replace(tmp_path,os.path.join(self.path,'manifest.json'))
+
+    def add_frame(self,frame_num,track_table,player_track,ball_player=-1,camera_movement=(0,0),ball_control_team=0):
+        """
+        Add the rows of a finished frame
+        Args:
+            frame_num: Frame number, frames are added in order
+            track_table: TrackTable of the match with positions, speed and distance
+            player_track: {track_id: track} of the frame's players with their
+                assigned 'team'
+            ball_player: Track id of the player with the ball, -1 for none
+            camera_movement: (x, y) camera movement of the frame
+            ball_control_team: Team in control of the ball, see BallControl
+        """
+        rows = track_table.frame_rows(frame_num)
+        track_id = track_table.track_id[rows]
+        class_id = track_table.class_id[rows]
+        is_player = class_id == TRACK_CLASSES.index('players')
+        team = np.array([player_track.get(player_id,{}).get('team',0) if player else 0
+                         for player_id,player in zip(track_id.tolist(),is_player.tolist())],dtype=np.int8)
+        bbox = track_table.bbox[rows]
+        time = frame_num/self.fps
+        self._pending['tracks'].append({
+            'frame':track_table.frame[rows],
+            'time':np.full(len(track_id),time),
+            'object':np.asarray(TRACK_CLASSES)[class_id],
+            'track_id':track_id,
+            'bbox_x1':bbox[:,0],
+            'bbox_y1':bbox[:,1],
+            'bbox_x2':bbox[:,2],
+            'bbox_y2':bbox[:,3],
+            'x':track_table.position[rows,0],
+            'y':track_table.position[rows,1],
+            'adjusted_x':track_table.adjusted_position[rows,0],
+            'adjusted_y':track_table.adjusted_position[rows,1],
+            'field_x':track_table.position_transformed[rows,0],
+            'field_y':track_table.position_transformed[rows,1],
+            'speed':track_table.speed[rows],
+            'distance':track_table.distance[rows],
+            'team':team,
+            'has_ball':is_player & (track_id == ball_player)
+        })
+        possession_team = player_track.get(ball_player,{}).get('team',0) if ball_player != -1 else 0
+        self._pending['frames'].append({
+            'frame':frame_num,
+            'time':time,
+            'camera_x':camera_movement[0],
+            'camera_y':camera_movement[1],
+            'ball_player':ball_player,
+            'possession_team':possession_team,
+            'ball_control_team':ball_control_team
+        })
+        self._pending_frames += 1
+        if self._pending_frames >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the frames added since the last chunk
+        """
+        if not self._pending_frames:
+            return
+        tracks = {column:np.concatenate([frame[column] for frame in self._pending['tracks']]).astype(dtype)
+                  for column,dtype in ANALYTICS_SCHEMA['tracks'].items()}
+        frames = {column:np.asarray([frame[column] for frame in self._pending['frames']],dtype=dtype)
+                  for column,dtype in ANALYTICS_SCHEMA['frames'].items()}
+        self._write_chunk('tracks',tracks)
+        self._write_chunk('frames',frames)
+        self._update_summaries(tracks,frames)
+        self.num_frames += self._pending_frames
+        self._pending = {'tracks':[],'frames':[]}
+        self._pending_frames = 0
+        self._save_manifest()
+
+    def _write_chunk(self,name,columns):
+        chunks = self.tables[name]['chunks']
+        chunk_path = os.path.join(name,f"part-{len(chunks):06d}.{self.format}")
+        file_path = os.path.join(self.path,chunk_path)
+        tmp_path = file_path+'.tmp'
+        if self.format == 'npz':
+            with open(tmp_path,'wb') as f:
+                np.savez_compressed(f,**columns)
+        else:
+            pd.DataFrame(columns).to_parquet(tmp_path,index=False)
+        os.replace(tmp_path,file_path)
+        num_rows = len(next(iter(columns.values()))) if columns else 0
+        chunks.append({
+            'path':chunk_path,
+            'rows':num_rows,
+            'stats':{column:_column_stats(values) for column,values in columns.items()}
+        })
+
+    def _update_summaries(self,tracks,frames):
+        is_player = tracks['object'] == 'players'
+        for player_id in np.unique(tracks['track_id'][is_player]).tolist():
+            rows = is_player & (tracks['track_id'] == player_id)
+            speed = tracks['speed'][rows]
+            speed = speed[~np.isnan(speed)]
+            distance = tracks['distance'][rows]
+            distance = distance[~np.isnan(distance)]
+            player = self._players.setdefault(player_id,{
+                'first_frame':int(tracks['frame'][rows][0]),
+                'frames':0,
+                'teams':{},
+                'distance':np.nan,
+                'max_speed':np.nan,
+                'speed_sum':0.0,
+                'speed_frames':0,
+                'frames_with_ball':0
+            })
+            player['last_frame'] = int(tracks['frame'][rows][-1])
+            player['frames'] += int(rows.sum())
+            teams,counts = np.unique(tracks['team'][rows],return_counts=True)
+            for team,count in zip(teams.tolist(),counts.tolist()):
+                player['teams'][team] = player['teams'].get(team,0)+count
+            if len(distance):
+                player['distance'] = np.fmax(player['distance'],float(distance.max()))
+            if len(speed):
+                player['max_speed'] = np.fmax(player['max_speed'],float(speed.max()))
+                player['speed_sum'] += float(speed.sum())
+                player['speed_frames'] += len(speed)
+            player['frames_with_ball'] += int(tracks['has_ball'][rows].sum())
+
+        for key,column in (('possession','possession_team'),('ball_control','ball_control_team')):
+            teams,counts = np.unique(frames[column],return_counts=True)
+            for team,count in zip(teams.tolist(),counts.tolist()):
+                if team:
+                    self._team_frames[key][team] = self._team_frames[key].get(team,0)+count
+
+    def get_summaries(self):
+        """
+        Returns:
+            (players, teams) column dicts of the frames written so far. A
+            player's team is the team it was assigned in most frames.
+        """
+        players = {column:[] for column in ANALYTICS_SCHEMA['players']}
+        for player_id,player in sorted(self._players.items()):
+            assigned = {team:count for team,count in player['teams'].items() if team}
+            players['track_id'].append(player_id)
+            players['team'].append(max(assigned,key=assigned.get) if assigned else 0)
+            players['first_frame'].append(player['first_frame'])
+            players['last_frame'].append(player['last_frame'])
+            players['frames'].append(player['frames'])
+            players['minutes'].append(player['frames']/self.fps/60)
+            players['distance'].append(player['distance'])
+            players['max_speed'].append(player['max_speed'])
+            players['mean_speed'].append(player['speed_sum']/player['speed_frames'] if player['speed_frames'] else np.nan)
+            players['frames_with_ball'].append(player['frames_with_ball'])
+        players = {column:np.asarray(values,dtype=ANALYTICS_SCHEMA['players'][column])
+                   for column,values in players.items()}
+
+        teams = {column:[] for column in ANALYTICS_SCHEMA['teams']}
+        possession_frames = sum(self._team_frames['possession'].values())
+        team_ids = set(players['team'].tolist())|set(self._team_frames['possession'])|set(self._team_frames['ball_control'])
+        for team in sorted(team_ids-{0}):
+            team_players = players['team'] == team
+            teams['team'].append(team)
+            teams['players'].append(int(team_players.sum()))
+            teams['distance'].append(float(np.nansum(players['distance'][team_players])))
+            teams['possession_frames'].append(self._team_frames['possession'].get(team,0))
+            teams['possession'].append(teams['possession_frames'][-1]/possession_frames if possession_frames else 0.0)
+            teams['ball_control_frames'].append(self._team_frames['ball_control'].get(team,0))
+            teams['ball_control'].append(teams['ball_control_frames'][-1]/self.num_frames if self.num_frames else 0.0)
+        teams = {column:np.asarray(values,dtype=ANALYTICS_SCHEMA['teams'][column])
+                 for column,values in teams.items()}
+        return players,teams
+
+    def close(self):
+        """
+        Write the remaining frames and the summaries and mark the match complete
+        """
+        if self.complete:
+            return
+        self.flush()
+        players,teams = self.get_summaries()
+        self._write_chunk('players',players)
+        self._write_chunk('teams',teams)
+        self.complete = True
+        self._save_manifest()
+
+class AnalyticsDataset():
+    """
+    Queries over the matches exported by AnalyticsExporter under one
+    directory (e.g. a season, one subdirectory per match), without loading
+    more than a query needs: matches and chunks whose manifest stats can't
+    match the filters are skipped without being opened, and only the
+    requested and filtered columns of the other chunks are read.
+
+    Filters are a list of (column, op, value) ANDed together, op one of
+    FILTER_OPS ('in' and 'not in' take a list), as in pandas.read_parquet.
+    The 'match' column (the match name) can be filtered and selected like
+    any other.
+    """
+    def __init__(self,root,include_incomplete=False):
+        """
+        Args:
+            root: Directory of the match directories, or of a single match
+            include_incomplete: Also read the chunks written so far of
+                matches that are still being processed or failed
+        """
+        self.root = root
+        self.include_incomplete = include_incomplete
+        # Chunks and rows of the last read, see read()
+        self.scan_stats = None
+
+    def _load_manifests(self):
+        if os.path.exists(os.path.join(self.root,'manifest.json')):
+            match_dirs = [self.root]
+        else:
+            match_dirs = [os.path.join(self.root,name) for name in sorted(os.listdir(self.root))
+                          if os.path.exists(os.path.join(self.root,name,'manifest.json'))]
+        manifests = []
+        for match_dir in match_dirs:
+            with open(os.path.join(match_dir,'manifest.json')) as f:
+                manifest = json.load(f)
+            if manifest['complete'] or self.include_incomplete:
+                manifest['path'] = match_dir
+                manifests.append(manifest)
+        return manifests
+
+    def matches(self):
+        """
+        Returns:
+            DataFrame of the matches: name, video, fps, frames, format, complete
+        """
+        return pd.DataFrame([{
+            'match':manifest['match'],
+            'video':manifest['video'],
+            'fps':manifest['fps'],
+            'frames':manifest['num_frames'],
+            'format':manifest['format'],
+            'complete':manifest['complete']
+        } for manifest in self._load_manifests()],columns=['match','video','fps','frames','format','complete'])
+
+    def _read_chunk(self,file_path,format,columns):
+        if format == 'npz':
+            with np.load(file_path) as data:
+                return {column:data[column] for column in columns}
+        chunk = pd.read_parquet(file_path,columns=columns)
+        return {column:chunk[column].to_numpy() for column in columns}
+
+    def read(self,table='tracks',columns=None,filters=None):
+        """
+        Args:
+            table: 'tracks', 'frames', 'players' or 'teams'
+            columns: Columns to return, all by default
+            filters: [(column, op, value), ...] rows must match
+        Returns:
+            DataFrame of the matching rows of every match, with a 'match'
+            column first. scan_stats then holds the number of matches,
+            chunks, chunks read and rows read.
+        """
+        if table not in ANALYTICS_SCHEMA:
+            raise ValueError(f"Unknown analytics table {table!r}, expected one of {', '.join(ANALYTICS_SCHEMA)}")
+        schema = ANALYTICS_SCHEMA[table]
+        columns = list(schema) if columns is None else [column for column in columns if column != 'match']
+        filters = list(filters or [])
+        for column,op,value in filters:
+            _check_filter(column,op)
+            if column != 'match' and column not in schema:
+                raise ValueError(f"Unknown column {column!r} of the {table} table")
+        for column in columns:
+            if column not in schema:
+                raise ValueError(f"Unknown column {column!r} of the {table} table")
+        match_filters = [(op,value) for column,op,value in filters if column == 'match']
+        row_filters = [(column,op,value) for column,op,value in filters if column != 'match']
+        read_columns = list(dict.fromkeys(columns+[column for column,_,_ in row_filters]))
+
+        self.scan_stats = {'matches':0,'chunks':0,'chunks_read':0,'rows_read':0}
+        parts = []
+        for manifest in self._load_manifests():
+            match = manifest['match']
+            if not all(_filter_mask(np.asarray([match]),op,value)[0] for op,value in match_filters):
+                continue
+            self.scan_stats['matches'] += 1
+            for chunk in manifest['tables'][table]['chunks']:
+                self.scan_stats['chunks'] += 1
+                if not all(_may_match(chunk['stats'][column],op,value) for column,op,value in row_filters):
+                    continue
+                data = self._read_chunk(os.path.join(manifest['path'],chunk['path']),manifest['format'],read_columns)
+                self.scan_stats['chunks_read'] += 1
+                self.scan_stats['rows_read'] += chunk['rows']
+                mask = np.ones(chunk['rows'],dtype=bool)
+                for column,op,value in row_filters:
+                    mask &= _filter_mask(data[column],op,value)
+                if not mask.any():
+                    continue
+                part = {'match':np.full(int(mask.sum()),match)}
+                part.update((column,data[column][mask]) for column in columns)
+                parts.append(pd.DataFrame(part))
+
+        if not parts:
+            return pd.DataFrame({'match':pd.Series(dtype=object),
+                                 **{column:pd.Series(dtype=object if schema[column] == 'str' else schema[column])
+                                    for column in columns}})
+        return pd.concat(parts,ignore_index=True)
@@ -0,0 +1,26 @@
+import cv2
+import numpy as np
+
+def draw_transparent_rectangle(frame,top_left,bottom_right,color,alpha):
+    """
+    Blend a filled rectangle into frame in place. Only the rectangle's region of
+    interest is blended, which gives the same pixels as blending a full-frame
+    overlay copy but touches a fraction of the memory.
+    Args:
+        frame: BGR frame, modified in place
+        top_left: (x1, y1) corner, inclusive like cv2.rectangle
+        bottom_right: (x2, y2) corner, inclusive like cv2.rectangle
+        color: BGR fill color
+        alpha: Opacity of the rectangle
+    """
+    height,width = frame.shape[:2]
+    x1,y1 = max(int(top_left[0]),0),max(int(top_left[1]),0)
+    x2,y2 = min(int(bottom_right[0])+1,width),min(int(bottom_right[1])+1,height)
+    if x1 >= x2 or y1 >= y2:
+        return frame
+
+    roi = frame[y1:y2,x1:x2]
+    overlay = np.empty_like(roi)
+    overlay[:] = color
+    cv2.addWeighted(overlay,alpha,roi,1-alpha,0,roi)
+    return frame
@@ -0,0 +1,298 @@
+import os
+import json
+import mmap
+import shutil
+import cv2
+import numpy as np
+
+class FrameStore():
+    """
+    Decoded frames of a video in a memory-mapped uint8 array on local disk.
+    Stages that go over the video several times (tracking, camera movement,
+    team assignment, annotation) read the frames as zero-copy views of the
+    mapped file instead of decoding the video again, and nothing is held on
+    the Python heap: pages are loaded and evicted by the OS page cache, so a
+    match larger than RAM only costs disk space (height*width*3 bytes per
+    frame).
+
+    An optional companion array holds the frames in grayscale, downscaled by
+    gray_scale, for camera movement estimation, which then reads a third of
+    the data (less when downscaled) and skips the conversion.
+
+    A store is written once, in frame order (append, or tee around the
+    decoder of the first pass), then finished, which maps it read-only.
+    Views of a finished store can't be drawn on, copy the frame first.
+    Frames a sequential pass is done with are released from the process
+    (the page cache keeps them while memory allows), so the resident memory
+    of a pass stays at a few frames however long the match.
+
+    Layout:
+        path/frames.u8   (frames, height, width, 3) BGR
+        path/gray.u8     (frames, gray height, gray width), optional
+        path/store.json  frame size, gray scale, number of frames, complete
+    """
+    def __init__(self,path,mode='r'):
+        """
+        Map an existing store
+        Args:
+            path: Directory of the store
+            mode: 'r' for a finished store, 'r+' to continue writing it
+        """
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path,'store.json')) as f:
+            metadata = json.load(f)
+        self.width = metadata['width']
+        self.height = metadata['height']
+        self.gray_scale = metadata['gray_scale']
+        self.num_frames = metadata['num_frames']
+        self.capacity = metadata['capacity']
+        self.complete = metadata['complete']
+        self.source = metadata.get('source')
+        if self.gray_scale is not None:
+            self.gray_width = max(int(round(self.width*self.gray_scale)),1)
+            self.gray_height = max(int(round(self.height*self.gray_scale)),1)
+        self._frames = None
+        self._gray = None
+        self._map()
+
+    @classmethod
+    def create(cls,path,width,height,capacity=0,gray_scale=None,source=None):
+        """
+        Create an empty store, replacing any store at path
+        Args:
+            path: Directory of the store, on a local disk
+            width, height: Frame size
+            capacity: Expected number of frames, e.g. the video's frame
+                count. The files grow when more frames are appended.
+            gray_scale: Also store grayscale frames, downscaled by this
+                factor (1.0 for full size), None for no grayscale companion
+            source: Description of the source kept in the metadata, e.g. the
+                video path and hash
+        """
+        capacity = max(int(capacity),1)
+        frame_bytes = width*height*3
+        if gray_scale is not None:
+            frame_bytes += max(int(round(width*gray_scale)),1)*max(int(round(height*gray_scale)),1)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        free_bytes = shutil.disk_usage(path).free
+        if free_bytes < capacity*frame_bytes:
+            shutil.rmtree(path)
+            raise OSError(f"Frame store needs {capacity*frame_bytes/1e9:.1f} GB, "
+                          f"{os.path.dirname(os.path.abspath(path))} has {free_bytes/1e9:.1f} GB free")
+        cls._write_metadata(path,{
+            'width':width,
+            'height':height,
+            'gray_scale':gray_scale,
+            'num_frames':0,
+            'capacity':capacity,
+            'complete':False,
+            'source':source
+        })
+        return cls(path,mode='r+')
+
+    @staticmethod
+    def _write_metadata(path,metadata):
+        tmp_path = os.path.join(path,'store.json.tmp')
+        with open(tmp_path,'w') as f:
+            json.dump(metadata,f,indent=4)
+        os.replace(tmp_path,os.path.join(path,'store.json'))
+
+    def _save_metadata(self):
+        self._write_metadata(self.path,{
+            'width':self.width,
+            'height':self.height,
+            'gray_scale':self.gray_scale,
+            'num_frames':self.num_frames,
+            'capacity':self.capacity,
+            'complete':self.complete,
+            'source':self.source
+        })
+
+    def _map(self):
+        # A finished store is mapped up to its last frame, a store being
+        # written up to its capacity (the files are sparse until written)
+        num_frames = self.num_frames if self.mode == 'r' else self.capacity
+        self._frames = self._map_file('frames.u8',(num_frames,self.height,self.width,3))
+        if self.gray_scale is not None:
+            self._gray = self._map_file('gray.u8',(num_frames,self.gray_height,self.gray_width))
+
+    def _map_file(self,name,shape):
+        file_path = os.path.join(self.path,name)
+        if self.mode != 'r':
+            size = int(np.prod(shape))
+            with open(file_path,'ab') as f:
+                if f.tell() < size:
+                    f.truncate(size)
+        if shape[0] == 0:
+            return np.empty(shape,dtype=np.uint8)
+        return np.memmap(file_path,dtype=np.uint8,mode=self.mode,shape=shape)
+
+    def _unmap(self):
+        for array in (self._frames,self._gray):
+            if isinstance(array,np.memmap) and self.mode != 'r':
+                array.flush()
+        self._frames = None
+        self._gray = None
+
+    def __len__(self):
+        return self.num_frames
+
+    def __getitem__(self,frame_num):
+        """
+        Returns:
+            (height, width, 3) view of a frame, no copy
+        """
+        if not -self.num_frames <= frame_num < self.num_frames:
+            raise IndexError(f"Frame {frame_num} out of range for a store of {self.num_frames} frames")
+        return self._frames[frame_num]
+
+    def get_gray(self,frame_num):
+        """
+        Returns:
+            View of the grayscale (downscaled) frame
+        """
+        if self._gray is None:
+            raise ValueError("The frame store has no grayscale frames")
+        if not -self.num_frames <= frame_num < self.num_frames:
+            raise IndexError(f"Frame {frame_num} out of range for a store of {self.num_frames} frames")
+        return self._gray[frame_num]
+
+    def _release(self,array,start_frame,end_frame):
+        """
+        Drop the pages of frames start_frame to end_frame from this process's
+        resident memory. They stay in the file (and the page cache), a later
+        read maps them again.
+        """
+        mapping = getattr(array,'_mmap',None)
+        if mapping is None or not hasattr(mapping,'madvise'):
+            return
+        frame_bytes = array[0].nbytes
+        start = start_frame*frame_bytes//mmap.PAGESIZE*mmap.PAGESIZE
+        end = end_frame*frame_bytes//mmap.PAGESIZE*mmap.PAGESIZE
+        if end > start:
+            mapping.madvise(mmap.MADV_DONTNEED,start,end-start)
+
+    def _iter_frames(self,array,start_frame,end_frame,release_lag,release_every=16):
+        end_frame = self.num_frames if end_frame is None else min(end_frame,self.num_frames)
+        released_frame = start_frame
+        for frame_num in range(start_frame,end_frame):
+            yield array[frame_num]
+            if frame_num-release_lag-released_frame >= release_every:
+                self._release(array,released_frame,frame_num-release_lag)
+                released_frame = frame_num-release_lag
+
+    def frames(self,start_frame=0,end_frame=None,release_lag=2):
+        """
+        Views of the frames from start_frame to end_frame
+        Args:
+            release_lag: Frames before the last one read that the consumer may
+                still look at (optical flow keeps the previous frame), older
+                frames are released. Consumers reading ahead through queues
+                need the number of frames they have in flight.
+        """
+        return self._iter_frames(self._frames,start_frame,end_frame,release_lag)
+
+    def gray_frames(self,start_frame=0,end_frame=None,release_lag=2):
+        """
+        Views of the grayscale frames from start_frame to end_frame, see
+        CameraMovementEstimator (gray_scale must be its downscale) and frames
+        """
+        if self._gray is None:
+            raise ValueError("The frame store has no grayscale frames")
+        return self._iter_frames(self._gray,start_frame,end_frame,release_lag)
+
+    def append(self,frame):
+        """
+        Store the next frame of the video
+        """
+        if self.mode == 'r':
+            raise ValueError("The frame store is finished, it can't be written")
+        if frame.shape != (self.height,self.width,3):
+            raise ValueError(f"Frame of shape {frame.shape} does not fit a store of "
+                             f"{self.width}x{self.height} frames")
+        if self.num_frames == self.capacity:
+            # The header frame count was short, grow the files by a quarter
+            self._unmap()
+            self.capacity += max(self.capacity//4,1)
+            self._map()
+
+        self._frames[self.num_frames] = frame
+        if self._gray is not None:
+            gray = cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)
+            if self.gray_scale != 1.0:
+                # The same conversion as CameraMovementEstimator
+                gray = cv2.resize(gray,None,fx=self.gray_scale,fy=self.gray_scale,interpolation=cv2.INTER_AREA)
+            self._gray[self.num_frames] = gray
+        self.num_frames += 1
+        # Written frames go to the file through the page cache
+        if self.num_frames%16 == 0:
+            for array in (self._frames,self._gray):
+                if array is not None:
+                    self._release(array,self.num_frames-16,self.num_frames)
+
+    def tee(self,frames):
+        """
+        Store frames as they go by, e.g. while the first pass decodes them
+        Returns:
+            Generator of the frames
+        """
+        for frame in frames:
+            self.append(frame)
+            yield frame
+
+    def finish(self):
+        """
+        Trim the files to the stored frames, mark the store complete and map
+        it read-only
+        """
+        if self.mode == 'r':
+            return self
+        self._unmap()
+        self.capacity = max(self.num_frames,1)
+        for name,frame_bytes in (('frames.u8',self.height*self.width*3),
+                                 ('gray.u8',self.gray_height*self.gray_width if self.gray_scale is not None else 0)):
+            file_path = os.path.join(self.path,name)
+            if frame_bytes and os.path.exists(file_path):
+                os.truncate(file_path,self.num_frames*frame_bytes)
+        self.complete = True
+        self._save_metadata()
+        self.mode = 'r'
+        self._map()
+        return self
+
+    @property
+    def nbytes(self):
+        """
+        Bytes of the stored frames on disk
+        """
+        frame_bytes = self.height*self.width*3
+        if self.gray_scale is not None:
+            frame_bytes += self.gray_height*self.gray_width
+        return self.num_frames*frame_bytes
+
+    def close(self):
+        self._unmap()
+
+    def delete(self):
+        """
+        Unmap the store and remove its files
+        """
+        self.close()
+        shutil.rmtree(self.path,ignore_errors=True)
+
+def open_frame_store(store_dir,name,width,height,capacity=0,gray_scale=None,source=None):
+    """
+    The finished store store_dir/name if there is one with the same frame
+    size, grayscale companion and source, else a new store to fill
+    """
+    path = os.path.join(store_dir,name)
+    if os.path.exists(os.path.join(path,'store.json')):
+        store = FrameStore(path)
+        if (store.complete and (store.width,store.height) == (width,height) and store.gray_scale == gray_scale
+                and store.source == source):
+            return store
+        store.close()
+    return FrameStore.create(path,width,height,capacity,gray_scale,source)
@@ -0,0 +1,189 @@
+import os
+import time
+import json
+import csv
+import cProfile
+from contextlib import contextmanager,nullcontext
+import numpy as np
+try:
+    import resource
+except ImportError:  # Not available on Windows, peak memory is not reported
+    resource = None
+
+# Latency histogram bins in milliseconds, log spaced from 0.1 ms to 100 s
+LATENCY_BIN_EDGES_MS = np.concatenate([[0.0],np.logspace(-1,5,61)])
+
+def _cpu_time():
+    # Includes finished child processes, e.g. the camera movement pool
+    times = os.times()
+    return times.user+times.system+times.children_user+times.children_system
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+class StageProfiler():
+    """
+    Wall time, CPU time, peak memory and frames/sec of every pipeline stage.
+
+    Whole-video stages are timed with the stage() context manager, per-frame
+    work (team assignment, every draw layer, the latency of the live path)
+    with add_time() or timed(). Every call also goes into a latency histogram
+    of its stage, so per-frame stages get their latency distribution with
+    O(1) memory. CPU time includes finished child processes, peak RSS is the
+    peak of this process so far.
+
+    With profile_dir, every stage() call is also run under cProfile and the
+    stats are dumped to <profile_dir>/<stage>.prof (view with snakeviz or
+    pstats). stage_hook(name) may return a context manager wrapped around
+    every stage() call instead, e.g. a sampling profiler.
+    """
+    def __init__(self,profile_dir=None,stage_hook=None):
+        self.profile_dir = profile_dir
+        self.stage_hook = stage_hook
+        self.stages = {}
+        self._profiling = False
+
+    def _get_stage(self,name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = {
+                'calls':0,
+                'frames':0,
+                'wall_seconds':0.0,
+                'cpu_seconds':0.0,
+                'peak_rss_mb':None,
+                'histogram':np.zeros(len(LATENCY_BIN_EDGES_MS),dtype=np.int64),
+                'max_seconds':0.0
+            }
+        return stage
+
+    def add_time(self,name,wall_seconds,cpu_seconds=0.0,frames=1):
+        """
+        Add one call of a stage, e.g. the processing of one frame
+        """
+        stage = self._get_stage(name)
+        stage['calls'] += 1
+        stage['frames'] += frames
+        stage['wall_seconds'] += wall_seconds
+        stage['cpu_seconds'] += cpu_seconds
+        stage['max_seconds'] = max(stage['max_seconds'],wall_seconds)
+        stage['histogram'][np.searchsorted(LATENCY_BIN_EDGES_MS,wall_seconds*1000,side='right')-1] += 1
+
+    @contextmanager
+    def stage(self,name,frames=0):
+        """
+        Time a block as one call of a stage
+        Args:
+            name: Stage name
+            frames: Frames processed by the block, can also be set on the
+                yielded dict as info['frames'] once known
+        """
+        info = {'frames':frames}
+        profiler = None
+        if self.profile_dir is not None and not self._profiling:
+            os.makedirs(self.profile_dir,exist_ok=True)
+            profiler = cProfile.Profile()
+            self._profiling = True
+        hook = self.stage_hook(name) if self.stage_hook is not None else nullcontext()
+
+        start_wall = time.perf_counter()
+        start_cpu = _cpu_time()
+        try:
+            with hook:
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    yield info
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            self.add_time(name,time.perf_counter()-start_wall,_cpu_time()-start_cpu,info['frames'])
+            self.stages[name]['peak_rss_mb'] = _peak_rss_mb()
+            if profiler is not None:
+                self._profiling = False
+                profiler.dump_stats(os.path.join(self.profile_dir,f'{name.replace("/","_")}.prof'))
+
+    def timed(self,name,function):
+        """
+        Wrap function so every call is added to the stage name, e.g. a draw
+        layer called once per frame
+        """
+        def timed_function(*args,**kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args,**kwargs)
+            finally:
+                self.add_time(name,time.perf_counter()-start)
+        return timed_function
+
+    def get_latency_percentiles(self,name,percentiles=(50,95,99)):
+        """
+        Returns:
+            {percentile: milliseconds} of the calls of a stage, estimated from
+            its histogram (upper edge of the bin, at most the slowest call)
+        """
+        stage = self.stages[name]
+        cumulative = np.cumsum(stage['histogram'])
+        upper_edges = np.append(LATENCY_BIN_EDGES_MS[1:],np.inf)
+        max_ms = stage['max_seconds']*1000
+        return {
+            percentile:round(min(float(upper_edges[np.searchsorted(cumulative,cumulative[-1]*percentile/100)]),max_ms),3)
+            for percentile in percentiles
+        }
+
+    def report(self):
+        """
+        Returns:
+            One dict per stage, in the order the stages first ran
+        """
+        rows = []
+        for name,stage in self.stages.items():
+            percentiles = self.get_latency_percentiles(name)
+            rows.append({
+                'stage':name,
+                'calls':stage['calls'],
+                'frames':stage['frames'],
+                'wall_seconds':round(stage['wall_seconds'],6),
+                'cpu_seconds':round(stage['cpu_seconds'],6),
+                'fps':round(stage['frames']/stage['wall_seconds'],2) if stage['frames'] and stage['wall_seconds'] > 0 else None,
+                'peak_rss_mb':None if stage['peak_rss_mb'] is None else round(stage['peak_rss_mb'],1),
+                'p50_ms':percentiles[50],
+                'p95_ms':percentiles[95],
+                'p99_ms':percentiles[99],
+                'max_ms':round(stage['max_seconds']*1000,3)
+            })
+        return rows
+
+    def save(self,path):
+        """
+        Save the report as JSON (with the latency histograms) if path ends
+        with .json and as CSV otherwise
+        """
+        rows = self.report()
+        if path.endswith('.json'):
+            histograms = {
+                name:{'bin_edges_ms':LATENCY_BIN_EDGES_MS.tolist(),'counts':stage['histogram'].tolist()}
+                for name,stage in self.stages.items()
+            }
+            with open(path,'w') as f:
+                json.dump({'stages':rows,'latency_histograms':histograms},f,indent=4)
+        else:
+            with open(path,'w',newline='') as f:
+                writer = csv.DictWriter(f,fieldnames=list(rows[0]) if rows else ['stage'])
+                writer.writeheader()
+                writer.writerows(rows)
+
+    def format_report(self):
+        lines = [f"{'stage':<28}{'calls':>7}{'frames':>8}{'wall s':>9}{'cpu s':>9}{'fps':>12}{'rss MB':>9}{'p95 ms':>9}"]
+        for row in self.report():
+            fps = '' if row['fps'] is None else f"{row['fps']:.1f}"
+            rss = '' if row['peak_rss_mb'] is None else f"{row['peak_rss_mb']:.0f}"
+            lines.append(
+                f"{row['stage']:<28}{row['calls']:>7}{row['frames']:>8}{row['wall_seconds']:>9.2f}"
+                f"{row['cpu_seconds']:>9.2f}{fps:>12}{rss:>9}{row['p95_ms']:>9.1f}"
+            )
+        return '\n'.join(lines)
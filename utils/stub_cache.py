@@ -0,0 +1,139 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+def hash_file(path,block_size=1<<20):
+    """
+    Returns:
+        sha256 hex digest of a file's content
+    """
+    digest = hashlib.sha256()
+    with open(path,'rb') as f:
+        for block in iter(lambda: f.read(block_size),b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class StubCache():
+    """
+    Content-addressed cache for per-frame results (tracks, camera movement).
+
+    Results are keyed by the stage name, the sha256 of the input video, the
+    sha256 of the model weights (if any) and the stage parameters, so a
+    different video, model or setting never reuses stale results. File hashes
+    are remembered by path, size and mtime to avoid re-hashing a long match.
+
+    Layout:
+        cache_dir/<stage>/<key>/chunk_<start_frame>.npz
+        cache_dir/<stage>/<key>/complete.json
+    """
+    def __init__(self,cache_dir='stubs',chunk_size=500):
+        self.cache_dir = cache_dir
+        self.chunk_size = chunk_size
+        self.hash_index_path = os.path.join(cache_dir,'file_hashes.json')
+
+    def _load_hash_index(self):
+        # Other processes (batch workers, tracking segments) share the index,
+        # an unreadable one only costs hashing the files again
+        try:
+            with open(self.hash_index_path) as f:
+                return json.load(f)
+        except (OSError,ValueError):
+            return {}
+
+    def file_hash(self,path):
+        stat = os.stat(path)
+        index_key = os.path.abspath(path)
+        entry = self._load_hash_index().get(index_key)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['sha256']
+
+        file_hash = hash_file(path)
+        # Merge into the index as it is now, so entries other processes wrote
+        # while this file was hashed are kept, and replace it atomically
+        hash_index = self._load_hash_index()
+        hash_index[index_key] = {'size':stat.st_size,'mtime_ns':stat.st_mtime_ns,'sha256':file_hash}
+        os.makedirs(self.cache_dir,exist_ok=True)
+        tmp_path = f"{self.hash_index_path}.{os.getpid()}.tmp"
+        with open(tmp_path,'w') as f:
+            json.dump(hash_index,f,indent=4)
+        os.replace(tmp_path,self.hash_index_path)
+        return file_hash
+
+    def stage(self,name,video_path,model_path=None,params=None):
+        """
+        Returns:
+            StageCache for one stage's results on one video/model/parameters
+        """
+        key_data = {
+            'video':self.file_hash(video_path),
+            'model':self.file_hash(model_path) if model_path else None,
+            'params':params or {}
+        }
+        key = hashlib.sha256(json.dumps(key_data,sort_keys=True,default=str).encode()).hexdigest()[:32]
+        return StageCache(os.path.join(self.cache_dir,name,key),self.chunk_size,key_data)
+
+class StageCache():
+    """
+    Chunked results of one stage. Chunks are compressed .npz files of
+    columnar arrays covering chunk_size consecutive frames, written atomically,
+    so an interrupted run can resume from the last finished chunk.
+    """
+    def __init__(self,path,chunk_size,key_data=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.key_data = key_data
+        self.complete_path = os.path.join(path,'complete.json')
+
+    def is_complete(self):
+        return os.path.exists(self.complete_path)
+
+    def clear(self):
+        shutil.rmtree(self.path,ignore_errors=True)
+
+    def write_chunk(self,start_frame,num_frames,**arrays):
+        os.makedirs(self.path,exist_ok=True)
+        chunk_path = os.path.join(self.path,f'chunk_{start_frame:09d}.npz')
+        tmp_path = chunk_path+'.tmp'
+        with open(tmp_path,'wb') as f:
+            np.savez_compressed(f,start_frame=start_frame,num_frames=num_frames,**arrays)
+        os.replace(tmp_path,chunk_path)
+
+    def read_chunks(self):
+        """
+        Returns:
+            List of {array name: array} for the contiguous chunks starting at
+            frame 0, each also holding 'start_frame' and 'num_frames'
+        """
+        chunks = []
+        next_frame = 0
+        for chunk_path in sorted(glob.glob(os.path.join(self.path,'chunk_*.npz'))):
+            with np.load(chunk_path) as chunk:
+                start_frame = int(chunk['start_frame'])
+                if start_frame < next_frame:
+                    # Left over from a run with other chunk boundaries
+                    continue
+                if start_frame != next_frame:
+                    break
+                chunk = {name:chunk[name] for name in chunk.files}
+            chunks.append(chunk)
+            next_frame += int(chunk['num_frames'])
+        return chunks
+
+    def read_arrays(self):
+        """
+        Returns:
+            (number of cached frames, {array name: arrays of all chunks concatenated})
+        """
+        chunks = self.read_chunks()
+        num_frames = sum(int(chunk['num_frames']) for chunk in chunks)
+        names = [name for name in chunks[0] if name not in ('start_frame','num_frames')] if chunks else []
+        arrays = {name:np.concatenate([chunk[name] for chunk in chunks]) for name in names}
+        return num_frames,arrays
+
+    def mark_complete(self,num_frames):
+        os.makedirs(self.path,exist_ok=True)
+        with open(self.complete_path,'w') as f:
+            json.dump({'num_frames':num_frames,'key':self.key_data},f,indent=4,default=str)
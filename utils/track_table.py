@@ -0,0 +1,234 @@
+import numpy as np
+
+# Row classes, in the same order as the keys of the dict tracks
+TRACK_CLASSES = ['players','referees','ball']
+BALL_TRACK_ID = -1
+
+class TrackTable():
+    """
+    Columnar (struct-of-arrays) store for every tracked object of a match.
+
+    One row per object per frame. Rows are sorted by frame, and within a frame
+    keep the order of the dict tracks they were built from. Every column is a
+    NumPy array so that per-row stages run as one vectorized operation:
+
+        frame                (N,)   frame number
+        track_id             (N,)   track id, BALL_TRACK_ID for the ball
+        class_id             (N,)   index into TRACK_CLASSES
+        bbox                 (N, 4) x1, y1, x2, y2
+        position             (N, 2) foot position (ball: bbox center)
+        adjusted_position    (N, 2) position compensated for camera movement
+        position_transformed (N, 2) top-down position in meters, NaN if invalid
+        speed                (N,)   km/h, NaN if not measured
+        distance             (N,)   meters, NaN if not measured
+        team                 (N,)   team id, 0 if not assigned
+        has_ball             (N,)   True if the player has the ball
+
+    frame_offsets gives the rows of every frame (frame_rows), track_order and
+    track_offsets give the rows of every track (track_rows). to_tracks builds
+    the nested per-frame dict shape used by the rest of the pipeline.
+    """
+    def __init__(self,frame,track_id,class_id,bbox,num_frames=None):
+        frame = np.asarray(frame,dtype=np.int64)
+        order = np.argsort(frame,kind='stable')
+        num_rows = len(frame)
+
+        self.frame = frame[order]
+        self.track_id = np.asarray(track_id,dtype=np.int64)[order]
+        self.class_id = np.asarray(class_id,dtype=np.int8)[order]
+        self.bbox = np.asarray(bbox,dtype=np.float64).reshape(-1,4)[order]
+        self.position = np.full((num_rows,2),np.nan)
+        self.adjusted_position = np.full((num_rows,2),np.nan)
+        self.position_transformed = np.full((num_rows,2),np.nan)
+        self.speed = np.full(num_rows,np.nan)
+        self.distance = np.full(num_rows,np.nan)
+        self.team = np.zeros(num_rows,dtype=np.int8)
+        self.has_ball = np.zeros(num_rows,dtype=bool)
+
+        if num_frames is None:
+            num_frames = int(self.frame[-1])+1 if num_rows else 0
+        self.num_frames = num_frames
+
+        # Columns that have been filled, only these are exposed by to_tracks
+        self.computed = set()
+
+        self._build_index()
+
+    def __len__(self):
+        return len(self.frame)
+
+    def _build_index(self):
+        # Per-frame offsets: rows of frame f are frame_offsets[f]:frame_offsets[f+1]
+        self.frame_offsets = np.searchsorted(self.frame,np.arange(self.num_frames+1))
+
+        # Per-track offsets over rows sorted by (class, track id, frame)
+        self.track_order = np.lexsort((self.frame,self.track_id,self.class_id))
+        class_sorted = self.class_id[self.track_order]
+        track_sorted = self.track_id[self.track_order]
+        is_new_track = np.ones(len(self),dtype=bool)
+        is_new_track[1:] = (np.diff(class_sorted)!=0) | (np.diff(track_sorted)!=0)
+        track_starts = np.flatnonzero(is_new_track)
+        self.track_offsets = np.append(track_starts,len(self))
+        self.track_keys = np.stack([class_sorted[track_starts],track_sorted[track_starts]],axis=1)
+        self._track_lookup = {
+            (int(class_id),int(track_id)):track_num
+            for track_num,(class_id,track_id) in enumerate(self.track_keys)
+        }
+
+    def frame_rows(self,frame_num):
+        """
+        Returns:
+            Slice of the rows of frame_num
+        """
+        return slice(int(self.frame_offsets[frame_num]),int(self.frame_offsets[frame_num+1]))
+
+    def track_rows(self,track_id,class_name='players'):
+        """
+        Returns:
+            Row indices of one track in frame order (empty if unknown)
+        """
+        track_num = self._track_lookup.get((TRACK_CLASSES.index(class_name),int(track_id)))
+        if track_num is None:
+            return np.empty(0,dtype=np.int64)
+        return self.track_order[self.track_offsets[track_num]:self.track_offsets[track_num+1]]
+
+    def class_mask(self,class_name):
+        return self.class_id == TRACK_CLASSES.index(class_name)
+
+    @classmethod
+    def from_tracks(cls,tracks):
+        """
+        Build a table from the nested dict tracks
+        ({'players': [{track_id: {'bbox': ...}}], 'ball': [{'bbox': ...}], ...}).
+        Values already present in the dicts are copied into their columns.
+        """
+        frames,track_ids,class_ids,bboxes,infos = [],[],[],[],[]
+        num_frames = 0
+        for class_id,class_name in enumerate(TRACK_CLASSES):
+            if class_name not in tracks:
+                continue
+            num_frames = max(num_frames,len(tracks[class_name]))
+            for frame_num,frame in enumerate(tracks[class_name]):
+                if class_name == 'ball':
+                    frame_items = [(BALL_TRACK_ID,frame)] if 'bbox' in frame else []
+                else:
+                    frame_items = frame.items()
+                for track_id,track_info in frame_items:
+                    frames.append(frame_num)
+                    track_ids.append(track_id)
+                    class_ids.append(class_id)
+                    bboxes.append(track_info['bbox'])
+                    infos.append(track_info)
+
+        table = cls(frames,track_ids,class_ids,bboxes,num_frames=num_frames)
+
+        # The constructor sorts rows by frame, apply the same order to infos
+        order = np.argsort(np.asarray(frames,dtype=np.int64),kind='stable')
+        infos = [infos[row] for row in order]
+        for column in ['position','adjusted_position','position_transformed']:
+            rows = [row for row,info in enumerate(infos) if column in info]
+            if rows:
+                getattr(table,column)[rows] = [
+                    [np.nan,np.nan] if infos[row][column] is None else np.ravel(infos[row][column])[:2]
+                    for row in rows
+                ]
+                table.computed.add(column)
+        for column in ['speed','distance','team','has_ball']:
+            rows = [row for row,info in enumerate(infos) if info.get(column) is not None]
+            if rows:
+                getattr(table,column)[rows] = [infos[row][column] for row in rows]
+                table.computed.add(column)
+        return table
+
+    def to_arrays(self):
+        """
+        Returns:
+            The detection columns (frame, track_id, class_id, bbox), e.g. for
+            saving with np.savez
+        """
+        return {
+            'frame':self.frame,
+            'track_id':self.track_id,
+            'class_id':self.class_id,
+            'bbox':self.bbox
+        }
+
+    @classmethod
+    def from_arrays(cls,arrays,num_frames=None):
+        """
+        Build a table from the columns returned by to_arrays
+        """
+        return cls(arrays['frame'],arrays['track_id'],arrays['class_id'],arrays['bbox'],num_frames=num_frames)
+
+    def to_tracks(self):
+        """
+        Compatibility view: build the nested per-frame dict shape used by the
+        rest of the pipeline from the columns.
+        """
+        tracks = {class_name:[{} for _ in range(self.num_frames)] for class_name in TRACK_CLASSES}
+
+        frame = self.frame.tolist()
+        track_id = self.track_id.tolist()
+        class_id = self.class_id.tolist()
+        columns = {'bbox':self.bbox.tolist()}
+        if 'position' in self.computed:
+            columns['position'] = self.position.tolist()
+        if 'adjusted_position' in self.computed:
+            columns['adjusted_position'] = self.adjusted_position.tolist()
+        if 'position_transformed' in self.computed:
+            columns['position_transformed'] = self.position_transformed.tolist()
+        speed = self.speed.tolist()
+        distance = self.distance.tolist()
+        team = self.team.tolist()
+        has_ball = self.has_ball.tolist()
+
+        for row in range(len(self)):
+            class_name = TRACK_CLASSES[class_id[row]]
+            track_info = {'bbox':columns['bbox'][row]}
+            if 'position' in columns:
+                position = columns['position'][row]
+                if class_name == 'ball' and not np.isnan(position).any():
+                    track_info['position'] = (int(position[0]),int(position[1]))
+                else:
+                    track_info['position'] = tuple(position)
+            if 'adjusted_position' in columns:
+                track_info['adjusted_position'] = tuple(columns['adjusted_position'][row])
+            if 'position_transformed' in columns:
+                position_transformed = columns['position_transformed'][row]
+                track_info['position_transformed'] = None if np.isnan(position_transformed[0]) else position_transformed
+            if speed[row] == speed[row]:
+                track_info['speed'] = speed[row]
+            if distance[row] == distance[row]:
+                track_info['distance'] = distance[row]
+            if team[row]:
+                track_info['team'] = team[row]
+            if has_ball[row]:
+                track_info['has_ball'] = True
+
+            if class_name == 'ball':
+                tracks['ball'][frame[row]] = track_info
+            else:
+                tracks[class_name][frame[row]][track_id[row]] = track_info
+
+        return tracks
+
+    def add_positions(self):
+        """
+        Foot position (bottom center) for players and referees, bbox center
+        truncated to whole pixels for the ball, for every row at once
+        """
+        x_center = (self.bbox[:,0]+self.bbox[:,2])/2
+        is_ball = self.class_mask('ball')
+        self.position[:,0] = x_center
+        self.position[:,1] = self.bbox[:,3]
+        self.position[is_ball,0] = np.trunc(x_center[is_ball])
+        self.position[is_ball,1] = np.trunc((self.bbox[is_ball,1]+self.bbox[is_ball,3])/2)
+        self.computed.add('position')
+
+    def adjust_positions(self,camera_movement_per_frame):
+        """
+        Subtract the camera movement of each row's frame from its position
+        """
+        camera_movement = np.asarray(camera_movement_per_frame,dtype=np.float64).reshape(-1,2)
+        self.adjusted_position = self.position - camera_movement[self.frame]
+        self.computed.add('adjusted_position')
@@ -0,0 +1,333 @@
+import queue
+import threading
+import subprocess
+import cv2
+import numpy as np
+
+# Frame rate used when the source does not report one
+DEFAULT_FPS = 24.0
+
+# ffmpeg executable of the 'ffmpeg' backend
+FFMPEG_PATH = 'ffmpeg'
+
+# Marks the end of the frame stream in the reader and writer queues
+_END = object()
+
+def get_video_fps(video_path,default=DEFAULT_FPS):
+    """
+    Returns:
+        Frame rate of a video from its container, default if it reports none
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    # Streams and some containers report 0 or a bogus value
+    return fps if 0 < fps < 1000 else default
+
+def _put(target_queue,item,stop):
+    while not stop.is_set():
+        try:
+            target_queue.put(item,timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _read_into(stream,frame):
+    """
+    Fill frame with the next raw frame of stream
+    Returns:
+        False at the end of the stream (a partial last frame is dropped)
+    """
+    buffer = memoryview(frame).cast('B')
+    num_read = 0
+    while num_read < len(buffer):
+        read = stream.readinto(buffer[num_read:])
+        if not read:
+            return False
+        num_read += read
+    return True
+
+class VideoReader():
+    """
+    Decode a video on a background thread that prefetches up to queue_size
+    frames, so decoding overlaps with the processing of the earlier frames.
+
+    backend 'opencv' decodes with cv2.VideoCapture, 'ffmpeg' pipes raw BGR
+    frames out of an ffmpeg subprocess, which can decode with several threads
+    and on the GPU (hwaccel, e.g. 'auto' or 'cuda'). Iterate over the reader
+    to get the frames; leaving the loop early stops the decoder.
+    """
+    def __init__(self,video_path,start_frame=0,end_frame=None,backend='opencv',queue_size=8,threads=0,hwaccel=None):
+        """
+        Args:
+            video_path: Path to input video file
+            start_frame: First frame to decode
+            end_frame: Frame to stop before, None for the end of the video
+            backend: 'opencv' or 'ffmpeg'
+            queue_size: Frames decoded ahead of the consumer
+            threads: Decoding threads of the ffmpeg backend, 0 for automatic
+            hwaccel: Hardware decoding method of the ffmpeg backend
+        """
+        if backend not in ('opencv','ffmpeg'):
+            raise ValueError(f"Unknown video backend {backend!r}")
+        self.video_path = video_path
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.backend = backend
+        self.queue_size = queue_size
+        self.threads = threads
+        self.hwaccel = hwaccel
+
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video {video_path}")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if 0 < fps < 1000 else DEFAULT_FPS
+        self.width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+    def _opencv_frames(self):
+        cap = cv2.VideoCapture(self.video_path)
+        if self.start_frame > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES,self.start_frame)
+        try:
+            frame_num = self.start_frame
+            while self.end_frame is None or frame_num < self.end_frame:
+                ret,frame = cap.read()
+                if not ret:
+                    break
+                yield frame
+                frame_num += 1
+        finally:
+            cap.release()
+
+    def _ffmpeg_frames(self):
+        command = [FFMPEG_PATH,'-nostdin','-loglevel','error']
+        if self.hwaccel:
+            command += ['-hwaccel',self.hwaccel]
+        if self.threads:
+            command += ['-threads',str(self.threads)]
+        if self.start_frame > 0:
+            command += ['-ss',f"{self.start_frame/self.fps:.6f}"]
+        command += ['-i',self.video_path]
+        if self.end_frame is not None:
+            command += ['-frames:v',str(self.end_frame-self.start_frame)]
+        # One output frame per decoded frame, no duplicates or drops
+        command += ['-vsync','0','-f','rawvideo','-pix_fmt','bgr24','-']
+
+        process = subprocess.Popen(command,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        try:
+            while True:
+                # A new array every frame, consumers keep and draw on frames
+                frame = np.empty((self.height,self.width,3),dtype=np.uint8)
+                if not _read_into(process.stdout,frame):
+                    break
+                yield frame
+            error = process.stderr.read().decode(errors='replace').strip()
+            if process.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed to decode {self.video_path}: {error}")
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.stderr.close()
+            process.wait()
+
+    def _decode(self,frame_queue,stop):
+        frames = self._ffmpeg_frames() if self.backend == 'ffmpeg' else self._opencv_frames()
+        try:
+            for frame in frames:
+                if not _put(frame_queue,frame,stop):
+                    break
+            item = _END
+        except BaseException as e:
+            item = e
+        finally:
+            frames.close()
+        _put(frame_queue,item,stop)
+
+    def __iter__(self):
+        frame_queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._decode,args=(frame_queue,stop),daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = frame_queue.get()
+                if item is _END:
+                    break
+                if isinstance(item,BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+
+class _OpenCVEncoder():
+    def __init__(self,output_path,fps,width,height,codec=None):
+        fourcc = cv2.VideoWriter_fourcc(*(codec or 'mp4v'))
+        self.writer = cv2.VideoWriter(output_path,fourcc,fps,(width,height))
+        if not self.writer.isOpened():
+            raise RuntimeError(f"Could not open {output_path} for writing")
+
+    def write(self,frame):
+        self.writer.write(frame)
+
+    def close(self):
+        self.writer.release()
+
+class _FFmpegEncoder():
+    def __init__(self,output_path,fps,width,height,codec=None,crf=23,preset=None,threads=0):
+        command = [
+            FFMPEG_PATH,'-y','-nostdin','-loglevel','error',
+            '-f','rawvideo','-pix_fmt','bgr24','-s',f"{width}x{height}",'-r',str(fps),'-i','-',
+            '-c:v',codec or 'libx264'
+        ]
+        if crf is not None:
+            command += ['-crf',str(crf)]
+        if preset:
+            command += ['-preset',preset]
+        if threads:
+            command += ['-threads',str(threads)]
+        command += ['-pix_fmt','yuv420p',output_path]
+        self.output_path = output_path
+        self.process = subprocess.Popen(command,stdin=subprocess.PIPE,stderr=subprocess.PIPE)
+
+    def _finish(self):
+        error = self.process.stderr.read().decode(errors='replace').strip()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {self.output_path}: {error}")
+
+    def write(self,frame):
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            # ffmpeg exited, report why
+            self._finish()
+            raise
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._finish()
+
+class VideoWriter():
+    """
+    Encode frames on a background thread: write() hands a frame to the
+    encoder through a queue of queue_size frames and returns, so encoding
+    overlaps with the processing of the next frames instead of running
+    after it. Frames must not be modified once written.
+
+    backend 'opencv' writes with cv2.VideoWriter (codec is a FourCC, 'mp4v'
+    by default). 'ffmpeg' pipes raw BGR frames into an ffmpeg subprocess
+    (codec is an ffmpeg encoder, 'libx264' by default, or a hardware
+    encoder such as 'h264_nvenc' with crf=None), with a constant rate
+    factor, preset and encoder threads. The file is opened with the size of
+    the first frame.
+    """
+    def __init__(self,output_path,fps=DEFAULT_FPS,backend='opencv',codec=None,crf=23,preset=None,threads=0,
+                 queue_size=8):
+        """
+        Args:
+            output_path: Path of the video file
+            fps: Frame rate of the video, the source's to keep its timing
+            backend: 'opencv' or 'ffmpeg'
+            codec: FourCC ('opencv') or ffmpeg encoder name ('ffmpeg')
+            crf: Constant rate factor of the ffmpeg backend, lower is better
+                quality, None to leave it to the encoder
+            preset: Encoder preset of the ffmpeg backend, e.g. 'veryfast'
+            threads: Encoder threads of the ffmpeg backend, 0 for automatic
+            queue_size: Frames waiting to be encoded before write() blocks
+        """
+        if backend not in ('opencv','ffmpeg'):
+            raise ValueError(f"Unknown video backend {backend!r}")
+        self.output_path = output_path
+        self.fps = fps
+        self.backend = backend
+        self.codec = codec
+        self.crf = crf
+        self.preset = preset
+        self.threads = threads
+        self.num_frames = 0
+        self.frame_size = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._error = None
+
+    def _open(self,width,height):
+        if self.backend == 'ffmpeg':
+            return _FFmpegEncoder(self.output_path,self.fps,width,height,self.codec,self.crf,self.preset,self.threads)
+        return _OpenCVEncoder(self.output_path,self.fps,width,height,self.codec)
+
+    def _encode(self):
+        encoder = None
+        try:
+            while not self._stop.is_set():
+                try:
+                    frame = self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if frame is _END:
+                    break
+                if encoder is None:
+                    encoder = self._open(*self.frame_size)
+                encoder.write(frame)
+        except BaseException as e:
+            self._error = e
+            self._stop.set()
+        finally:
+            if encoder is not None:
+                try:
+                    encoder.close()
+                except BaseException as e:
+                    self._error = self._error or e
+
+    def write(self,frame):
+        height,width = frame.shape[:2]
+        if self.frame_size is None:
+            self.frame_size = (width,height)
+            self._thread = threading.Thread(target=self._encode,daemon=True)
+            self._thread.start()
+        elif (width,height) != self.frame_size:
+            raise ValueError(f"Frame size {width}x{height} differs from the video's "
+                             f"{self.frame_size[0]}x{self.frame_size[1]}")
+        if not _put(self._queue,frame,self._stop):
+            raise self._error or RuntimeError("Video writer is closed")
+        self.num_frames += 1
+
+    def close(self):
+        """
+        Encode the queued frames and close the file
+        """
+        if self._thread is None:
+            return
+        _put(self._queue,_END,self._stop)
+        self._thread.join()
+        self._thread = None
+        if self._error is not None:
+            raise self._error
+
+    def abort(self):
+        """
+        Stop without encoding the queued frames
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
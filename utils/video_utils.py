@@ -1,23 +1,87 @@
 import cv2
+from .video_io import VideoWriter,DEFAULT_FPS
 
-def read_video(input_video_path):
-    frames = []
+def iter_video_frames(input_video_path,start_frame=0,end_frame=None):
+    """
+    Lazily decode a video one frame at a time
+    Args:
+        input_video_path: Path to input video file
+        start_frame: First frame to decode
+        end_frame: Frame to stop before, None for the end of the video
+    Yields:
+        BGR frames in decoding order
+    """
     cap = cv2.VideoCapture(input_video_path)
-    while True:
-        ret,frame = cap.read()
-        if not ret:
-            break
-        frames.append(frame)
+    if start_frame > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES,start_frame)
+    try:
+        frame_num = start_frame
+        while end_frame is None or frame_num < end_frame:
+            ret,frame = cap.read()
+            if not ret:
+                break
+            yield frame
+            frame_num += 1
+    finally:
+        cap.release()
 
-    return frames
+def get_frame_count(input_video_path):
+    """
+    Returns:
+        Number of frames from the container header (may be approximate)
+    """
+    cap = cv2.VideoCapture(input_video_path)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return frame_count
 
-import cv2
+def read_frame(input_video_path,frame_num):
+    """
+    Decode a single frame without reading the whole video
+    Returns:
+        The frame, or None if the video has fewer frames
+    """
+    cap = cv2.VideoCapture(input_video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES,frame_num)
+    ret,frame = cap.read()
+    cap.release()
+    return frame if ret else None
 
-def save_video(frames, output_path):
-    height, width, _ = frames[0].shape
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, 24.0, (width, height))
+def batch_frames(frames,batch_size):
+    """
+    Group any iterable of frames into lists of at most batch_size frames
+    Yields:
+        (start_frame_num, list of frames)
+    """
+    batch = []
+    start_frame_num = 0
     for frame in frames:
-        out.write(frame)
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield start_frame_num,batch
+            start_frame_num += len(batch)
+            batch = []
+    if batch:
+        yield start_frame_num,batch
 
-    out.release()
+def save_video(frames, output_path, fps=DEFAULT_FPS, backend='opencv', **writer_options):
+    """
+    Write frames to a video file. frames can be a list or any iterable
+    (e.g. a generator), so the output never has to be held in memory.
+    Frames are encoded on a background thread while the next ones are
+    produced (see VideoWriter).
+    Args:
+        frames: Iterable of BGR frames
+        output_path: Path of the video file
+        fps: Frame rate of the video, pass the source's (get_video_fps)
+        backend: 'opencv' or 'ffmpeg'
+        writer_options: codec, crf, preset, threads, see VideoWriter
+    Returns:
+        Number of frames written
+    """
+    with VideoWriter(output_path, fps=fps, backend=backend, **writer_options) as writer:
+        for frame in frames:
+            writer.write(frame)
+    if not writer.num_frames:
+        raise ValueError("No frames to save")
+    return writer.num_frames
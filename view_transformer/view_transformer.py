@@ -2,6 +2,9 @@ import cv2
 import numpy as np
 import os
 import json
+import sys
+sys.path.append('../')
+from utils import TrackTable
 
 class ViewTransformer():
     def __init__(self):
@@ -37,59 +40,113 @@ class ViewTransformer():
         """
         if point is None or len(point) != 2:
             return None
-            
-        p = (int(point[0]), int(point[1]))
-        
-        # Check if point is inside the field with some tolerance
-        is_inside = cv2.pointPolygonTest(self.pixel_vertices, p, False) >= -10  # 10 pixel tolerance
-        if not is_inside:
+
+        transformed_point = self.transform_points(np.asarray(point).reshape(1, 2)).astype(np.float32)
+        if np.isnan(transformed_point[0, 0]):
             return None
+        return transformed_point
+
+    def points_in_field_polygon(self, points, tolerance=10):
+        """
+        Vectorized cv2.pointPolygonTest with a distance tolerance
+        Args:
+            points: (N, 2) array of image coordinates
+            tolerance: Pixels a point may lie outside the field corners
+        Returns:
+            (N,) boolean mask, True for points inside the polygon or closer
+            than tolerance to its edges
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        edge_start = self.pixel_vertices.astype(np.float64)
+        edge_end = np.roll(edge_start, -1, axis=0)
+        x, y = points[:, 0, None], points[:, 1, None]
+
+        # Even-odd rule over all (point, edge) pairs
+        crosses = (edge_start[:, 1] > y) != (edge_end[:, 1] > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = edge_start[:, 0] + (y - edge_start[:, 1]) * (edge_end[:, 0] - edge_start[:, 0]) / (edge_end[:, 1] - edge_start[:, 1])
+        is_inside = (crosses & (x < x_cross)).sum(axis=1) % 2 == 1
+
+        # Distance to the closest edge for the points outside
+        edge = edge_end - edge_start
+        t = ((x - edge_start[:, 0]) * edge[:, 0] + (y - edge_start[:, 1]) * edge[:, 1]) / (edge * edge).sum(axis=1)
+        t = t.clip(0, 1)
+        delta_x = x - (edge_start[:, 0] + t * edge[:, 0])
+        delta_y = y - (edge_start[:, 1] + t * edge[:, 1])
+        edge_distance = np.sqrt((delta_x * delta_x + delta_y * delta_y).min(axis=1))
+
+        return is_inside | (edge_distance <= tolerance)
+
+    def transform_points(self, points, polygon_tolerance=None):
+        """
+        Transform the positions of a whole frame or a whole match from image
+        coordinates to top-down view coordinates in meters, with a single
+        perspectiveTransform call and the validity tests as vectorized masks
+        Args:
+            points: (N, 2) array of image coordinates, NaN rows stay NaN
+            polygon_tolerance: If set, points further than this many pixels
+                outside the field corners are invalid. Off by default like in
+                the original per-point check, which compared the +1/0/-1
+                result of pointPolygonTest(..., False) with -10 and so never
+                rejected a point.
+        Returns:
+            (N, 2) float64 array of positions in meters, NaN where the point
+            is invalid
+        """
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        if len(points) == 0:
+            return np.empty((0, 2))
+
+        transformed = cv2.perspectiveTransform(points.reshape(-1, 1, 2), self.perspective_transformer)
+        transformed = transformed.reshape(-1, 2).astype(np.float64)
 
-        # Transform the point
-        reshaped_point = point.reshape(-1, 1, 2).astype(np.float32)
-        transformed_point = cv2.perspectiveTransform(reshaped_point, self.perspective_transformer)
-        
-        # Ensure the transformed point is in meters
-        transformed_point = transformed_point.reshape(-1, 2)
-        
         # Validate the transformed coordinates are within the field bounds with tolerance
-        x, y = transformed_point[0]
         tolerance = 1.0  # 1 meter tolerance
-        if not (-tolerance <= x <= self.court_length + tolerance and 
-                -tolerance <= y <= self.court_width + tolerance):
-            return None
-            
-        return transformed_point
+        x, y = transformed[:, 0], transformed[:, 1]
+        is_valid = ((-tolerance <= x) & (x <= self.court_length + tolerance) &
+                    (-tolerance <= y) & (y <= self.court_width + tolerance))
+        if polygon_tolerance is not None:
+            is_valid &= self.points_in_field_polygon(points, polygon_tolerance)
+
+        transformed[~is_valid] = np.nan
+        return transformed
 
     def add_transformed_position_to_tracks(self, tracks):
         """
-        Add transformed positions to all tracks
+        Add transformed positions to all tracks, projecting every position of
+        the match in one batch
         Args:
-            tracks: Dictionary containing track data
+            tracks: Dictionary containing track data, or a TrackTable
         Returns:
             Updated tracks with transformed positions
         """
+        if isinstance(tracks, TrackTable):
+            tracks.position_transformed = self.transform_points(tracks.position)
+            tracks.computed.add('position_transformed')
+            return tracks
+
+        # Gather the track info dicts that have a position, in one array
+        track_infos = []
         for object, object_tracks in tracks.items():
-            for frame_num, track in enumerate(object_tracks):
+            for track in object_tracks:
                 if object == 'ball':
                     # Ball track is a dictionary, not a list of dictionaries
-                    position = track.get('position')
-                    if position is not None:
-                        position = np.array(position)
-                        position_transformed = self.transform_point(position)
-                        if position_transformed is not None:
-                            position_transformed = position_transformed.squeeze().tolist()
-                        tracks[object][frame_num]['position_transformed'] = position_transformed
+                    if track.get('position') is not None:
+                        track_infos.append(track)
                 else:
                     # Players and referees are dictionaries with track IDs
-                    for track_id, track_info in track.items():
-                        position = track_info.get('position')
-                        if position is not None:
-                            position = np.array(position)
-                            position_transformed = self.transform_point(position)
-                            if position_transformed is not None:
-                                position_transformed = position_transformed.squeeze().tolist()
-                            tracks[object][frame_num][track_id]['position_transformed'] = position_transformed
+                    track_infos.extend(track_info for track_info in track.values()
+                                       if track_info.get('position') is not None)
+        if not track_infos:
+            return tracks
+
+        positions = np.array([track_info['position'] for track_info in track_infos], dtype=np.float32)
+        positions_transformed = self.transform_points(positions).astype(np.float32)
+
+        # Fill back in bulk, as lists of floats like the per-point version
+        is_valid = ~np.isnan(positions_transformed[:, 0])
+        for track_info, position_transformed, valid in zip(track_infos, positions_transformed.tolist(), is_valid.tolist()):
+            track_info['position_transformed'] = position_transformed if valid else None
 
         return tracks
 